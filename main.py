@@ -1,144 +1,191 @@
-"""Welcome to Julius!
-
-This is a simple code created to extract data from all City Transparency Portals of the state of Espírito Santo, Brazil.
-Every portal has your own API, but they have similar patterns (depends on the company that create them).
-We catalog them in 4 diferent patterns to extract data in a efficient way.
-
-You have 2 ways to execute this code. Using threads or not.
-If you choose use threading you can select how API methods (data clusters) u want extract.
-A full extract consumes 4gb of you hard disk.
-
-###############################################################
-
-Bem-vindo à Julius!
-
-Este é um código simples criado para extrair dados de todos os Portais de Transparência da Cidade do Estado do Espírito Santo, Brasil.
-Cada portal tem sua própria API, mas têm padrões semelhantes (depende da empresa que os cria).
-Nós os catalogamos em 4 padrões diferentes para extrair dados de uma maneira eficiente.
-
-Você tem 2 maneiras de executar este código. Usando ou não threads.
-Se você escolher usar threading você pode selecionar como os métodos API (clusters de dados) você quer extrair.
-Um extrato completo consome 4gb de seu disco rígido.
-
-Todos comentários estão em inglês pq a ideia é esse projeto também ser uma ferramenta de aprendizado e prática
-
-Insira a API da sua cidade e colabore para unificar as fontes de dados públicos no Brasil"""
-
-"""All starts here"""
-
-
-import scr.tectrilha as tectrilha
-import scr.agape as agape
-import sqlite3
-import scr.portaltp as portaltp
-
-
-
-def main():
-#    empresa_escolhida = str(input('Escolha qual empresa você quer rodar: \n 0: Todas \n 1: Tectrilha \n 2: Ágape \n 3: Portaltp \n '))
-#    funcao_escolhida = str(input('Escolha o que você quer fazer: \n 1: Rodar todo o script (lê apenas urls que não foram lidas ainda) \n 2: Rodar apenas as leituras com erro \n'))
-
-    empresa_escolhida = '0'
-    funcao_escolhida = '1'
-
-    if(empresa_escolhida=='1'):
-        #Conexão com o banco tectrilha
-        conn_tectrilha=sqlite3.connect('output/tectrilha.db')
-        type(conn_tectrilha)
-        cur_tectrilha = conn_tectrilha.cursor()
-        type(cur_tectrilha)
-        print('Tectrilha Connected!')
-        if(funcao_escolhida=='1'):
-            tectrilha.readData_tectrilha_Total(conn_tectrilha)
-        if(funcao_escolhida=='2'):
-            tectrilha.readData_Tectrilha_ComErro(conn_tectrilha)
-        conn_tectrilha.close()
-
-    if(empresa_escolhida=='2'):
-        #Conexão com o banco Agape
-        conn_agape=sqlite3.connect('output/agape.db')
-        type(conn_agape)
-        cur_agape = conn_agape.cursor()
-        type(cur_agape)
-        print('Agape Connected!')
-        if(funcao_escolhida=='1'):
-            agape.readData_Agape_Total(conn_agape, cur_agape)
-        if(funcao_escolhida=='2'):
-            agape.readData_Agape_ComErro(conn_agape,cur_agape)
-        conn_agape.close()
-
-    if(empresa_escolhida=='3'):
-        #Conexão com o banco portaltp
-        conn_portaltp=sqlite3.connect('output/portaltp.db')
-        type(conn_portaltp)
-        cur_portaltp = conn_portaltp.cursor()
-        type(cur_portaltp)
-        print('Portaltp Connected!')
-        if(funcao_escolhida=='1'):
-            portaltp.readData_portaltp_Total(conn_portaltp)   
-        if(funcao_escolhida=='2'):
-            portaltp.readData_Portaltp_ComErro(conn_portaltp)
-        conn_portaltp.close()
-
-    if(empresa_escolhida=='0'):
-        if(funcao_escolhida=='1'):
-            #Conexão com o banco Agape
-            print('empresa e funcao escolhidas')
-            conn_agape=sqlite3.connect('output/agape.db')
-            type(conn_agape)
-            cur_agape = conn_agape.cursor()
-            type(cur_agape)
-            print('Agape Connected!')
-            agape.readData_Agape_Total(conn_agape,cur_agape)
-            conn_agape.close()
-
-            #Conexão com o banco tectrilha
-            conn_tectrilha=sqlite3.connect('output/tectrilha.db')
-            type(conn_tectrilha)
-            cur = conn_tectrilha.cursor()
-            type(cur)
-            print('Tectrilha Connected!')
-            tectrilha.readData_tectrilha_Total(conn_tectrilha)
-            conn_tectrilha.close()
-
-            #Conexão com o banco portaltp
-            conn_portaltp=sqlite3.connect('output/portaltp.db')
-            type(conn_portaltp)
-            cur = conn_portaltp.cursor()
-            type(cur)
-            print('Portaltp Connected!')
-            portaltp.readData_portaltp_Total(conn_portaltp)
-            conn_portaltp.close()
-            
-        if(funcao_escolhida=='2'):
-            #Conexão com o banco Agape
-            conn_agape=sqlite3.connect('output/agape.db')
-            type(conn_agape)
-            cur_agape = conn_agape.cursor()
-            type(cur_agape)
-            print('Agape Connected!')
-            agape.readData_Agape_ComErro(conn_agape,cur_agape)
-            conn_agape.close()
-
-            #Conexão com o banco tectrilha
-            conn_tectrilha=sqlite3.connect('output/tectrilha.db')
-            type(conn_tectrilha)
-            cur = conn_tectrilha.cursor()
-            type(cur)
-            print('Tectrilha Connected!')
-            tectrilha.readData_Tectrilha_ComErro(conn_tectrilha)
-            conn_tectrilha.close()
-
-            #Conexão com o banco portaltp
-            conn_portaltp=sqlite3.connect('output/portaltp.db')
-            type(conn_portaltp)
-            cur = conn_portaltp.cursor()
-            type(cur)
-            print('Portaltp Connected!')
-            portaltp.readData_Portaltp_ComErro(conn_portaltp)
-            conn_portaltp.close()
-            
-  
-
-if __name__ == "__main__":
-    main()
+"""Welcome to Julius!
+
+This is a simple code created to extract data from all City Transparency Portals of the state of Espírito Santo, Brazil.
+Every portal has your own API, but they have similar patterns (depends on the company that create them).
+We catalog them in 4 diferent patterns to extract data in a efficient way.
+
+You have 2 ways to execute this code. Using threads or not.
+If you choose use threading you can select how API methods (data clusters) u want extract.
+A full extract consumes 4gb of you hard disk.
+
+###############################################################
+
+Bem-vindo à Julius!
+
+Este é um código simples criado para extrair dados de todos os Portais de Transparência da Cidade do Estado do Espírito Santo, Brasil.
+Cada portal tem sua própria API, mas têm padrões semelhantes (depende da empresa que os cria).
+Nós os catalogamos em 4 padrões diferentes para extrair dados de uma maneira eficiente.
+
+Você tem 2 maneiras de executar este código. Usando ou não threads.
+Se você escolher usar threading você pode selecionar como os métodos API (clusters de dados) você quer extrair.
+Um extrato completo consome 4gb de seu disco rígido.
+
+Todos comentários estão em inglês pq a ideia é esse projeto também ser uma ferramenta de aprendizado e prática
+
+Insira a API da sua cidade e colabore para unificar as fontes de dados públicos no Brasil"""
+
+"""All starts here
+
+Orquestrador sem menu (para cron): cada vendor roda num processo separado, em
+paralelo, e o progresso de todos sai numa linha só, lida do ledger de cada BD.
+A saída detalhada de cada vendor vai para logs/<vendor>_output.log.
+
+    python main.py --modo full --inicio 01/2024 --fim 12/2024
+    python main.py --modo continue --vendors portaltp tectrilha
+    python main.py --modo failed
+    python main.py --modo replay --inicio 01/2024 --fim 12/2024
+    python main.py --modo full --inicio 01/2024 --workers 0 --por-host 3
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from banco import contar_status, STATUS_OK, STATUS_VAZIO, STATUS_ERRO, STATUS_ADIADO
+
+VENDORS = ('portaltp', 'tectrilha', 'agape&alphatec')
+MODOS = ('full', 'failed', 'continue', 'revalidate', 'replay')
+
+# Segundos entre as linhas de progresso
+INTERVALO_PROGRESSO = 30
+
+def carregar_vendor(vendor):
+    # agape&alphatec.py não é um nome de módulo válido para import direto
+    return importlib.import_module(vendor)
+
+def executar_vendor(vendor, modo, data_inicio, data_fim, concorrencia=None):
+    """Corpo do processo de um vendor: o mesmo que as opções do menu dele fazem.
+
+    concorrencia: {'max_workers': ..., 'por_host': ...} só com o que veio da linha de comando;
+    o que faltar fica com o padrão do vendor.
+    """
+    concorrencia = concorrencia or {}
+    modulo = carregar_vendor(vendor)
+    (endpoints_file, prefeituras_file, db_file,
+     error_log_file, execution_log_file, last_run_file) = modulo.caminhos_padrao()
+    anual = vendor == 'tectrilha'
+
+    saida = open(execution_log_file.replace('_execution.log', '_output.log'), 'a', encoding='utf-8', buffering=1)
+    sys.stdout = sys.stderr = saida
+
+    start_time = time()
+    modulo.log_execution(execution_log_file, f"Orquestrador: modo {modo}")
+    if modo in ('full', 'replay'):
+        if anual:
+            data_inicio, data_fim = data_inicio[0], data_fim[0]
+        modulo.run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file,
+                              reproduzir=modo == 'replay', **concorrencia)
+    elif modo == 'failed':
+        modulo.run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file, **concorrencia)
+    elif modo == 'continue':
+        data_inicio = modulo.get_last_run(db_file, last_run_file)
+        if data_inicio is None:
+            print("\n🔴 Nenhuma execução anterior encontrada. Rode o modo full primeiro.")
+            sys.exit(2)
+        hoje = datetime.now()
+        data_fim = hoje.year if anual else (hoje.year, hoje.month)
+        modulo.run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, **concorrencia)
+    elif modo == 'revalidate':
+        data_inicio, data_fim = modulo.periodo_revalidacao()
+        modulo.run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=True,
+                              **concorrencia)
+    modulo.log_execution_time(execution_log_file, start_time)
+
+def progresso(vendor, inicio):
+    """Contagem por status dos jobs que o vendor gravou desde o início da execução"""
+    db_file = carregar_vendor(vendor).caminhos_padrao()[2]
+    if not os.path.exists(db_file):
+        return {}
+    try:
+        conn = sqlite3.connect(db_file, timeout=1)
+        try:
+            return contar_status(conn, vendor, inicio)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+def formatar_contagem(contagem):
+    rotulos = ((STATUS_OK, '✅'), (STATUS_VAZIO, '🟡'), (STATUS_ERRO, '🔴'), (STATUS_ADIADO, '⏸️'))
+    return ' '.join(f"{icone}{contagem.get(status, 0)}" for status, icone in rotulos)
+
+def formatar_tempo(segundos):
+    minutos, segundos = divmod(int(segundos), 60)
+    horas, minutos = divmod(minutos, 60)
+    return f"{horas}h{minutos:02d}m{segundos:02d}s"
+
+def ler_periodo(texto):
+    mes, ano = texto.split('/')
+    return int(ano), int(mes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Julius: extrai os portais de transparência sem menu interativo")
+    parser.add_argument('--vendors', nargs='+', choices=VENDORS, default=list(VENDORS))
+    parser.add_argument('--modo', choices=MODOS, default='continue',
+                        help="full: período dado; failed: reprocessa falhas; continue: da última data até hoje; "
+                             "revalidate: confere os períodos recentes; "
+                             "replay: reconstrói as tabelas do período a partir do arquivo, sem rede")
+    parser.add_argument('--inicio', help="MM/AAAA (modos full e replay)")
+    parser.add_argument('--fim', help="MM/AAAA (modos full e replay, padrão: mês atual)")
+    parser.add_argument('--workers', type=int,
+                        help="requisições em paralelo por vendor (0 = uma por host; padrão: o do vendor)")
+    parser.add_argument('--por-host', type=int, help="requisições simultâneas por host (padrão: o do vendor)")
+    args = parser.parse_args()
+    if args.workers is not None and args.workers < 0:
+        parser.error("--workers não pode ser negativo")
+    if args.por_host is not None and args.por_host < 1:
+        parser.error("--por-host precisa ser pelo menos 1")
+    concorrencia = {}
+    if args.workers is not None:
+        concorrencia['max_workers'] = args.workers or None
+    if args.por_host is not None:
+        concorrencia['por_host'] = args.por_host
+
+    data_inicio = data_fim = None
+    if args.modo in ('full', 'replay'):
+        if not args.inicio:
+            parser.error(f"--inicio é obrigatório no modo {args.modo}")
+        data_inicio = ler_periodo(args.inicio)
+        data_fim = ler_periodo(args.fim) if args.fim else (datetime.now().year, datetime.now().month)
+
+    inicio = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    start_time = time()
+    processos = {}
+    for vendor in args.vendors:
+        processo = multiprocessing.Process(target=executar_vendor, args=(vendor, args.modo, data_inicio, data_fim, concorrencia),
+                                           name=vendor)
+        processo.start()
+        processos[vendor] = (processo, time())
+    print(f"🚀 {len(processos)} vendors em paralelo, modo {args.modo}")
+
+    duracoes = {}
+    while len(duracoes) < len(processos):
+        for vendor, (processo, comeco) in processos.items():
+            processo.join(timeout=0)
+            if vendor not in duracoes and not processo.is_alive():
+                duracoes[vendor] = time() - comeco
+        if len(duracoes) < len(processos):
+            sleep(INTERVALO_PROGRESSO)
+            linha = ' | '.join(f"{vendor}: {formatar_contagem(progresso(vendor, inicio))}" for vendor in processos)
+            print(f"⏳ {formatar_tempo(time() - start_time)} | {linha}", flush=True)
+
+    print("\n" + "="*50)
+    print(f"RESUMO - modo {args.modo}")
+    print("="*50)
+    falhas = 0
+    for vendor, (processo, _) in processos.items():
+        icone = '✅' if processo.exitcode == 0 else '🔴'
+        falhas += processo.exitcode != 0
+        print(f"{icone} {vendor}: {formatar_contagem(progresso(vendor, inicio))} em {formatar_tempo(duracoes[vendor])}"
+              + (f" (saída {processo.exitcode})" if processo.exitcode else ''))
+    print(f"\nTempo total: {formatar_tempo(time() - start_time)}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Achatamento das respostas JSON em linhas, com um plano de campos por endpoint.
+
+O caminho antigo (json.loads, json_normalize e um apply(json.dumps) por coluna
+para as listas) gastava mais CPU que a espera da rede nos meses grandes. Aqui o
+plano (as colunas de um endpoint e o caminho de cada uma nos registros) é
+aprendido dos primeiros registros e guardado como funções encadeadas, uma por
+dicionário, que preenchem a linha seguindo só os caminhos conhecidos e
+serializam as listas no caminho. Registro com um campo fora do plano estende o
+plano, que é montado de novo.
+
+O resultado é o mesmo do caminho antigo: dicionários aninhados viram colunas
+"pai_filho" (dicionário vazio não gera coluna), listas viram o texto do
+json.dumps e as colunas seguem a ordem em que aparecem. O orjson, se instalado,
+decodifica o corpo; sem ele vale o json da biblioteca.
+"""
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SEP = '_'
+
+# Mesmo texto do json.dumps(ensure_ascii=False) do caminho antigo, sem montar um encoder por valor
+_codificar = json.JSONEncoder(ensure_ascii=False).encode
+
+# Chave ausente no registro (diferente de chave presente com null, que gera a coluna)
+_AUSENTE = object()
+
+class _ForaDoPlano(Exception):
+    pass
+
+def decodificar_json(conteudo):
+    """Objeto Python do corpo em bytes (com ou sem BOM)"""
+    if conteudo.startswith(codecs.BOM_UTF8):
+        conteudo = conteudo[len(codecs.BOM_UTF8):]
+    if orjson is not None:
+        try:
+            return orjson.loads(conteudo)
+        except orjson.JSONDecodeError:
+            pass  # ex. inteiro acima de 64 bits, que o json da biblioteca aceita
+    return json.loads(conteudo.decode('utf-8'))
+
+class _No:
+    """Uma chave do plano: vira coluna (folha), dicionário (filhos) ou os dois, conforme o registro"""
+    __slots__ = ('filhos', 'coluna')
+
+    def __init__(self):
+        self.filhos = {}
+        self.coluna = None
+
+class PlanoCampos:
+    """Colunas de um endpoint e a função montada com o plano que preenche a linha de cada registro"""
+    def __init__(self, sep=SEP):
+        self.sep = sep
+        self.raiz = _No()
+        self.colunas = []
+        self.indices = {}
+        self._preencher = None
+
+    def aprender(self, registro):
+        """Inclui no plano os campos do registro; devolve True se apareceu coluna nova"""
+        antes = len(self.colunas)
+        self._aprender(self.raiz, registro, '')
+        self._preencher = None
+        return len(self.colunas) != antes
+
+    def _aprender(self, no, registro, prefixo):
+        itens = registro.items()
+        if not prefixo:
+            # Como no json_normalize: no primeiro nível os campos aninhados entram depois dos simples
+            itens = sorted(itens, key=lambda item: isinstance(item[1], dict))
+        for chave, valor in itens:
+            filho = no.filhos.get(chave)
+            if filho is None:
+                filho = no.filhos[chave] = _No()
+            nome = f"{prefixo}{self.sep}{chave}" if prefixo else chave
+            if isinstance(valor, dict):
+                self._aprender(filho, valor, nome)
+            elif filho.coluna is None:
+                # "a_b" e a -> b dão o mesmo nome: uma coluna só, como no json_normalize
+                if nome not in self.indices:
+                    self.indices[nome] = len(self.colunas)
+                    self.colunas.append(nome)
+                filho.coluna = self.indices[nome]
+
+    def _montar(self, no):
+        """Função (dicionário, linha) que preenche a linha com os campos do nó, montada uma vez por plano"""
+        chaves = frozenset(no.filhos)
+        # (chave, coluna da folha, função dos filhos se a chave já veio como dicionário)
+        caminhos = tuple((chave, filho.coluna, self._montar(filho) if filho.filhos else None)
+                         for chave, filho in no.filhos.items())
+
+        def preencher(dicionario, linha):
+            if not dicionario.keys() <= chaves:
+                raise _ForaDoPlano
+            for chave, coluna, dentro in caminhos:
+                valor = dicionario.get(chave, _AUSENTE)
+                if valor is _AUSENTE:
+                    continue
+                if valor.__class__ is dict:
+                    if dentro is not None:
+                        dentro(valor, linha)
+                    elif valor:
+                        raise _ForaDoPlano
+                elif coluna is None:
+                    raise _ForaDoPlano
+                else:
+                    linha[coluna] = _codificar(valor) if valor.__class__ is list else valor
+        return preencher
+
+    def linhas(self, registros):
+        """Tuplas (na ordem de self.colunas) dos registros; o plano cresce com os campos novos"""
+        saida = []
+        for registro in registros:
+            linha = [None] * len(self.colunas)
+            try:
+                if self._preencher is None:
+                    raise _ForaDoPlano
+                self._preencher(registro, linha)
+            except _ForaDoPlano:
+                # Campo fora do plano: estende o plano e preenche de novo com ele, que agora cobre o registro
+                self.aprender(registro)
+                self._preencher = self._montar(self.raiz)
+                linha = [None] * len(self.colunas)
+                self._preencher(registro, linha)
+            saida.append(tuple(linha))
+        # Registros anteriores a uma coluna nova ficaram mais curtos (as colunas só crescem no fim)
+        total = len(self.colunas)
+        return [tupla if len(tupla) == total else tupla + (None,) * (total - len(tupla)) for tupla in saida]
@@ -1,44 +1,81 @@
-import requests
+import asyncio
 import pandas as pd
 from pandas import json_normalize
 import sqlite3
-from time import sleep, time
+from time import time
 import os
 from datetime import datetime
-from urllib.parse import urlparse
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from urllib.parse import urlparse, parse_qs
 import json
 
-def normalizar_url(url):
-    url = url.strip()
-    if not url.startswith('http'):
-        url = 'https://' + url.strip().lstrip('/')
-    return url.rstrip('/')
-
-def get_retry_session():
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=2, status_forcelist=[500, 502, 503, 504])
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    return session
-
-def main():
+from nucleo_http import (ClienteHTTP, Resposta, ErroHTTP, STATUS_RETRY, normalizar_url, host_da_url, executar_jobs,
+                         workers_padrao, cabecalhos_condicionais, conteudo_inalterado, falha_por_tamanho)
+from controle_host import CircuitoAberto
+from gravador import GravadorSQLite
+from prioridades import prioridade_job
+from retentativas import indice_prefeituras, reprocessar_falhas
+from cache_negativo import vazio_em_dia
+from prazos import PrazosAprendidos
+from capacidades import matriz_capacidades, periodos_permitidos, resumo_capacidades
+from snapshots import cadencias_snapshot, snapshot_em_dia, marcar_snapshot, chave_substituicao
+from arquivo_bruto import ArquivoBruto, reproduzir_jobs
+from achatador import PlanoCampos, decodificar_json
+from banco import (carregar_chaves_concluidas, criar_ledger, periodos_com_status, periodos_vazios, validadores_ledger,
+                   snapshots_ledger, janelas_ledger, ultimo_periodo, importar_log_legado, PERIODO_SNAPSHOT,
+                   STATUS_OK, STATUS_VAZIO, STATUS_ERRO, STATUS_ADIADO)
+
+VENDOR = 'agape&alphatec'
+
+MAX_WORKERS = 16
+REQUISICOES_POR_HOST = 2
+
+# Colunas que identificam um período já extraído e, nos endpoints de retrato, a prefeitura
+CHAVES = ('municipio', 'prefeitura', 'ano', 'mes')
+CHAVES_SNAPSHOT = ('municipio', 'prefeitura')
+
+# Revalidação: meses mais recentes (inclusive o atual) conferidos de novo, já que os portais revisam o passado recente
+MESES_REVALIDACAO = 3
+
+# Mês que responde 5xx (ou estoura o tempo) inteiro é pedido de novo em janelas menores,
+# nesta ordem: o mês todo e depois páginas de 1000 e de 200 linhas. A janela que funcionou
+# fica no ledger e as próximas execuções já começam nela para aquele host e endpoint
+JANELAS = ('mes', 'pagina:1000', 'pagina:200')
+PARAM_PAGINA = 'pagina'
+PARAM_TAMANHO = 'tamanho'
+MAX_PAGINAS = 1000
+# Depois de tantos meses seguidos numa janela menor, um job do host tenta de novo a janela
+# maior (o portal pode ter melhorado); se ela responde, o host sobe para ela
+SUCESSOS_PARA_SUBIR = 25
+
+# Janela em uso por (host, endpoint) na execução atual (ver janela_em_uso)
+JANELAS_EM_USO = {}
+
+# Plano de campos de cada endpoint, aprendido na primeira resposta e reaproveitado no resto da execução
+PLANOS = {}
+
+def caminhos_padrao():
+    """(endpoints, prefeituras, BD, log de erros, log de execução, last_run) do projeto"""
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     data_dir = os.path.join(base_dir, 'data')
     bds_dir = os.path.join(base_dir, 'bds')
     logs_dir = os.path.join(base_dir, 'logs')
 
-    endpoints_file = os.path.join(data_dir, 'endpoints_agape.txt')
-    prefeituras_file = os.path.join(data_dir, 'prefeituras.csv')
-    db_file = os.path.join(bds_dir, 'agape&alphatec.db')
-    error_log_file = os.path.join(logs_dir, 'agape_alphatec_errors.log')
-    execution_log_file = os.path.join(logs_dir, 'agape_alphatec_execution.log')
-    last_run_file = os.path.join(logs_dir, 'agape_alphatec_last_run.txt')
-
     os.makedirs(bds_dir, exist_ok=True)
     os.makedirs(logs_dir, exist_ok=True)
 
+    return (
+        os.path.join(data_dir, 'endpoints_agape.txt'),
+        os.path.join(data_dir, 'prefeituras.csv'),
+        os.path.join(bds_dir, 'agape&alphatec.db'),
+        os.path.join(logs_dir, 'agape_alphatec_errors.log'),
+        os.path.join(logs_dir, 'agape_alphatec_execution.log'),
+        os.path.join(logs_dir, 'agape_alphatec_last_run.txt'),
+    )
+
+def main():
+    (endpoints_file, prefeituras_file, db_file,
+     error_log_file, execution_log_file, last_run_file) = caminhos_padrao()
+
     while True:
         print("\n" + "="*50)
         print("MENU PRINCIPAL - AGAPE & ALPHATEC DATA EXTRACTOR")
@@ -46,16 +83,17 @@ def main():
         print("1. Rodar código para um período específico")
         print("2. Rodar URLs que falharam (do arquivo de log)")
         print("3. Continuar extração desde a última data")
-        print("4. Sair")
+        print(f"4. Revalidar os últimos {MESES_REVALIDACAO} meses (regrava só o que mudou)")
+        print("5. Reconstruir as tabelas de um período a partir do arquivo (sem rede)")
+        print("6. Sair")
 
-        choice = input("\nEscolha uma opção (1-4): ")
+        choice = input("\nEscolha uma opção (1-6): ")
 
         if choice == '1':
             start_time = time()
             log_execution(execution_log_file, "Opção 1: Rodar código para período específico")
             data_inicio, data_fim = get_periodo_usuario()
-            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, error_log_file)
-            save_last_run(last_run_file, data_fim)
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '2':
@@ -67,17 +105,30 @@ def main():
         elif choice == '3':
             start_time = time()
             log_execution(execution_log_file, "Opção 3: Continuar desde última data")
-            data_inicio = get_last_run(last_run_file)
+            data_inicio = get_last_run(db_file, last_run_file)
             if data_inicio is None:
                 print("\n🔴 Nenhuma execução anterior encontrada. Use a opção 1 primeiro.")
                 continue
 
             data_fim = (datetime.now().year, datetime.now().month)
-            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, error_log_file)
-            save_last_run(last_run_file, data_fim)
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '4':
+            start_time = time()
+            log_execution(execution_log_file, "Opção 4: Revalidar últimos meses")
+            data_inicio, data_fim = periodo_revalidacao()
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=True)
+            log_execution_time(execution_log_file, start_time)
+
+        elif choice == '5':
+            start_time = time()
+            log_execution(execution_log_file, "Opção 5: Reconstruir a partir do arquivo")
+            data_inicio, data_fim = get_periodo_usuario()
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, reproduzir=True)
+            log_execution_time(execution_log_file, start_time)
+
+        elif choice == '6':
             print("\nSaindo...")
             break
 
@@ -112,7 +163,33 @@ def get_periodo_usuario():
         except (ValueError, IndexError):
             print("🔴 Formato inválido. Use MM/AAAA (ex: 01/2024). Tente novamente.")
 
-def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, error_log_file):
+def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file,
+                   max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST, revalidar=False, reproduzir=False):
+    """Extrai o período. Com revalidar=True os meses já baixados também são
+    requisitados, de forma condicional, e só regravados se o conteúdo mudou.
+    Com reproduzir=True as tabelas do período são reconstruídas a partir do
+    arquivo de respostas brutas, sem rede."""
+    if reproduzir:
+        # Todos os meses do intervalo, baixados ou não; só os que estão no arquivo são reprocessados
+        jobs = planejar_extracao(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=True)
+        # O arquivo tem os meses já costurados: nada de janela herdada de uma extração anterior
+        JANELAS_EM_USO.clear()
+        asyncio.run(reproduzir_jobs(jobs, db_file, processar_job, max_workers))
+        print("\n\n✅ RECONSTRUÇÃO CONCLUÍDA!")
+        return
+
+    jobs = planejar_extracao(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar)
+    if not jobs:
+        return
+
+    max_workers = workers_padrao(jobs, max_workers)
+    print(f"🔧 {max_workers} em paralelo, {por_host} por host")
+    asyncio.run(executar_extracao(jobs, db_file, max_workers, por_host))
+
+    print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
+
+def planejar_extracao(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=False):
+    """Cria as tabelas e o ledger e devolve os jobs (um por prefeitura x endpoint x mês) ainda pendentes"""
     endpoints = load_endpoints(endpoints_file)
     prefeituras = load_prefeituras(prefeituras_file)
     prefeituras_agape = prefeituras[prefeituras['empresa'] == 'Agape']
@@ -120,15 +197,25 @@ def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_f
 
     if prefeituras_agape.empty and prefeituras_alphatec.empty:
         print("\n🔴 Nenhuma prefeitura com empresa 'Agape' ou 'Alphatec' encontrada.")
-        return
+        return []
 
-    session = get_retry_session()
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
+    criar_ledger(conn)
+    jobs = []
+    meses = generate_months_range(data_inicio, data_fim)
+    # Agape e Alphatec usam a mesma API
+    prefeituras_vendor = pd.concat([prefeituras_agape, prefeituras_alphatec])
+
+    # Endpoints de retrato: um pedido por prefeitura com o último mês, quando o retrato anterior venceu
+    cadencias, detectados = cadencias_snapshot(conn, VENDOR, {endpoint.split('/')[-1].replace('Get', '').lower(): endpoint
+                                                  for endpoint in endpoints})
+    # Endpoints que o portal recusa sempre (400/404) ficam de fora, salvo a sonda da rechecagem
+    capacidades = matriz_capacidades(conn, VENDOR)
+    resumo_capacidades(VENDOR, capacidades)
 
     for endpoint in endpoints:
         endpoint_name = endpoint.split('/')[-1].replace('Get', '').lower()
-        print(f"\n{'='*50}\n🔧 Processando endpoint: {endpoint_name}")
 
         cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS {endpoint_name} (
@@ -140,53 +227,114 @@ def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_f
             )
         ''')
         conn.commit()
+        if endpoint_name in cadencias:
+            retratos = snapshots_ledger(conn, VENDOR, endpoint_name)
+            for _, prefeitura in prefeituras_vendor.iterrows():
+                base_url = normalizar_url(prefeitura['url'])
+                host = host_da_url(base_url)
+                registro = retratos.get((host, ''))
+                if periodos_permitidos(capacidades, host, endpoint_name, meses) and (revalidar or not snapshot_em_dia(registro, cadencias[endpoint_name])):
+                    ano, mes = meses[-1]
+                    job = montar_job(f"{base_url}/{endpoint}?ano={ano}&mes={mes:02d}", endpoint_name,
+                                     prefeitura['municipio'], prefeitura['prefeitura'], ano, mes)
+                    jobs.append(marcar_snapshot(job, registro, endpoint_name in detectados))
+            continue
+        concluidos = carregar_chaves_concluidas(conn, endpoint_name, CHAVES)
+        finalizados = periodos_com_status(conn, VENDOR, endpoint_name, (STATUS_OK,))
+        vazios = periodos_vazios(conn, VENDOR, endpoint_name)
+        validadores = validadores_ledger(conn, VENDOR, endpoint_name) if revalidar else {}
+        janelas = janelas_ledger(conn, VENDOR, endpoint_name)
 
-        # Processar Agape
-        for _, prefeitura in prefeituras_agape.iterrows():
-            processar_prefeitura(session, conn, cursor, prefeitura, endpoint, endpoint_name, data_inicio, data_fim, error_log_file)
-
-        # Processar Alphatec
-        for _, prefeitura in prefeituras_alphatec.iterrows():
-            processar_prefeitura(session, conn, cursor, prefeitura, endpoint, endpoint_name, data_inicio, data_fim, error_log_file)
-
+        for _, prefeitura in prefeituras_vendor.iterrows():
+            municipio = prefeitura['municipio']
+            prefeitura_nome = prefeitura['prefeitura']
+            base_url = normalizar_url(prefeitura['url'])
+            host = host_da_url(base_url)
+
+            for ano, mes in periodos_permitidos(capacidades, host, endpoint_name, meses):
+                periodo = (host, '', f"{ano}-{mes:02d}")
+                ja_baixado = ((municipio, prefeitura_nome, ano, mes) in concluidos or periodo in finalizados
+                              or vazio_em_dia(vazios.get(periodo), ano, mes))
+                if ja_baixado and not revalidar:
+                    continue
+                job = montar_job(f"{base_url}/{endpoint}?ano={ano}&mes={mes:02d}", endpoint_name,
+                                 municipio, prefeitura_nome, ano, mes)
+                if host in janelas:
+                    job['janela'] = janelas[host]
+                if ja_baixado:
+                    job['revalidar'] = True
+                    job['validadores'] = validadores.get(periodo)
+                jobs.append(job)
+
+    # A gravação fica com o GravadorSQLite (conexão própria)
     conn.close()
-    print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
-
-def processar_resposta(response):
-    """Processa a resposta HTTP e retorna um DataFrame normalizado"""
+    print(f"\n🔧 {VENDOR}: {len(jobs)} requisições pendentes ({len(endpoints)} endpoints x "
+          f"{len(prefeituras_vendor)} prefeituras x {len(meses)} meses)")
+    return jobs
+
+async def executar_extracao(jobs, db_file, max_workers, por_host, timeout=30, retentativa=False):
+    """timeout é o padrão dos pares (host, endpoint) ainda sem histórico de latência
+    e, no reprocessamento (retentativa=True), o piso de todos"""
+    arquivo = ArquivoBruto()
+    # Cada execução parte das janelas do ledger, já atualizadas pela anterior
+    JANELAS_EM_USO.clear()
+    prazos = PrazosAprendidos.do_banco(db_file, VENDOR, timeout, retentativa)
+    print(f"⏱️ Timeouts: {prazos}")
+    with GravadorSQLite(db_file, arquivo=arquivo) as gravador:
+        async with ClienteHTTP(por_host=por_host, arquivo=arquivo) as cliente:
+            async def processar(job):
+                await processar_job(cliente, gravador, job, prazos.para(job))
+            # A fila justa alterna as prefeituras; cada host recebe no máximo por_host meses ao mesmo tempo
+            await executar_jobs(jobs, processar, max_workers, por_host, prioridade_job, cliente.disjuntores)
+        print(f"\n🔌 Pool: {cliente.estatisticas}")
+
+async def processar_job(cliente, gravador, job, timeout=30):
+    """Ponto de entrada de um job (também usado pelo agendador)"""
+    await processar_mes(cliente, gravador, job, timeout)
+
+def processar_resposta(response, endpoint_name=None):
+    """Processa a resposta HTTP e retorna um DataFrame normalizado, já com as listas em texto JSON"""
     try:
-        content = response.content.decode('utf-8-sig')
-        if not content.strip():
+        if not response.content.strip():
             return pd.DataFrame()
-        
-        dados = json.loads(content)
-        
-        # Se for uma lista de objetos
+
+        dados = decodificar_json(response.content)
+
+        # Lista de objetos: o formato de quase todos os endpoints, achatado pelo plano do endpoint
+        if isinstance(dados, list) and dados and all(item.__class__ is dict for item in dados):
+            plano = PLANOS.setdefault(endpoint_name, PlanoCampos())
+            return pd.DataFrame(plano.linhas(dados), columns=plano.colunas)
+
         if isinstance(dados, list):
             if not dados:
                 return pd.DataFrame()
-            
-            # Tenta normalizar com json_normalize do pandas
+
+            # Lista com itens que não são objetos: mantém o caminho do json_normalize
             try:
                 df = json_normalize(dados, sep='_')
-                return df
             except:
                 # Fallback para tratamento manual se json_normalize falhar
                 records = []
                 for item in dados:
                     if isinstance(item, dict):
                         records.append(flatten_dict(item))
-                if records:
-                    return pd.DataFrame(records)
-                return pd.DataFrame(dados)
-        
+                df = pd.DataFrame(records) if records else pd.DataFrame(dados)
+            return preparar_dataframe(df)
+
+        # Dicionário de colunas ({"campo": [v1, v2, ...]}) vira uma linha por posição
+        elif isinstance(dados, dict) and dados and all(isinstance(v, list) for v in dados.values()):
+            lengths = [len(v) for v in dados.values()]
+            if len(set(lengths)) > 1:
+                raise ValueError("All arrays must be of the same length")
+            return preparar_dataframe(pd.DataFrame([dict(zip(dados.keys(), values)) for values in zip(*dados.values())]))
+
         # Se for um único dicionário
         elif isinstance(dados, dict):
             return pd.DataFrame([flatten_dict(dados)])
-        
+
         # Valor simples (string, número, etc)
         else:
-            return pd.DataFrame({'valor': [dados]})
+            return preparar_dataframe(pd.DataFrame({'valor': [dados]}))
 
     except Exception as e:
         raise ValueError(f"Erro ao processar resposta: {str(e)}")
@@ -209,190 +357,215 @@ def flatten_dict(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def processar_prefeitura(session, conn, cursor, prefeitura, endpoint, endpoint_name, data_inicio, data_fim, error_log_file):
-    municipio = prefeitura['municipio']
-    prefeitura_nome = prefeitura['prefeitura']
-    base_url = normalizar_url(prefeitura['url'])
-    print(f"\n🏛️ Prefeitura: {prefeitura_nome} ({municipio})")
-
-    for ano, mes in generate_months_range(data_inicio, data_fim):
-        print(f"📅 {mes:02d}/{ano}", end=' ', flush=True)
-        
-        cursor.execute(f'''
-            SELECT 1 FROM {endpoint_name} 
-            WHERE municipio = ? AND prefeitura = ? AND ano = ? AND mes = ?
-            LIMIT 1
-        ''', (municipio, prefeitura_nome, ano, mes))
-
-        if cursor.fetchone():
-            print("✅ Já existe no BD", end=' ')
-            continue
+def montar_job(url, endpoint_name, municipio, prefeitura_nome, ano, mes):
+    return {
+        'vendor': VENDOR,
+        'url': url,
+        'host': host_da_url(url),
+        'endpoint_name': endpoint_name,
+        'municipio': municipio,
+        'prefeitura': prefeitura_nome,
+        'periodo': f"{ano}-{mes:02d}",
+        'ano': ano,
+        'mes': mes,
+    }
+
+async def processar_mes(cliente, gravador, job, timeout=30):
+    endpoint_name = job['endpoint_name']
+    prefixo = f"[{job['municipio']}] {endpoint_name} {job['mes']:02d}/{job['ano']}"
+    # Na revalidação o mês inteiro é substituído se o conteúdo mudou (no retrato, a prefeitura inteira)
+    chave = chave_substituicao(job, CHAVES, CHAVES_SNAPSHOT)
+    try:
+        validadores = job.get('validadores')
+        response = await baixar_mes(cliente, job, timeout, cabecalhos_condicionais(validadores), prefixo)
+        if chave and conteudo_inalterado(response, validadores):
+            print(f"🔁 {prefixo}: Sem mudanças")
+            if job.get('snapshot'):
+                # A cadência do retrato conta a partir desta conferência
+                await gravador.enviar(job, conferido=True)
+            return
+
+        df = processar_resposta(response, endpoint_name)
+
+        if df.empty:
+            print(f"🟡 {prefixo}: Dados vazios")
+            await gravador.enviar(job, STATUS_VAZIO, resposta=response, tabela=endpoint_name, chave=chave,
+                                  limpar=chave is not None)
+            return
+
+        # Adiciona metadados
+        df['municipio'] = job['municipio']
+        df['prefeitura'] = job['prefeitura']
+        df['ano'] = job['ano']
+        df['mes'] = job['mes']
+
+        await gravador.enviar(job, STATUS_OK, resposta=response, tabela=endpoint_name, df=df,
+                              chave=chave, limpar=chave is not None)
+        print(f"✅ {prefixo}: Dados salvos")
+
+    except CircuitoAberto as e:
+        print(f"⏸️ {prefixo}: {e}")
+        await gravador.enviar(job, STATUS_ADIADO, erro=e)
 
-        url = f"{base_url}/{endpoint}?ano={ano}&mes={mes:02d}"
+    except Exception as e:
+        print(f"🔴 {prefixo}: Erro: {type(e).__name__} - {str(e)}")
+        await gravador.enviar(job, STATUS_ERRO, erro=e)
+
+async def baixar_mes(cliente, job, timeout, cabecalhos, prefixo):
+    """O mês a partir da janela em uso no host; 5xx ou timeout passa para a janela seguinte, menor"""
+    estado = janela_em_uso(job)
+    inicio = estado[0]
+    if inicio > 0 and estado[1] >= SUCESSOS_PARA_SUBIR:
+        # Sonda: um job tenta de novo a janela maior; os outros seguem na atual até ela responder
+        inicio -= 1
+        estado[1] = 0
+    erro_tamanho = None
+    for indice in range(inicio, len(JANELAS)):
+        janela = JANELAS[indice]
         try:
-            response = session.get(url, timeout=30)
-            response.raise_for_status()
-            
-            df = processar_resposta(response)
-            
-            if df.empty:
-                print("🟡 Dados vazios", end=' ')
-                continue
-
-            # Adiciona metadados
-            df['municipio'] = municipio
-            df['prefeitura'] = prefeitura_nome
-            df['ano'] = ano
-            df['mes'] = mes
-
-            # Verifica e adapta estrutura da tabela
-            cursor.execute(f"PRAGMA table_info({endpoint_name})")
-            existing_columns = [col[1] for col in cursor.fetchall()]
-            
-            # Converte listas/dicionários para JSON string
-            for col in df.columns:
-                if df[col].apply(lambda x: isinstance(x, (list, dict))).any():
-                    df[col] = df[col].apply(lambda x: json.dumps(x, ensure_ascii=False) if isinstance(x, (list, dict)) else x)
-            
-            # Adiciona novas colunas se necessário
-            for col in df.columns:
-                if col not in existing_columns and col != 'id':
-                    col_type = 'TEXT'
-                    if pd.api.types.is_numeric_dtype(df[col]):
-                        col_type = 'REAL' if df[col].dtype == float else 'INTEGER'
-                    cursor.execute(f"ALTER TABLE {endpoint_name} ADD COLUMN {col} {col_type}")
-                    conn.commit()
-            
-            # Insere os dados
-            df.to_sql(endpoint_name, conn, if_exists='append', index=False)
-            print("✅ Dados salvos", end=' ')
-
+            if janela == JANELAS[0]:
+                response = await cliente.get(job['url'], timeout=timeout, cabecalhos=cabecalhos)
+            else:
+                response = await baixar_paginado(cliente, job, int(janela.split(':')[1]), timeout)
         except Exception as e:
-            error_msg = f"Erro: {type(e).__name__} - {str(e)}"
-            print(f"🔴 {error_msg}", end=' ')
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(error_log_file, 'a', encoding='utf-8') as f:
-                f.write(f"{timestamp}|{url}|{error_msg}\n")
-        
-        sleep(1)
-
-def log_error(log_file, url, error_msg):
-    """Registra erros no arquivo de log"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(log_file, 'a', encoding='utf-8') as f:
-        f.write(f"{timestamp}|{url}|{error_msg}\n")
-
-def run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file):
-    if not os.path.exists(error_log_file):
-        print("\n🔴 Nenhum arquivo de log de erros encontrado.")
-        return
+            if janela != JANELAS[0] and paginacao_recusada(e):
+                # PARAM_PAGINA/PARAM_TAMANHO não valem para este portal: fica o erro do mês inteiro,
+                # que a retentativa ainda resolve, e não um 400 permanente
+                if erro_tamanho is not None:
+                    raise erro_tamanho from e
+                # Janela aprendida que deixou de ser aceita: o mês inteiro de novo
+                print(f"🪟 {prefixo}: paginação recusada ({e.status}), voltando ao mês inteiro")
+                estado[:] = [0, 0]
+                response = await cliente.get(job['url'], timeout=timeout, cabecalhos=cabecalhos)
+                janela = JANELAS[0]
+                indice = 0
+                break
+            if indice == len(JANELAS) - 1 or not falha_por_tamanho(e):
+                raise
+            erro_tamanho = erro_tamanho or e
+            print(f"🪟 {prefixo}: {type(e).__name__} com janela {janela}, tentando {JANELAS[indice + 1]}")
+            continue
+        break
+    if indice == estado[0]:
+        estado[1] += 1
+    else:
+        estado[:] = [indice, 0]
+    # Gravada no ledger com o resultado: a próxima execução começa por ela
+    job['janela'] = janela
+    return response
+
+def janela_em_uso(job):
+    """[índice em JANELAS, sucessos seguidos] do host e endpoint do job, compartilhado na execução"""
+    chave = (job['host'], job['endpoint_name'])
+    if chave not in JANELAS_EM_USO:
+        inicio = JANELAS.index(job['janela']) if job.get('janela') in JANELAS else 0
+        JANELAS_EM_USO[chave] = [inicio, 0]
+    return JANELAS_EM_USO[chave]
+
+def paginacao_recusada(erro):
+    """4xx num pedido paginado: o portal não conhece os parâmetros de página"""
+    return isinstance(erro, ErroHTTP) and 400 <= erro.status < 500 and erro.status not in STATUS_RETRY
+
+def url_pagina(url, pagina, tamanho):
+    separador = '&' if '?' in url else '?'
+    return f"{url}{separador}{PARAM_PAGINA}={pagina}&{PARAM_TAMANHO}={tamanho}"
+
+async def baixar_paginado(cliente, job, tamanho, timeout):
+    """Pede o mês página a página e devolve uma Resposta só, com as linhas de todas.
+
+    O corpo costurado é arquivado sob a URL do mês: a reprodução lê o mês de uma vez.
+    """
+    registros = []
+    latencia = 0
+    anterior = None
+    for pagina in range(1, MAX_PAGINAS + 1):
+        # Só o corpo costurado é arquivado: as páginas não são resposta de nenhum job
+        response = await cliente.get(url_pagina(job['url'], pagina, tamanho), timeout=timeout, arquivar=False)
+        latencia += response.latencia
+        if response.hash == anterior:
+            break  # o portal ignora a paginação e devolveu a mesma página
+        anterior = response.hash
+        dados = response.json() if response.content.strip() else []
+        if not isinstance(dados, list):
+            if pagina == 1:
+                return response  # formato sem paginação (dicionário de colunas)
+            break
+        registros.extend(dados)
+        if len(dados) < tamanho:
+            break
+    conteudo = json.dumps(registros, ensure_ascii=False).encode('utf-8') if registros else b''
+    costurada = Resposta(job['url'], 200, {}, conteudo, latencia)
+    if cliente.arquivo is not None:
+        await asyncio.to_thread(cliente.arquivo.guardar, conteudo, costurada.hash)
+    return costurada
+
+def preparar_dataframe(df):
+    # Converte listas/dicionários para JSON string
+    for col in df.columns:
+        if df[col].apply(lambda x: isinstance(x, (list, dict))).any():
+            df[col] = df[col].apply(lambda x: json.dumps(x, ensure_ascii=False) if isinstance(x, (list, dict)) else x)
+    return df
+
+def run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file,
+                    max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST):
+    conn = sqlite3.connect(db_file)
+    criar_ledger(conn)
 
-    failed_urls = []
-    with open(error_log_file, 'r') as f:
-        for line in f:
-            partes = line.strip().split('|')
-            if len(partes) >= 2:
-                failed_urls.append(partes[1])
+    # O log de erros antigo (pipe-delimitado) é importado para o ledger uma única vez
+    prefeituras = load_prefeituras(prefeituras_file)
+    indice = indice_prefeituras(prefeituras)
+    importados = importar_log_legado(conn, error_log_file, lambda url: job_da_url(url, indice))
+    if importados:
+        print(f"\n📥 {importados} falhas do log antigo importadas para o ledger")
+
+    def executar(jobs):
+        for job in jobs:
+            if job['periodo'] == PERIODO_SNAPSHOT:
+                # O retrato foi pedido com o último mês do intervalo daquela execução
+                params = parse_qs(urlparse(job['url']).query)
+                job['ano'], job['mes'] = int(params['ano'][0]), int(params['mes'][0])
+                job['snapshot'] = True
+            else:
+                job['ano'], job['mes'] = map(int, job['periodo'].split('-'))
+        asyncio.run(executar_extracao(jobs, db_file, max_workers, por_host, timeout=60, retentativa=True))
 
-    if not failed_urls:
+    total, descartadas, restantes = reprocessar_falhas(conn, VENDOR, executar)
+    conn.close()
+    if not total:
         print("\n✅ Nenhuma URL com erro para reprocessar.")
         return
+    print(f"\n✅ Concluído! {total - descartadas - restantes}/{total} URLs reprocessadas com sucesso "
+          f"({descartadas} descartadas, {restantes} ainda com erro).")
 
-    print(f"\n🔧 Reprocessando {len(failed_urls)} URLs com erro")
-    session = get_retry_session()
-    prefeituras = load_prefeituras(prefeituras_file)
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    success_count = 0
-    temp_error_file = error_log_file + ".temp"
-
-    for url in failed_urls:
-        try:
-            print(f"🔁 Tentando novamente: {url}", end=' ', flush=True)
-            url = normalizar_url(url).replace('//', '/').replace('https:/', 'https://')
-            parsed = urlparse(url)
-            base_url = f"{parsed.scheme}://{parsed.netloc}"
-            if '?' not in url:
-                print("🟡 URL sem parâmetros. Ignorando.")
-                continue
-
-            query_params = parsed.query
-            params_dict = dict(param.split('=', 1) for param in query_params.split('&'))
-            ano = int(params_dict.get('ano', 0))
-            mes = int(params_dict.get('mes', 0))
+def job_da_url(url, indice):
+    """Monta o job a partir de uma URL do log antigo (None se não der para identificar).
 
-            prefeitura_match = prefeituras[prefeituras['url'].str.strip().apply(normalizar_url) == base_url]
-            if prefeitura_match.empty:
-                print("🟡 Prefeitura não encontrada. Ignorando.")
-                continue
-
-            prefeitura = prefeitura_match.iloc[0]
-            municipio = prefeitura['municipio']
-            prefeitura_nome = prefeitura['prefeitura']
-            endpoint_name = parsed.path.split('/')[-1].replace('Get', '').lower()
+    indice: {host: prefeitura} do indice_prefeituras.
+    """
+    url = normalizar_url(url)
+    parsed = urlparse(url)
+    if not parsed.query:
+        return None
 
-            response = session.get(url, timeout=60)
-            response.raise_for_status()
-            if not response.content.strip():
-                print("🟡 Resposta vazia. Ignorando.")
-                continue
+    params_dict = dict(param.split('=', 1) for param in parsed.query.split('&') if '=' in param)
+    try:
+        ano = int(params_dict.get('ano', 0))
+        mes = int(params_dict.get('mes', 0))
+    except ValueError:
+        return None
 
-            # Tratamento do encoding UTF-8 com BOM
-            try:
-                dados = response.json()
-            except json.JSONDecodeError:
-                dados = json.loads(response.content.decode('utf-8-sig'))
-
-            if isinstance(dados, dict):
-                if all(isinstance(v, list) for v in dados.values()):
-                    lengths = [len(v) for v in dados.values()]
-                    if len(set(lengths)) > 1:
-                        raise ValueError("All arrays must be of the same length")
-                    dados = [dict(zip(dados.keys(), values)) for values in zip(*dados.values())]
-                else:
-                    dados = [dados]
-
-            if not isinstance(dados, list):
-                raise ValueError("Formato inesperado (não é lista)")
-
-            df = pd.DataFrame(dados)
-
-            if not df.empty:
-                df['municipio'] = municipio
-                df['prefeitura'] = prefeitura_nome
-                df['ano'] = ano
-                df['mes'] = mes
-
-                cursor.execute(f"PRAGMA table_info({endpoint_name})")
-                existing_columns = [col[1] for col in cursor.fetchall()]
-
-                for column in df.columns:
-                    if column not in existing_columns and column != 'id':
-                        col_type = 'TEXT'
-                        if pd.api.types.is_numeric_dtype(df[column]):
-                            col_type = 'REAL'
-                        elif pd.api.types.is_integer_dtype(df[column]):
-                            col_type = 'INTEGER'
-                        cursor.execute(f"ALTER TABLE {endpoint_name} ADD COLUMN {column} {col_type}")
-                        conn.commit()
-
-                for col in df.columns:
-                    df[col] = df[col].apply(lambda x: json.dumps(x) if isinstance(x, (list, dict)) else x)
-
-                df.to_sql(endpoint_name, conn, if_exists='append', index=False)
-                success_count += 1
-                print("✅ Sucesso")
+    prefeitura = indice.get(host_da_url(url))
+    if prefeitura is None or not ano or not mes:
+        return None
 
-        except Exception as e:
-            print(f"🔴 Falhou novamente: {str(e)}")
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(temp_error_file, 'a') as f:
-                f.write(f"{timestamp}|{url}|{type(e).__name__}|{str(e)}\n")
-        sleep(1)
+    endpoint_name = parsed.path.split('/')[-1].replace('Get', '').lower()
+    return montar_job(url, endpoint_name, prefeitura['municipio'], prefeitura['prefeitura'], ano, mes)
 
-    conn.close()
-    os.replace(temp_error_file, error_log_file)
-    print(f"\n✅ Concluído! {success_count}/{len(failed_urls)} URLs reprocessadas com sucesso.")
+def periodo_revalidacao():
+    """Os últimos MESES_REVALIDACAO meses, inclusive o atual"""
+    hoje = datetime.now()
+    inicio = hoje.year * 12 + hoje.month - MESES_REVALIDACAO
+    return (inicio // 12, inicio % 12 + 1), (hoje.year, hoje.month)
 
 def generate_months_range(data_inicio, data_fim):
     meses = []
@@ -409,11 +582,16 @@ def generate_months_range(data_inicio, data_fim):
 
     return meses
 
-def save_last_run(last_run_file, data_fim):
-    with open(last_run_file, 'w') as f:
-        f.write(f"{data_fim[0]},{data_fim[1]}")
-
-def get_last_run(last_run_file):
+def get_last_run(db_file, last_run_file):
+    """Última data registrada no ledger; o arquivo last_run antigo serve de fallback"""
+    if os.path.exists(db_file):
+        conn = sqlite3.connect(db_file)
+        criar_ledger(conn)
+        periodo = ultimo_periodo(conn, VENDOR)
+        conn.close()
+        if periodo:
+            ano, mes = map(int, periodo.split('-'))
+            return (ano, mes)
     if not os.path.exists(last_run_file):
         return None
     with open(last_run_file, 'r') as f:
@@ -0,0 +1,95 @@
+"""Agendador único para os três vendors.
+
+Em vez de rodar portaltp, tectrilha e agape&alphatec um depois do outro (cada
+um com seu menu), os jobs de todos entram numa mesma fila justa por host e são
+atendidos por um único pool de workers: um portal lento de um vendor não segura
+o trabalho dos outros. Cada vendor continua gravando no seu próprio BD, com seu
+próprio GravadorSQLite, e o cliente HTTP (ritmo e disjuntor por host) é um só.
+"""
+import asyncio
+import importlib
+from contextlib import ExitStack
+from time import time
+
+from nucleo_http import ClienteHTTP, executar_jobs, workers_padrao
+from gravador import GravadorSQLite
+from prioridades import prioridade_job
+from arquivo_bruto import ArquivoBruto
+from prazos import PrazosAprendidos
+
+import portaltp
+import tectrilha
+agape = importlib.import_module('agape&alphatec')
+
+VENDORS = {
+    portaltp.VENDOR: portaltp,
+    tectrilha.VENDOR: tectrilha,
+    agape.VENDOR: agape,
+}
+
+# Pool global: None é um worker por host (todos os portais ao mesmo tempo, cada um no seu limite por host)
+MAX_WORKERS = None
+REQUISICOES_POR_HOST = 2
+
+def caminhos_padrao(modulo):
+    return modulo.caminhos_padrao()[:3]
+
+def planejar(vendors, data_inicio, data_fim, revalidar=False, caminhos=caminhos_padrao):
+    """{vendor: (db_file, jobs)}. A tectrilha é anual: pega os anos de data_inicio a data_fim.
+
+    caminhos(modulo) devolve (endpoints, prefeituras, BD) do vendor (ver shards).
+    """
+    planos = {}
+    for vendor in vendors:
+        modulo = VENDORS[vendor]
+        endpoints_file, prefeituras_file, db_file = caminhos(modulo)
+        if modulo is tectrilha:
+            inicio, fim = data_inicio[0], data_fim[0]
+        else:
+            inicio, fim = data_inicio, data_fim
+        jobs = modulo.planejar_extracao(inicio, fim, endpoints_file, prefeituras_file, db_file, revalidar)
+        planos[vendor] = (db_file, jobs)
+    return planos
+
+async def executar_agendador(planos, max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST, timeout=30):
+    jobs = [job for _, jobs_vendor in planos.values() for job in jobs_vendor]
+    arquivo = ArquivoBruto()
+    prazos = {vendor: PrazosAprendidos.do_banco(db_file, vendor, timeout) for vendor, (db_file, _) in planos.items()}
+    for vendor, prazos_vendor in prazos.items():
+        print(f"⏱️ {vendor}: {prazos_vendor}")
+    with ExitStack() as pilha:
+        gravadores = {vendor: pilha.enter_context(GravadorSQLite(db_file, arquivo=arquivo))
+                      for vendor, (db_file, _) in planos.items()}
+        async with ClienteHTTP(por_host=por_host, arquivo=arquivo) as cliente:
+            async def processar(job):
+                await VENDORS[job['vendor']].processar_job(cliente, gravadores[job['vendor']], job,
+                                                            prazos[job['vendor']].para(job))
+            await executar_jobs(jobs, processar, max_workers, por_host, prioridade_job, cliente.disjuntores)
+        print(f"\n🔌 Pool: {cliente.estatisticas}")
+
+def run_agendador(data_inicio, data_fim, vendors=tuple(VENDORS), max_workers=MAX_WORKERS,
+                  por_host=REQUISICOES_POR_HOST, revalidar=False):
+    start_time = time()
+    planos = planejar(vendors, data_inicio, data_fim, revalidar)
+    total = sum(len(jobs) for _, jobs in planos.values())
+    if not total:
+        print("\n✅ Nada pendente.")
+        return
+
+    max_workers = workers_padrao([job for _, jobs in planos.values() for job in jobs], max_workers)
+    print(f"\n🔧 {total} requisições de {len(planos)} vendors ({max_workers} em paralelo, {por_host} por host)")
+    asyncio.run(executar_agendador(planos, max_workers, por_host))
+
+    minutes, seconds = divmod(time() - start_time, 60)
+    print(f"\n\n✅ EXTRAÇÃO CONCLUÍDA! ({int(minutes)} minutos e {int(seconds)} segundos)")
+
+def main():
+    print("\n" + "="*50)
+    print("AGENDADOR - TODOS OS VENDORS")
+    print("="*50)
+    data_inicio, data_fim = portaltp.get_periodo_usuario()
+    concorrencia = portaltp.get_concorrencia_usuario({'max_workers': MAX_WORKERS, 'por_host': REQUISICOES_POR_HOST})
+    run_agendador(data_inicio, data_fim, **concorrencia)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Arquivo das respostas brutas, comprimidas e endereçadas pelo conteúdo.
+
+Todo corpo baixado com sucesso é gravado uma única vez em
+arquivo/blobs/<aa>/<sha256>.gz: o nome é o hash do corpo, então uma resposta
+repetida (revalidação, portal que devolve o mesmo mês de novo) não ocupa espaço
+outra vez. O gravador anota em arquivo/<vendor>.jsonl qual hash respondeu cada
+(vendor, endpoint, host, UG, período).
+
+Depois de mudar o achatamento ou o esquema, as tabelas são reconstruídas a
+partir do arquivo, sem rede (run_extraction(..., reproduzir=True)):
+ClienteArquivo responde get/get_stream do disco com a mesma cara do ClienteHTTP,
+então o caminho de parsing e gravação é exatamente o da extração.
+"""
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from nucleo_http import Resposta, TAMANHO_PEDACO, executar_jobs
+from gravador import GravadorSQLite, identificar_job
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARQUIVO_DIR = os.path.join(BASE_DIR, 'arquivo')
+
+# gzip nível 6: JSON de portal comprime ~10x e a compressão não segura o download
+NIVEL_COMPRESSAO = 6
+
+# Campos de controle do job que não descrevem a requisição
+_CAMPOS_CONTROLE = ('revalidar', 'validadores', 'fatiar', 'janela')
+
+def _nativo(valor):
+    # numpy.int64 e afins (jobs montados a partir do pandas)
+    return valor.item() if hasattr(valor, 'item') else str(valor)
+
+class ArquivoBruto:
+    """Blobs gzip por sha256 + um manifesto por vendor (uma linha JSON por resposta arquivada)"""
+    def __init__(self, diretorio=ARQUIVO_DIR):
+        self.diretorio = diretorio
+        self.blobs_dir = os.path.join(diretorio, 'blobs')
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+    def caminho(self, hash):
+        return os.path.join(self.blobs_dir, hash[:2], f"{hash}.gz")
+
+    def contem(self, hash):
+        return os.path.exists(self.caminho(hash))
+
+    def guardar(self, conteudo, hash):
+        """Grava o corpo inteiro (nada a fazer se o hash já está no arquivo)"""
+        if self.contem(hash):
+            return
+        fluxo = self.novo_fluxo()
+        try:
+            fluxo.escrever(conteudo)
+        except Exception:
+            fluxo.descartar()
+            raise
+        fluxo.concluir(hash)
+
+    def novo_fluxo(self):
+        """Blob escrito pedaço a pedaço (leitura em fluxo): o hash só é conhecido no fim"""
+        return FluxoArquivo(self)
+
+    def abrir(self, hash):
+        caminho = self.caminho(hash)
+        if not os.path.exists(caminho):
+            raise FileNotFoundError(f"Resposta {hash} não está no arquivo")
+        return gzip.open(caminho, 'rb')
+
+    def ler(self, hash):
+        with self.abrir(hash) as f:
+            return f.read()
+
+    def manifesto(self, vendor):
+        return os.path.join(self.diretorio, f"{vendor.replace('&', '_')}.jsonl")
+
+    def registrar(self, job, hash):
+        """Anota que o período do job foi respondido pelo blob hash.
+
+        Uma linha por write em modo append: processos paralelos (shards) do
+        mesmo vendor podem anotar no mesmo manifesto.
+        """
+        registro = {campo: valor for campo, valor in job.items() if campo not in _CAMPOS_CONTROLE}
+        registro['hash'] = hash
+        registro['arquivado_em'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        linha = json.dumps(registro, ensure_ascii=False, default=_nativo) + '\n'
+        with open(self.manifesto(job['vendor']), 'a', encoding='utf-8') as f:
+            f.write(linha)
+
+    def indice(self, vendor):
+        """{chave do ledger: registro} com o registro mais recente de cada período"""
+        indice = {}
+        manifesto = self.manifesto(vendor)
+        if not os.path.exists(manifesto):
+            return indice
+        with open(manifesto, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except json.JSONDecodeError:
+                    continue  # linha cortada por um processo interrompido
+                indice[identificar_job(registro)] = registro
+        return indice
+
+class FluxoArquivo:
+    """Blob em construção: arquivo temporário renomeado para o hash em concluir()"""
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        descritor, self.temporario = tempfile.mkstemp(suffix='.tmp', dir=arquivo.blobs_dir)
+        self._bruto = os.fdopen(descritor, 'wb')
+        self._gzip = gzip.GzipFile(fileobj=self._bruto, mode='wb', compresslevel=NIVEL_COMPRESSAO, mtime=0)
+
+    def escrever(self, pedaco):
+        self._gzip.write(pedaco)
+
+    def concluir(self, hash):
+        self._fechar()
+        caminho = self.arquivo.caminho(hash)
+        if os.path.exists(caminho):
+            os.remove(self.temporario)
+            return
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        os.replace(self.temporario, caminho)
+
+    def descartar(self):
+        self._fechar()
+        if os.path.exists(self.temporario):
+            os.remove(self.temporario)
+
+    def _fechar(self):
+        if not self._bruto.closed:
+            self._gzip.close()
+            self._bruto.close()
+
+class ClienteArquivo:
+    """Mesma interface do ClienteHTTP, respondendo com os corpos do arquivo (sem rede).
+
+    hashes: {url: hash} das requisições a reproduzir.
+    """
+    def __init__(self, arquivo, hashes):
+        self.arquivo = arquivo
+        self.hashes = hashes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def _hash(self, url):
+        if url not in self.hashes:
+            raise FileNotFoundError(f"{url} não está no arquivo")
+        return self.hashes[url]
+
+    async def get(self, url, timeout=None, cabecalhos=None, arquivar=True):
+        conteudo = await asyncio.to_thread(self.arquivo.ler, self._hash(url))
+        # Sem latência: a leitura do disco não diz nada do portal e não entra nos prazos aprendidos
+        return Resposta(url, 200, {}, conteudo, None)
+
+    async def get_stream(self, url, ao_receber, timeout=None, tamanho_pedaco=TAMANHO_PEDACO, cabecalhos=None):
+        hash = self._hash(url)
+        tamanho = 0
+        with self.arquivo.abrir(hash) as f:
+            while pedaco := await asyncio.to_thread(f.read, tamanho_pedaco):
+                tamanho += len(pedaco)
+                await ao_receber(pedaco)
+        return Resposta(url, 200, {}, None, None, tamanho, hash)
+
+def jobs_arquivados(arquivo, vendor, jobs):
+    """Filtra os jobs planejados aos que têm resposta no arquivo.
+
+    Devolve (jobs, {url: hash}); os jobs voltam marcados para substituir as
+    linhas do período, como na revalidação.
+    """
+    indice = arquivo.indice(vendor)
+    selecionados = []
+    hashes = {}
+    for job in jobs:
+        registro = indice.get(identificar_job(job))
+        if registro is None:
+            continue
+        job['url'] = registro['url']
+        job['revalidar'] = True
+        # Ano em fatias (tectrilha) e mês em páginas (agape&alphatec) foram arquivados já costurados
+        job.pop('fatiar', None)
+        job.pop('janela', None)
+        job['validadores'] = None
+        hashes[job['url']] = registro['hash']
+        selecionados.append(job)
+    return selecionados, hashes
+
+async def reproduzir_jobs(jobs, db_file, processar_job, max_workers, arquivo=None):
+    """Reconstrói as tabelas dos jobs a partir do arquivo. processar_job é o do vendor"""
+    arquivo = arquivo or ArquivoBruto()
+    vendor = jobs[0]['vendor'] if jobs else None
+    total = len(jobs)
+    jobs, hashes = jobs_arquivados(arquivo, vendor, jobs)
+    print(f"\n📦 {len(jobs)} de {total} períodos no arquivo: reconstruindo sem rede")
+    if not jobs:
+        return
+    with GravadorSQLite(db_file) as gravador:
+        async with ClienteArquivo(arquivo, hashes) as cliente:
+            async def processar(job):
+                await processar_job(cliente, gravador, job)
+            await executar_jobs(jobs, processar, max_workers)
@@ -0,0 +1,367 @@
+"""Funções de banco (SQLite) compartilhadas pelos extratores."""
+import os
+from datetime import datetime
+
+import pandas as pd
+
+def criar_indice_chaves(conn, tabela, colunas):
+    """Cria (se não existir) o índice composto nas colunas que identificam um período já extraído"""
+    nome_indice = f"idx_{tabela}_{'_'.join(colunas)}"
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {nome_indice} ON {tabela} ({', '.join(colunas)})")
+    conn.commit()
+
+def carregar_chaves_concluidas(conn, tabela, colunas):
+    """Carrega de uma vez as combinações de chave já presentes na tabela.
+
+    Substitui um SELECT 1 por URL: o teste de "já existe no BD" vira uma
+    consulta a um set em memória.
+    """
+    criar_indice_chaves(conn, tabela, colunas)
+    cursor = conn.execute(f"SELECT DISTINCT {', '.join(colunas)} FROM {tabela}")
+    return set(cursor.fetchall())
+
+def tipo_coluna(serie):
+    """Tipo SQLite para uma coluna nova a partir do dtype do pandas"""
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        return 'INTEGER'
+    if pd.api.types.is_numeric_dtype(serie):
+        return 'REAL'
+    return 'TEXT'
+
+class CacheEsquema:
+    """Colunas de cada tabela mantidas em memória durante toda a execução.
+
+    O PRAGMA table_info roda uma vez por tabela; as colunas que faltam num lote
+    são adicionadas juntas, numa única transação.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.colunas = {}
+
+    def colunas_da_tabela(self, tabela):
+        if tabela not in self.colunas:
+            cursor = self.conn.execute(f"PRAGMA table_info({tabela})")
+            # SQLite compara nomes de coluna sem diferenciar maiúsculas
+            self.colunas[tabela] = {col[1].lower() for col in cursor.fetchall()}
+        return self.colunas[tabela]
+
+    def garantir_colunas(self, tabela, df):
+        existentes = self.colunas_da_tabela(tabela)
+        faltando = {}
+        for column in df.columns:
+            if column != 'id' and column.lower() not in existentes and column.lower() not in faltando:
+                faltando[column.lower()] = (column, tipo_coluna(df[column]))
+        if not faltando:
+            return
+
+        # Dentro de uma transação aberta por quem chamou (gravador), o commit fica com ela
+        propria = not self.conn.in_transaction
+        if propria:
+            self.conn.execute("BEGIN")
+        try:
+            for column, col_type in faltando.values():
+                self.conn.execute(f'ALTER TABLE {tabela} ADD COLUMN "{column}" {col_type}')
+            if propria:
+                self.conn.commit()
+        except Exception:
+            if propria:
+                self.conn.rollback()
+            # O cache pode ter ficado desatualizado: relê na próxima vez
+            self.colunas.pop(tabela, None)
+            raise
+        existentes.update(faltando)
+
+    def invalidar(self):
+        """Descarta o cache (depois de um rollback que desfez ALTER TABLEs)"""
+        self.colunas.clear()
+
+# Livro-razão (ledger) de coleta: uma linha por (vendor, endpoint, host, UG, período)
+STATUS_OK = 'ok'
+STATUS_VAZIO = 'vazio'
+STATUS_ERRO = 'erro'
+STATUS_ADIADO = 'adiado'
+# Resposta grande sendo gravada em lotes: se o processo cair, o período fica pela metade
+STATUS_PARCIAL = 'parcial'
+# Falha permanente (400, 404, erro de gravação...): fica registrada, mas não volta para a fila
+STATUS_DESCARTADO = 'descartado'
+
+# Período dos endpoints de retrato (ver snapshots): uma linha no ledger por host/UG, não por mês
+PERIODO_SNAPSHOT = 'snapshot'
+
+def criar_ledger(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
+            vendor TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            host TEXT NOT NULL,
+            unidadegestora TEXT NOT NULL DEFAULT '',
+            periodo TEXT NOT NULL,
+            url TEXT,
+            municipio TEXT,
+            prefeitura TEXT,
+            status TEXT NOT NULL,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            http_status INTEGER,
+            erro TEXT,
+            latencia REAL,
+            bytes INTEGER,
+            linhas INTEGER,
+            hash TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            janela TEXT,
+            criado_em TEXT,
+            atualizado_em TEXT,
+            PRIMARY KEY (vendor, endpoint, host, unidadegestora, periodo)
+        )
+    ''')
+    # Ledgers criados antes dos validadores de conteúdo (e da janela de requisição)
+    existentes = {col[1] for col in conn.execute("PRAGMA table_info(crawl_jobs)").fetchall()}
+    for coluna in ('hash', 'etag', 'last_modified', 'janela'):
+        if coluna not in existentes:
+            conn.execute(f"ALTER TABLE crawl_jobs ADD COLUMN {coluna} TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crawl_jobs_status ON crawl_jobs (vendor, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crawl_jobs_periodo ON crawl_jobs (vendor, periodo)")
+    conn.commit()
+
+SQL_LEDGER = '''
+    INSERT INTO crawl_jobs (vendor, endpoint, host, unidadegestora, periodo, url, municipio, prefeitura,
+                            status, tentativas, http_status, erro, latencia, bytes, linhas,
+                            hash, etag, last_modified, janela, criado_em, atualizado_em)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (vendor, endpoint, host, unidadegestora, periodo) DO UPDATE SET
+        url = excluded.url,
+        status = excluded.status,
+        tentativas = crawl_jobs.tentativas + excluded.tentativas,
+        http_status = excluded.http_status,
+        erro = excluded.erro,
+        latencia = COALESCE(excluded.latencia, crawl_jobs.latencia),
+        bytes = excluded.bytes,
+        linhas = excluded.linhas,
+        hash = COALESCE(excluded.hash, crawl_jobs.hash),
+        etag = COALESCE(excluded.etag, crawl_jobs.etag),
+        last_modified = COALESCE(excluded.last_modified, crawl_jobs.last_modified),
+        janela = COALESCE(excluded.janela, crawl_jobs.janela),
+        atualizado_em = excluded.atualizado_em
+'''
+
+# Importação do log antigo: cada falha entra com a data dela no log e vale a mais recente,
+# do log ou do ledger (período que falhou e depois deu certo fica como está)
+SQL_LEDGER_LEGADO = SQL_LEDGER + '    WHERE excluded.atualizado_em >= crawl_jobs.atualizado_em\n'
+
+def linha_ledger(job, status, resposta=None, erro=None, linhas=None):
+    """Parâmetros do SQL_LEDGER para o resultado de um job.
+
+    job é o dicionário montado pelos extratores (vendor, endpoint_name, host,
+    periodo, url, municipio, prefeitura e, na tectrilha, unidadegestora). A
+    janela (agape&alphatec) só é gravada quando o período veio com sucesso.
+    """
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Job adiado pelo disjuntor não chegou a fazer requisição; o parcial é a mesma tentativa do resultado final
+    tentativa = 0 if status in (STATUS_ADIADO, STATUS_PARCIAL) else 1
+    http_status = resposta.status_code if resposta is not None else getattr(erro, 'status', None)
+    # Falha não apaga os validadores do último conteúdo bom (COALESCE no upsert)
+    hash = etag = last_modified = janela = None
+    if resposta is not None and status in (STATUS_OK, STATUS_VAZIO):
+        hash = resposta.hash
+        etag = resposta.headers.get('ETag')
+        last_modified = resposta.headers.get('Last-Modified')
+        janela = job.get('janela')
+    return (
+        job['vendor'], job['endpoint_name'], job['host'], str(job.get('unidadegestora', '')), job['periodo'],
+        job['url'], job['municipio'], job['prefeitura'],
+        status, tentativa, http_status,
+        descrever_erro(erro),
+        resposta.latencia if resposta is not None else None,
+        resposta.tamanho if resposta is not None else None,
+        linhas, hash, etag, last_modified, janela, agora, agora,
+    )
+
+# Conteúdo conferido e inalterado: só a data (e a tentativa) do ledger mudam
+SQL_CONFERIDO = '''
+    UPDATE crawl_jobs SET tentativas = tentativas + 1, atualizado_em = ?
+    WHERE vendor = ? AND endpoint = ? AND host = ? AND unidadegestora = ? AND periodo = ?
+'''
+
+def linha_conferido(job):
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return (agora, job['vendor'], job['endpoint_name'], job['host'], str(job.get('unidadegestora', '')), job['periodo'])
+
+def registrar_job(conn, job, status, resposta=None, erro=None, linhas=None):
+    """Grava (upsert) o resultado de um job no ledger, fora do gravador"""
+    conn.execute(SQL_LEDGER, linha_ledger(job, status, resposta, erro, linhas))
+    conn.commit()
+
+def descrever_erro(erro):
+    if erro is None or isinstance(erro, str):
+        return erro
+    return f"{type(erro).__name__}: {erro}"
+
+def periodos_com_status(conn, vendor, endpoint, status):
+    """Set de (host, unidadegestora, periodo) do endpoint com algum dos status dados"""
+    marcadores = ', '.join('?' for _ in status)
+    cursor = conn.execute(f'''
+        SELECT host, unidadegestora, periodo FROM crawl_jobs
+        WHERE vendor = ? AND endpoint = ? AND status IN ({marcadores})
+    ''', (vendor, endpoint, *status))
+    return set(cursor.fetchall())
+
+def periodos_vazios(conn, vendor, endpoint):
+    """{(host, unidadegestora, periodo): atualizado_em} dos períodos que vieram vazios (cache negativo)"""
+    cursor = conn.execute('''
+        SELECT host, unidadegestora, periodo, atualizado_em FROM crawl_jobs
+        WHERE vendor = ? AND endpoint = ? AND status = ? AND periodo != ?
+    ''', (vendor, endpoint, STATUS_VAZIO, PERIODO_SNAPSHOT))
+    return {linha[:3]: linha[3] for linha in cursor.fetchall()}
+
+def validadores_ledger(conn, vendor, endpoint):
+    """{(host, unidadegestora, periodo): (hash, etag, last_modified)} dos períodos já baixados com sucesso"""
+    cursor = conn.execute('''
+        SELECT host, unidadegestora, periodo, hash, etag, last_modified FROM crawl_jobs
+        WHERE vendor = ? AND endpoint = ? AND status IN (?, ?)
+    ''', (vendor, endpoint, STATUS_OK, STATUS_VAZIO))
+    return {linha[:3]: linha[3:] for linha in cursor.fetchall()}
+
+def snapshots_ledger(conn, vendor, endpoint):
+    """{(host, unidadegestora): (atualizado_em, hash, etag, last_modified)} dos retratos já baixados"""
+    cursor = conn.execute('''
+        SELECT host, unidadegestora, atualizado_em, hash, etag, last_modified FROM crawl_jobs
+        WHERE vendor = ? AND endpoint = ? AND periodo = ? AND status IN (?, ?)
+    ''', (vendor, endpoint, PERIODO_SNAPSHOT, STATUS_OK, STATUS_VAZIO))
+    return {linha[:2]: linha[2:] for linha in cursor.fetchall()}
+
+def endpoints_conteudo_repetido(conn, vendor, min_periodos, min_hosts):
+    """Endpoints em que todo host/UG com min_periodos ou mais períodos baixados recebeu sempre o mesmo corpo.
+
+    Precisa de min_hosts hosts distintos assim: um portal só (quebrado, devolvendo uma
+    página fixa) não decide pelo vendor inteiro. Corpo vazio não conta.
+    """
+    cursor = conn.execute('''
+        SELECT endpoint FROM (
+            SELECT endpoint, host, COUNT(*) AS periodos, COUNT(DISTINCT hash) AS corpos FROM crawl_jobs
+            WHERE vendor = ? AND status = ? AND hash IS NOT NULL AND periodo != ?
+              AND bytes > 0 AND (linhas IS NULL OR linhas > 0)
+            GROUP BY endpoint, host, unidadegestora
+        )
+        WHERE periodos >= ?
+        GROUP BY endpoint
+        HAVING MAX(corpos) = 1 AND COUNT(DISTINCT host) >= ?
+    ''', (vendor, STATUS_OK, PERIODO_SNAPSHOT, min_periodos, min_hosts))
+    return {linha[0] for linha in cursor.fetchall()}
+
+def jobs_para_reprocessar(conn, vendor, status=(STATUS_ERRO, STATUS_ADIADO, STATUS_PARCIAL)):
+    """Jobs do ledger que falharam ou foram adiados, já no formato de job dos extratores"""
+    marcadores = ', '.join('?' for _ in status)
+    cursor = conn.execute(f'''
+        SELECT vendor, endpoint, host, unidadegestora, periodo, url, municipio, prefeitura, status, erro, http_status
+        FROM crawl_jobs
+        WHERE vendor = ? AND status IN ({marcadores})
+    ''', (vendor, *status))
+    colunas = ['vendor', 'endpoint_name', 'host', 'unidadegestora', 'periodo', 'url', 'municipio', 'prefeitura',
+               'status', 'erro', 'http_status']
+    return [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+
+def descartar_jobs(conn, jobs):
+    """Marca como descartados os jobs (do jobs_para_reprocessar) com falha permanente"""
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany('''
+        UPDATE crawl_jobs SET status = ?, atualizado_em = ?
+        WHERE vendor = ? AND endpoint = ? AND host = ? AND unidadegestora = ? AND periodo = ?
+    ''', [(STATUS_DESCARTADO, agora, job['vendor'], job['endpoint_name'], job['host'],
+           str(job['unidadegestora']), job['periodo']) for job in jobs])
+    conn.commit()
+
+def maiores_respostas(conn, vendor, endpoint):
+    """{(host, unidadegestora): maior resposta em bytes} do endpoint"""
+    cursor = conn.execute('''
+        SELECT host, unidadegestora, MAX(bytes) FROM crawl_jobs
+        WHERE vendor = ? AND endpoint = ? AND bytes IS NOT NULL
+        GROUP BY host, unidadegestora
+    ''', (vendor, endpoint))
+    return {linha[:2]: linha[2] for linha in cursor.fetchall()}
+
+def janelas_ledger(conn, vendor, endpoint):
+    """{host: janela} com a janela do período baixado com sucesso mais recente de cada host"""
+    cursor = conn.execute('''
+        SELECT host, janela FROM crawl_jobs
+        WHERE vendor = ? AND endpoint = ? AND status IN (?, ?) AND janela IS NOT NULL
+        ORDER BY atualizado_em
+    ''', (vendor, endpoint, STATUS_OK, STATUS_VAZIO))
+    return dict(cursor.fetchall())
+
+def latencias_ledger(conn, vendor):
+    """Lista de (host, endpoint, latência) das respostas bem-sucedidas do vendor.
+
+    Latência zero (reprodução do arquivo gravada antes de ficar nula) não é medida de rede.
+    """
+    cursor = conn.execute('''
+        SELECT host, endpoint, latencia FROM crawl_jobs
+        WHERE vendor = ? AND status IN (?, ?) AND latencia > 0
+    ''', (vendor, STATUS_OK, STATUS_VAZIO))
+    return cursor.fetchall()
+
+def endpoints_servidos(conn, vendor):
+    """Set de (host, endpoint) que já responderam com sucesso (com ou sem linhas) alguma vez"""
+    cursor = conn.execute('''
+        SELECT DISTINCT host, endpoint FROM crawl_jobs
+        WHERE vendor = ? AND status IN (?, ?)
+    ''', (vendor, STATUS_OK, STATUS_VAZIO))
+    return set(cursor.fetchall())
+
+def falhas_ledger(conn, vendor):
+    """Falhas registradas do vendor (erro ou descartado), uma por período, com o que houver do erro"""
+    cursor = conn.execute('''
+        SELECT host, endpoint, unidadegestora, periodo, status, http_status, erro, tentativas, atualizado_em
+        FROM crawl_jobs
+        WHERE vendor = ? AND status IN (?, ?)
+    ''', (vendor, STATUS_ERRO, STATUS_DESCARTADO))
+    colunas = ['host', 'endpoint_name', 'unidadegestora', 'periodo', 'status', 'http_status', 'erro', 'tentativas',
+               'atualizado_em']
+    return [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+
+def contar_status(conn, vendor, desde=None):
+    """{status: quantidade} dos jobs do vendor atualizados a partir de desde ('AAAA-MM-DD HH:MM:SS')"""
+    cursor = conn.execute('''
+        SELECT status, COUNT(*) FROM crawl_jobs
+        WHERE vendor = ? AND atualizado_em >= ?
+        GROUP BY status
+    ''', (vendor, desde or ''))
+    return dict(cursor.fetchall())
+
+def ultimo_periodo(conn, vendor):
+    """Maior período já registrado no ledger para o vendor (None se não houver)"""
+    linha = conn.execute("SELECT MAX(periodo) FROM crawl_jobs WHERE vendor = ? AND periodo != ?",
+                         (vendor, PERIODO_SNAPSHOT)).fetchone()
+    return linha[0] if linha else None
+
+def importar_log_legado(conn, error_log_file, job_da_url):
+    """Importa uma única vez o log de erros antigo (timestamp|url|tipo|mensagem) para o ledger.
+
+    job_da_url(url) monta o job do extrator ou devolve None se a URL não for
+    reconhecida. O log é renomeado para .importado depois da importação.
+    """
+    if not os.path.exists(error_log_file):
+        return 0
+
+    linhas = []
+    with open(error_log_file, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            partes = line.strip().split('|')
+            if len(partes) < 2:
+                continue
+            job = job_da_url(partes[1])
+            if job is None:
+                continue
+            linha = linha_ledger(job, STATUS_ERRO, erro=': '.join(partes[2:4]))
+            try:
+                datetime.strptime(partes[0], "%Y-%m-%d %H:%M:%S")
+                linha = linha[:-2] + (partes[0], partes[0])  # criado_em e atualizado_em: quando falhou
+            except ValueError:
+                pass
+            linhas.append(linha)
+
+    # Um commit só: o log antigo tem milhares de linhas
+    conn.executemany(SQL_LEDGER_LEGADO, linhas)
+    conn.commit()
+    os.replace(error_log_file, error_log_file + '.importado')
+    return len(linhas)
@@ -0,0 +1,39 @@
+"""Cache negativo: períodos que vieram vazios não são pedidos de novo até vencerem.
+
+Resposta vazia e resposta sem linhas ficam no ledger com status vazio. O
+planejamento pula esses períodos enquanto o registro estiver dentro do prazo,
+que depende da idade que o período tinha quando veio vazio: o mês corrente
+ainda pode ganhar dados a qualquer dia, um mês de um ano e pouco atrás já está
+fechado e o vazio vale para sempre.
+"""
+from datetime import datetime, timedelta
+
+# (idade máxima do período em meses, validade do vazio); acima da última faixa o vazio é permanente
+TTL_POR_IDADE = (
+    (0, timedelta(days=1)),
+    (2, timedelta(days=7)),
+    (12, timedelta(days=30)),
+)
+
+def ttl_vazio(ano, mes=12, hoje=None):
+    """Validade do vazio de um período (None = permanente). Períodos anuais contam a partir de dezembro"""
+    hoje = hoje or datetime.now()
+    idade = (hoje.year * 12 + hoje.month) - (int(ano) * 12 + int(mes))
+    for idade_maxima, ttl in TTL_POR_IDADE:
+        if idade <= idade_maxima:
+            return ttl
+    return None
+
+def vazio_em_dia(atualizado_em, ano, mes=12, hoje=None):
+    """Se o vazio registrado em atualizado_em (linha de periodos_vazios) ainda vale.
+
+    A faixa é a da idade do período quando o vazio foi registrado: um mês que
+    veio vazio ainda aberto vence pelo prazo daquela faixa, mesmo que hoje já
+    seja antigo. Só é permanente o vazio de um período que já estava fechado.
+    """
+    if atualizado_em is None:
+        return False
+    hoje = hoje or datetime.now()
+    registrado = datetime.strptime(atualizado_em, "%Y-%m-%d %H:%M:%S")
+    ttl = ttl_vazio(ano, mes, registrado)
+    return ttl is None or registrado > hoje - ttl
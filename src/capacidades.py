@@ -0,0 +1,71 @@
+"""Matriz de capacidades: quais endpoints cada portal (host) de fato atende.
+
+Nem todo portal implementa todos os endpoints do arquivo de endpoints (ou de
+assuntos, na tectrilha); os que não existem respondiam 400/404 em todo mês de
+toda execução. A matriz é tirada do ledger, que já é persistente:
+
+- suportado: o (host, endpoint) já respondeu com sucesso (com ou sem linhas);
+- sem suporte: nunca respondeu e foi recusado com status permanente
+  (STATUS_PERMANENTES) em MIN_RECUSAS tentativas ou mais;
+- desconhecido: o resto (ainda sem resposta conclusiva), planejado normalmente.
+
+O planejamento não cria jobs para um endpoint sem suporte. Depois de
+RECHECAGEM_DIAS da última recusa vai uma sonda (só o último período) para
+conferir se o portal passou a atender; se responder, a próxima execução
+planeja todos os períodos de novo.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from banco import endpoints_servidos, falhas_ledger
+from retentativas import classificar_falha
+
+SUPORTADO = 'suportado'
+SEM_SUPORTE = 'sem_suporte'
+DESCONHECIDO = 'desconhecido'
+
+MIN_RECUSAS = 2
+RECHECAGEM_DIAS = 90
+
+def matriz_capacidades(conn, vendor):
+    """{(host, endpoint): (estado, última recusa)} dos pares com histórico no ledger"""
+    servidos = endpoints_servidos(conn, vendor)
+    recusas = defaultdict(int)
+    ultima_recusa = {}
+    for falha in falhas_ledger(conn, vendor):
+        classe, permanente = classificar_falha(falha)
+        # Erro de gravação também é permanente, mas não diz nada sobre o portal
+        if not (permanente and classe.startswith('HTTP ')):
+            continue
+        chave = (falha['host'], falha['endpoint_name'])
+        recusas[chave] += falha['tentativas'] or 1
+        ultima_recusa[chave] = max(ultima_recusa.get(chave, ''), falha['atualizado_em'] or '')
+
+    matriz = {chave: (SUPORTADO, None) for chave in servidos}
+    for chave, quantidade in recusas.items():
+        if chave in matriz:
+            continue
+        estado = SEM_SUPORTE if quantidade >= MIN_RECUSAS else DESCONHECIDO
+        matriz[chave] = (estado, ultima_recusa[chave])
+    return matriz
+
+def rechecagem_vencida(ultima_recusa, agora=None):
+    if not ultima_recusa:
+        return True
+    agora = agora or datetime.now()
+    return datetime.strptime(ultima_recusa, "%Y-%m-%d %H:%M:%S") <= agora - timedelta(days=RECHECAGEM_DIAS)
+
+def periodos_permitidos(matriz, host, endpoint_name, periodos):
+    """Os períodos a planejar: todos, nenhum (sem suporte) ou só o último (sonda da rechecagem)"""
+    estado, ultima_recusa = matriz.get((host, endpoint_name), (DESCONHECIDO, None))
+    if estado != SEM_SUPORTE:
+        return periodos
+    return periodos[-1:] if rechecagem_vencida(ultima_recusa) else []
+
+def resumo_capacidades(vendor, matriz):
+    sem_suporte = [chave for chave, (estado, ultima) in matriz.items()
+                   if estado == SEM_SUPORTE and not rechecagem_vencida(ultima)]
+    sondas = sum(1 for estado, ultima in matriz.values() if estado == SEM_SUPORTE and rechecagem_vencida(ultima))
+    if sem_suporte or sondas:
+        print(f"🧭 {vendor}: {len(sem_suporte)} pares (host, endpoint) sem suporte fora do planejamento"
+              f"{f', {sondas} em rechecagem' if sondas else ''}")
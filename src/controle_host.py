@@ -0,0 +1,205 @@
+"""Controle de ritmo por host (netloc) usado pelo núcleo HTTP.
+
+Cada portal tem seu próprio balde de tokens. A taxa sobe devagar enquanto a
+latência e a taxa de erro ficam baixas e cai pela metade em 429/5xx/timeout.
+Um Retry-After pausa o host pelo tempo pedido.
+
+O disjuntor (circuit breaker) de cada host abre depois de algumas falhas de
+conexão seguidas: os jobs restantes daquele host ficam na fila (ver
+nucleo_http.FilaJusta) em vez de gastar timeout + backoff cada um, e depois da
+espera um deles sai como sonda e testa o host de novo. Se a execução acabar
+antes, os que sobraram são adiados.
+"""
+import asyncio
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from time import monotonic
+
+# Requisições por segundo por host: começa no ritmo antigo (sleep(1)) e se adapta
+TAXA_INICIAL = 1.0
+TAXA_MINIMA = 0.1
+TAXA_MAXIMA = 10.0
+INCREMENTO = 0.25
+FATOR_REDUCAO = 0.5
+
+# Limites para considerar o host saudável (médias móveis exponenciais)
+LATENCIA_ALVO = 2.0
+ERRO_ALVO = 0.05
+PESO_MEDIA = 0.2
+
+STATUS_SOBRECARGA = {429, 500, 502, 503, 504}
+
+# Disjuntor: falhas de conexão seguidas para abrir e espera (s) até a próxima sonda
+FALHAS_PARA_ABRIR = 5
+ESPERA_DISJUNTOR = 300
+ESPERA_MAXIMA_DISJUNTOR = 3600
+
+def interpretar_retry_after(valor):
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera"""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+        return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class BaldeTokens:
+    """Token bucket de um host com taxa ajustada por AIMD"""
+    def __init__(self, taxa=TAXA_INICIAL):
+        self.taxa = taxa
+        self.tokens = 1.0
+        self.atualizado = monotonic()
+        self.pausado_ate = 0.0
+        self.latencia_media = 0.0
+        self.erro_medio = 0.0
+        self._lock = asyncio.Lock()
+
+    def _reabastecer(self):
+        agora = monotonic()
+        capacidade = max(1.0, self.taxa)
+        self.tokens = min(capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    async def aguardar(self):
+        # O lock mantém a ordem de chegada: quem chegou primeiro sai primeiro
+        async with self._lock:
+            while True:
+                agora = monotonic()
+                if agora < self.pausado_ate:
+                    await asyncio.sleep(self.pausado_ate - agora)
+                    continue
+                self._reabastecer()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.taxa)
+
+    def registrar(self, status=None, latencia=None, retry_after=None):
+        """Atualiza as médias com o resultado de uma requisição (status None = falha de rede)"""
+        falhou = status is None or status in STATUS_SOBRECARGA
+        self.erro_medio += PESO_MEDIA * ((1.0 if falhou else 0.0) - self.erro_medio)
+        if latencia is not None:
+            self.latencia_media += PESO_MEDIA * (latencia - self.latencia_media)
+
+        if retry_after is not None:
+            self.pausado_ate = max(self.pausado_ate, monotonic() + retry_after)
+
+        if falhou:
+            self.taxa = max(TAXA_MINIMA, self.taxa * FATOR_REDUCAO)
+            self.tokens = min(self.tokens, 0.0)
+        elif self.latencia_media < LATENCIA_ALVO and self.erro_medio < ERRO_ALVO:
+            self.taxa = min(TAXA_MAXIMA, self.taxa + INCREMENTO)
+
+class LimitadorHosts:
+    """Um BaldeTokens por netloc, criado sob demanda"""
+    def __init__(self, taxa_inicial=TAXA_INICIAL):
+        self.taxa_inicial = taxa_inicial
+        self.baldes = {}
+
+    def balde(self, host):
+        if host not in self.baldes:
+            self.baldes[host] = BaldeTokens(self.taxa_inicial)
+        return self.baldes[host]
+
+    async def aguardar(self, host):
+        await self.balde(host).aguardar()
+
+    def registrar(self, host, status=None, latencia=None, retry_after=None):
+        self.balde(host).registrar(status, latencia, retry_after)
+
+class CircuitoAberto(Exception):
+    """O host está com o disjuntor aberto: a requisição foi adiada, não falhou"""
+    def __init__(self, host):
+        self.host = host
+        super().__init__(f"Circuito aberto para {host}: requisição adiada")
+
+class Disjuntor:
+    """Disjuntor de um host: fechado -> aberto -> semiaberto (uma sonda) -> fechado"""
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    SEMIABERTO = 'semiaberto'
+
+    def __init__(self, falhas_para_abrir=FALHAS_PARA_ABRIR, espera=ESPERA_DISJUNTOR):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.espera_inicial = espera
+        self.espera = espera
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.sondando = False
+
+    def permitir(self):
+        if self.estado == self.ABERTO and monotonic() >= self.aberto_ate:
+            self.estado = self.SEMIABERTO
+            self.sondando = False
+        if self.estado == self.FECHADO:
+            return True
+        if self.estado == self.SEMIABERTO and not self.sondando:
+            self.sondando = True
+            return True
+        return False
+
+    def espera_restante(self):
+        """Segundos até deixar passar a sonda; 0 se já deixa passar; None com a sonda em andamento"""
+        if self.estado == self.ABERTO:
+            return max(0.0, self.aberto_ate - monotonic())
+        if self.estado == self.SEMIABERTO and self.sondando:
+            return None
+        return 0.0
+
+    def registrar_sucesso(self):
+        """O host respondeu (qualquer status): conexão funciona"""
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self.espera = self.espera_inicial
+        self.sondando = False
+
+    def registrar_falha_conexao(self):
+        self.falhas += 1
+        if self.estado == self.SEMIABERTO:
+            # A sonda falhou: volta a abrir, esperando mais a cada vez
+            self.espera = min(ESPERA_MAXIMA_DISJUNTOR, self.espera * 2)
+            self._abrir()
+        elif self.falhas >= self.falhas_para_abrir:
+            self._abrir()
+
+    def _abrir(self):
+        self.estado = self.ABERTO
+        self.aberto_ate = monotonic() + self.espera
+        self.sondando = False
+
+class DisjuntoresHosts:
+    """Um Disjuntor por netloc, criado sob demanda"""
+    def __init__(self, falhas_para_abrir=FALHAS_PARA_ABRIR, espera=ESPERA_DISJUNTOR):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.espera = espera
+        self.disjuntores = {}
+
+    def disjuntor(self, host):
+        if host not in self.disjuntores:
+            self.disjuntores[host] = Disjuntor(self.falhas_para_abrir, self.espera)
+        return self.disjuntores[host]
+
+    def permitir(self, host):
+        return self.disjuntor(host).permitir()
+
+    def espera_restante(self, host):
+        if host not in self.disjuntores:
+            return 0.0
+        return self.disjuntores[host].espera_restante()
+
+    def registrar_sucesso(self, host):
+        self.disjuntor(host).registrar_sucesso()
+
+    def registrar_falha_conexao(self, host):
+        disjuntor = self.disjuntor(host)
+        estado_anterior = disjuntor.estado
+        disjuntor.registrar_falha_conexao()
+        if disjuntor.estado == Disjuntor.ABERTO and estado_anterior != Disjuntor.ABERTO:
+            print(f"⛔ Disjuntor aberto para {host} ({disjuntor.falhas} falhas de conexão seguidas, "
+                  f"nova tentativa em {int(disjuntor.espera)}s)")
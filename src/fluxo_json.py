@@ -0,0 +1,94 @@
+"""Decodificação incremental de respostas JSON grandes.
+
+Os endpoints que devolvem um array de objetos são lidos pedaço a pedaço: cada
+elemento completo sai assim que chega, e o texto já consumido é descartado.
+Assim a memória fica limitada ao lote em montagem, e não ao payload inteiro.
+Respostas que não são array (objeto, valor simples) são acumuladas e
+decodificadas de uma vez no final.
+"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_ESPACOS = ' \t\n\r'
+_DELIMITADORES = _ESPACOS + ',]'
+
+class DecodificadorArray:
+    """Recebe bytes com alimentar() e devolve os elementos do array já completos"""
+    def __init__(self):
+        self._texto = codecs.getincrementaldecoder('utf-8-sig')()
+        self._buffer = ''
+        self._pos = 0
+        self._estado = 'inicio'  # inicio -> primeiro -> elemento <-> separador -> fim | inteiro
+
+    def alimentar(self, dados):
+        self._buffer += self._texto.decode(dados)
+        return self._extrair(final=False)
+
+    def finalizar(self):
+        """Fecha o fluxo; levanta ValueError se o JSON estiver incompleto ou inválido"""
+        self._buffer += self._texto.decode(b'', final=True)
+        if self._estado == 'inteiro':
+            texto = self._buffer.strip()
+            if not texto:
+                return []
+            dados = json.loads(texto)
+            return dados if isinstance(dados, list) else [dados]
+        elementos = self._extrair(final=True)
+        if self._estado == 'inicio' and not self._buffer[self._pos:].strip():
+            return elementos  # corpo vazio
+        if self._estado != 'fim':
+            raise ValueError("JSON incompleto: o array não foi fechado")
+        return elementos
+
+    def _pular_espacos(self):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _ESPACOS:
+            self._pos += 1
+
+    def _extrair(self, final):
+        elementos = []
+        if self._estado == 'inteiro':
+            return elementos  # não é array: acumula até o finalizar
+        while True:
+            self._pular_espacos()
+            if self._pos >= len(self._buffer):
+                break
+            c = self._buffer[self._pos]
+            if self._estado == 'inicio':
+                if c != '[':
+                    self._estado = 'inteiro'
+                    break
+                self._pos += 1
+                self._estado = 'primeiro'
+            elif self._estado == 'primeiro' and c == ']':
+                self._pos += 1
+                self._estado = 'fim'
+            elif self._estado == 'separador':
+                if c == ',':
+                    self._pos += 1
+                    self._estado = 'elemento'
+                elif c == ']':
+                    self._pos += 1
+                    self._estado = 'fim'
+                else:
+                    raise ValueError(f"JSON inválido: esperado ',' ou ']' e veio {c!r}")
+            elif self._estado in ('primeiro', 'elemento'):
+                try:
+                    elemento, fim = _decoder.raw_decode(self._buffer, self._pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    break  # elemento ainda incompleto: espera mais bytes
+                # Um número no fim do buffer (ou seguido de '.', 'e'...) pode continuar no próximo pedaço
+                if not final and (fim >= len(self._buffer) or self._buffer[fim] not in _DELIMITADORES):
+                    break
+                elementos.append(elemento)
+                self._pos = fim
+                self._estado = 'separador'
+            else:  # fim
+                raise ValueError("JSON inválido: dados depois do fim do array")
+
+        if self._estado != 'inteiro' and self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return elementos
@@ -0,0 +1,208 @@
+"""Estágio de gravação: uma única thread escreve no SQLite.
+
+Os extratores só fazem rede e parsing. Cada resultado (linhas + linha do ledger)
+entra numa fila limitada, e o gravador a esvazia em transações grandes com
+executemany, em modo WAL. Assim o fsync do SQLite nunca segura as requisições:
+enquanto a fila tem espaço os fetchers seguem; se ela enche, eles esperam
+(contrapressão) em vez de acumular memória.
+"""
+import asyncio
+import queue
+import sqlite3
+import threading
+
+from banco import (CacheEsquema, SQL_LEDGER, SQL_CONFERIDO, linha_ledger, linha_conferido,
+                   STATUS_OK, STATUS_VAZIO, STATUS_ERRO)
+from nucleo_http import STATUS_NAO_MODIFICADO
+
+# Resultados aguardando gravação e linhas por transação
+TAMANHO_FILA = 256
+LINHAS_POR_TRANSACAO = 50000
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64 MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+_FIM = object()
+
+def abrir_conexao(db_file):
+    """Conexão em modo autocommit (as transações são explícitas) com os pragmas de escrita"""
+    conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def linhas_sqlite(df):
+    """Linhas do DataFrame como tuplas de tipos nativos (NaN vira NULL)"""
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+def identificar_job(job):
+    """Chave primária do job no ledger"""
+    return (job['vendor'], job['endpoint_name'], job['host'], str(job.get('unidadegestora', '')), job['periodo'])
+
+class GravadorSQLite:
+    """Thread gravadora com fila limitada. Uso:
+
+        with GravadorSQLite(db_file) as gravador:
+            await gravador.enviar(job, STATUS_OK, resposta=response, tabela=endpoint_name, df=df)
+    """
+    def __init__(self, db_file, tamanho_fila=TAMANHO_FILA, linhas_por_transacao=LINHAS_POR_TRANSACAO, arquivo=None):
+        self.db_file = db_file
+        # ArquivoBruto onde o cliente guardou os corpos: o gravador anota o período de cada um
+        self.arquivo = arquivo
+        self.linhas_por_transacao = linhas_por_transacao
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.erro = None
+        self.gravados = 0
+        self._thread = None
+        # Jobs cuja gravação falhou: os lotes seguintes deles são descartados
+        self._descartados = set()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._executar, name='gravador-sqlite', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.fila.put(_FIM)
+        self._thread.join()
+        if self.erro is not None and exc[0] is None:
+            raise self.erro
+
+    async def enviar(self, job, status=None, resposta=None, erro=None, tabela=None, df=None, linhas=None,
+                     chave=None, limpar=False, conferido=False):
+        """Enfileira o resultado de um job; espera (sem travar o event loop) se a fila estiver cheia.
+
+        Para respostas gravadas em vários lotes (leitura em fluxo): status None
+        grava só as linhas, chave ({coluna: valor}) identifica as linhas do
+        período em tabela e limpar=True apaga essas linhas antes de inserir.
+        conferido=True só atualiza a data do job no ledger (conteúdo inalterado).
+        """
+        if self.erro is not None:
+            raise self.erro
+        if linhas is None:
+            linhas = len(df) if df is not None else (0 if resposta is not None else None)
+        ledger = None
+        if conferido:
+            ledger = (SQL_CONFERIDO, linha_conferido(job))
+        elif status is not None:
+            ledger = (SQL_LEDGER, linha_ledger(job, status, resposta, erro, linhas))
+        # A linha do manifesto do arquivo também fica com a thread gravadora (append em disco)
+        arquivar = None
+        if (self.arquivo is not None and status in (STATUS_OK, STATUS_VAZIO) and resposta is not None
+                and resposta.hash is not None and resposta.status_code != STATUS_NAO_MODIFICADO):
+            arquivar = resposta.hash
+        item = (job, tabela, df, ledger, chave, limpar, arquivar)
+        try:
+            self.fila.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self.fila.put, item)
+
+    def _executar(self):
+        conn = abrir_conexao(self.db_file)
+        esquema = CacheEsquema(conn)
+        fim = False
+        try:
+            while not fim:
+                lote, fim = self._proximo_lote()
+                if lote:
+                    self._gravar_lote(conn, esquema, lote)
+        except Exception as e:
+            self.erro = e
+            # Continua esvaziando a fila para nenhum fetcher ficar preso no put (o _FIM pode ter vindo no lote)
+            while not fim:
+                fim = self.fila.get() is _FIM
+        finally:
+            conn.close()
+
+    def _proximo_lote(self):
+        """Junta itens até o limite de linhas ou até a fila esvaziar"""
+        item = self.fila.get()
+        if item is _FIM:
+            return [], True
+        lote = [item]
+        linhas = len(item[2]) if item[2] is not None else 0
+        while linhas < self.linhas_por_transacao:
+            try:
+                item = self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is _FIM:
+                return lote, True
+            lote.append(item)
+            linhas += len(item[2]) if item[2] is not None else 0
+        return lote, False
+
+    def _gravar_lote(self, conn, esquema, lote):
+        try:
+            conn.execute("BEGIN")
+            for item in lote:
+                self._aplicar(conn, esquema, item)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            esquema.invalidar()
+            # Refaz item a item: só o job problemático fica com erro
+            for item in lote:
+                self._gravar_item(conn, esquema, item)
+            return
+        self.gravados += len(lote)
+        for item in lote:
+            self._arquivar(item)
+
+    def _gravar_item(self, conn, esquema, item):
+        try:
+            conn.execute("BEGIN")
+            self._aplicar(conn, esquema, item)
+            conn.commit()
+            self.gravados += 1
+        except sqlite3.Error as e:
+            conn.rollback()
+            esquema.invalidar()
+            job, tabela, _, _, chave, _, _ = item
+            print(f"🔴 [{job['municipio']}] {job['endpoint_name']} {job['periodo']}: ERRO ao gravar: {e}")
+            self._descartados.add(identificar_job(job))
+            self._registrar_falha(conn, job, tabela, chave, e)
+            return
+        self._arquivar(item)
+
+    def _registrar_falha(self, conn, job, tabela, chave, erro):
+        """Erro do job no ledger; se nem isso grava (disco cheio, banco travado), a thread segue com os outros"""
+        try:
+            conn.execute("BEGIN")
+            if chave:
+                # Lotes anteriores do mesmo período já gravados não podem ficar pela metade
+                self._apagar(conn, tabela, chave)
+            conn.execute(SQL_LEDGER, linha_ledger(job, STATUS_ERRO, erro=erro))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"🔴 [{job['municipio']}] {job['endpoint_name']} {job['periodo']}: ERRO ao registrar a falha: {e}")
+
+    def _arquivar(self, item):
+        """Anota no manifesto o corpo do job, depois que as linhas dele foram gravadas"""
+        job, arquivar = item[0], item[6]
+        if arquivar is not None and not (self._descartados and identificar_job(job) in self._descartados):
+            self.arquivo.registrar(job, arquivar)
+
+    def _aplicar(self, conn, esquema, item):
+        job, tabela, df, ledger, chave, limpar, _ = item
+        if self._descartados and identificar_job(job) in self._descartados:
+            return
+        if limpar:
+            self._apagar(conn, tabela, chave)
+        if df is not None and not df.empty:
+            esquema.garantir_colunas(tabela, df)
+            colunas = ', '.join(f'"{col}"' for col in df.columns)
+            marcadores = ', '.join('?' for _ in df.columns)
+            conn.executemany(f'INSERT INTO {tabela} ({colunas}) VALUES ({marcadores})', linhas_sqlite(df))
+        if ledger is not None:
+            conn.execute(*ledger)
+
+    def _apagar(self, conn, tabela, chave):
+        condicao = ' AND '.join(f'"{col}" = ?' for col in chave)
+        conn.execute(f'DELETE FROM {tabela} WHERE {condicao}', tuple(chave.values()))
@@ -0,0 +1,392 @@
+"""Núcleo HTTP assíncrono compartilhado pelos extratores.
+
+Todos os extratores (portaltp, tectrilha e agape&alphatec) fazem as requisições
+por aqui: uma única sessão aiohttp com reaproveitamento de conexões, timeout e
+retentativas por requisição, um limite de requisições simultâneas por host e um
+ritmo adaptativo e um disjuntor por host (ver controle_host).
+Assim milhares de requisições podem ficar em voo no mesmo event loop e o gargalo
+passa a ser o portal, não o Python esperando socket.
+
+Com um ArquivoBruto (ver arquivo_bruto), todo corpo baixado também é guardado
+comprimido em disco.
+"""
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict, deque
+from time import monotonic
+from urllib.parse import urlparse
+
+import aiohttp
+
+from controle_host import LimitadorHosts, DisjuntoresHosts, CircuitoAberto, interpretar_retry_after
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36'
+
+TIMEOUT_PADRAO = 30
+TIMEOUT_CONEXAO = 10
+TENTATIVAS = 3
+BACKOFF = 2
+STATUS_RETRY = {429, 500, 502, 503, 504}
+STATUS_NAO_MODIFICADO = 304
+
+# Falhas que indicam host inalcançável (contam para o disjuntor)
+ERROS_CONEXAO = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+# Limite global de conexões abertas e padrão de requisições simultâneas por host
+LIMITE_CONEXOES = 2000
+POR_HOST = 2
+
+# Leitura em fluxo: bytes pedidos ao socket por vez
+TAMANHO_PEDACO = 64 * 1024
+
+# Pool de conexões: um socket ocioso fica aberto por KEEPALIVE segundos, então os
+# meses seguintes do mesmo portal reaproveitam a conexão (e a sessão TLS já
+# negociada) em vez de pagar um handshake novo; o DNS de cada host fica em cache
+KEEPALIVE = 60
+TTL_DNS = 600
+
+try:
+    import brotli  # noqa: F401  (com o pacote instalado o aiohttp decodifica br)
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+def cabecalhos_condicionais(validadores):
+    """If-None-Match / If-Modified-Since a partir dos validadores (hash, etag, last_modified) do ledger"""
+    if not validadores:
+        return None
+    _, etag, last_modified = validadores
+    cabecalhos = {}
+    if etag:
+        cabecalhos['If-None-Match'] = etag
+    if last_modified:
+        cabecalhos['If-Modified-Since'] = last_modified
+    return cabecalhos or None
+
+def conteudo_inalterado(resposta, validadores):
+    """304, ou corpo com o mesmo hash do último download (portal que ignora os cabeçalhos condicionais)"""
+    if resposta.status_code == STATUS_NAO_MODIFICADO:
+        return True
+    return bool(validadores) and resposta.hash is not None and resposta.hash == validadores[0]
+
+def normalizar_url(url):
+    url = url.strip()
+    if not url.startswith('http'):
+        url = 'https://' + url.strip().lstrip('/')
+    return url.rstrip('/')
+
+def host_da_url(url):
+    return urlparse(url).netloc.lower()
+
+class ErroHTTP(Exception):
+    """Resposta com status de erro (4xx/5xx) depois de esgotadas as tentativas"""
+    def __init__(self, status, url, motivo=''):
+        self.status = status
+        self.url = url
+        motivo = f" {motivo}" if motivo else ''
+        super().__init__(f"{status}{motivo} for url: {url}")
+
+class Resposta:
+    """Resposta já lida por completo, com a mesma cara da Response do requests.
+
+    Nas respostas lidas em fluxo (get_stream) content é None e só o tamanho e
+    o hash ficam. O hash (sha256 do corpo) serve para detectar mudança de conteúdo.
+    """
+    def __init__(self, url, status, headers, content, latencia, tamanho=None, hash=None):
+        self.url = url
+        self.status_code = status
+        self.headers = headers
+        self.content = content
+        self.latencia = latencia
+        self.tamanho = len(content) if content is not None else tamanho
+        self.hash = hashlib.sha256(content).hexdigest() if content is not None else hash
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8-sig'))
+
+def falha_por_tamanho(erro):
+    """Falhas que um pedido menor pode evitar: timeout, 5xx, resposta cortada no meio"""
+    if isinstance(erro, ErroHTTP):
+        return erro.status >= 500
+    if isinstance(erro, ERROS_CONEXAO):
+        return False  # host fora do ar: dividir o pedido só multiplicaria as falhas
+    return isinstance(erro, (asyncio.TimeoutError, aiohttp.ClientError, LeituraInterrompida))
+
+class Prazo:
+    """Orçamento de tempo de uma requisição, com conexão e leitura separadas (segundos).
+
+    No get a leitura é o limite da resposta inteira; no get_stream, de cada pedaço.
+    """
+    def __init__(self, conexao, leitura):
+        self.conexao = conexao
+        self.leitura = leitura
+
+    @classmethod
+    def de(cls, timeout):
+        """Aceita um Prazo ou o timeout único de antes (a conexão fica limitada a TIMEOUT_CONEXAO)"""
+        if isinstance(timeout, cls):
+            return timeout
+        return cls(min(timeout, TIMEOUT_CONEXAO), timeout)
+
+    def __repr__(self):
+        return f"Prazo(conexao={self.conexao:g}s, leitura={self.leitura:g}s)"
+
+class LeituraInterrompida(Exception):
+    """A conexão caiu ou deu timeout no meio de um corpo lido em fluxo (sem retentativa)"""
+
+class EstatisticasPool:
+    """Acertos e faltas do pool de conexões e do cache de DNS (ganchos de trace do aiohttp)"""
+    def __init__(self):
+        self.reaproveitadas = 0
+        self.novas = 0
+        self.dns_cache = 0
+        self.dns_resolvidos = 0
+
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        def contar(atributo):
+            async def gancho(session, contexto, params):
+                setattr(self, atributo, getattr(self, atributo) + 1)
+            return gancho
+
+        trace.on_connection_reuseconn.append(contar('reaproveitadas'))
+        trace.on_connection_create_end.append(contar('novas'))
+        trace.on_dns_cache_hit.append(contar('dns_cache'))
+        trace.on_dns_cache_miss.append(contar('dns_resolvidos'))
+        return trace
+
+    @property
+    def taxa_reaproveitamento(self):
+        total = self.reaproveitadas + self.novas
+        return self.reaproveitadas / total if total else 0.0
+
+    def __str__(self):
+        return (f"{self.reaproveitadas} conexões reaproveitadas e {self.novas} novas "
+                f"({self.taxa_reaproveitamento:.0%} de reaproveitamento); "
+                f"DNS: {self.dns_cache} do cache, {self.dns_resolvidos} resolvidos")
+
+class ClienteHTTP:
+    """Sessão aiohttp compartilhada com limite de concorrência por host.
+
+    O pool do conector tem por_host conexões por host, o mesmo limite do
+    semáforo: cada requisição em andamento tem seu socket, e nenhum sobra.
+    """
+    def __init__(self, por_host=POR_HOST, limite=LIMITE_CONEXOES, timeout=TIMEOUT_PADRAO,
+                 tentativas=TENTATIVAS, backoff=BACKOFF, limitador=None, disjuntores=None, arquivo=None):
+        self.por_host = por_host
+        self.limite = limite
+        self.timeout = timeout
+        self.tentativas = tentativas
+        self.backoff = backoff
+        self.limitador = limitador or LimitadorHosts()
+        self.disjuntores = disjuntores or DisjuntoresHosts()
+        self.arquivo = arquivo
+        self.estatisticas = EstatisticasPool()
+        self.session = None
+        self._semaforos = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limite, limit_per_host=self.por_host,
+                                         ttl_dns_cache=TTL_DNS, keepalive_timeout=KEEPALIVE)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             headers={'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING},
+                                             trace_configs=[self.estatisticas.trace_config()])
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _semaforo(self, host):
+        if host not in self._semaforos:
+            self._semaforos[host] = asyncio.Semaphore(self.por_host)
+        return self._semaforos[host]
+
+    async def get(self, url, timeout=None, cabecalhos=None, arquivar=True):
+        """GET com timeout (número ou Prazo) por requisição e retentativas em 429/5xx, timeout e falha de conexão.
+
+        Levanta CircuitoAberto se o disjuntor do host estiver aberto. Com
+        cabecalhos condicionais a resposta pode vir 304 (sem corpo). Com
+        arquivar=False o corpo não vai para o arquivo (partes de uma resposta
+        que é arquivada já costurada).
+        """
+        prazo = Prazo.de(timeout or self.timeout)
+        timeout = aiohttp.ClientTimeout(total=prazo.leitura, sock_connect=prazo.conexao)
+
+        async def ler(response):
+            return await response.read(), None, None
+
+        resposta = await self._requisitar(url, timeout, ler, cabecalhos)
+        if arquivar and self.arquivo is not None and resposta.status_code != STATUS_NAO_MODIFICADO:
+            await asyncio.to_thread(self.arquivo.guardar, resposta.content, resposta.hash)
+        return resposta
+
+    async def get_stream(self, url, ao_receber, timeout=None, tamanho_pedaco=TAMANHO_PEDACO, cabecalhos=None):
+        """GET lendo o corpo em pedaços: await ao_receber(bytes) a cada pedaço.
+
+        O timeout vale por pedaço lido (sock_read), não pela resposta inteira:
+        payloads grandes não estouram enquanto continuarem chegando. Depois que o
+        primeiro pedaço foi entregue não há retentativa e a falha vira
+        LeituraInterrompida. Devolve uma Resposta sem content.
+        """
+        prazo = Prazo.de(timeout or self.timeout)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=prazo.conexao, sock_read=prazo.leitura)
+
+        async def ler(response):
+            tamanho = 0
+            hash = hashlib.sha256()
+            # Comprimir 64 KB é rápido o bastante para ficar no event loop
+            arquivar = self.arquivo is not None and response.status != STATUS_NAO_MODIFICADO
+            fluxo = self.arquivo.novo_fluxo() if arquivar else None
+            try:
+                async for pedaco in response.content.iter_chunked(tamanho_pedaco):
+                    tamanho += len(pedaco)
+                    hash.update(pedaco)
+                    if fluxo is not None:
+                        fluxo.escrever(pedaco)
+                    await ao_receber(pedaco)
+            except BaseException as e:
+                if fluxo is not None:
+                    fluxo.descartar()
+                if not isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)) or not tamanho:
+                    raise
+                raise LeituraInterrompida(f"{type(e).__name__} depois de {tamanho} bytes: {e}") from e
+            if fluxo is not None:
+                fluxo.concluir(hash.hexdigest())
+            return None, tamanho, hash.hexdigest()
+
+        return await self._requisitar(url, timeout, ler, cabecalhos)
+
+    async def _requisitar(self, url, timeout, ler, cabecalhos=None):
+        """Laço de tentativas comum a get e get_stream; ler(response) lê o corpo de um 2xx/3xx"""
+        host = host_da_url(url)
+        async with self._semaforo(host):
+            for tentativa in range(self.tentativas + 1):
+                if not self.disjuntores.permitir(host):
+                    raise CircuitoAberto(host)
+                await self.limitador.aguardar(host)
+                inicio = monotonic()
+                try:
+                    async with self.session.get(url, timeout=timeout, headers=cabecalhos) as response:
+                        # O ritmo do host se guia pelo tempo até os cabeçalhos, que não depende do tamanho do corpo
+                        self.disjuntores.registrar_sucesso(host)
+                        retry_after = interpretar_retry_after(response.headers.get('Retry-After'))
+                        self.limitador.registrar(host, response.status, monotonic() - inicio, retry_after)
+                        if response.status in STATUS_RETRY and tentativa < self.tentativas:
+                            await asyncio.sleep(max(self.backoff * 2 ** tentativa, retry_after or 0))
+                            continue
+                        if response.status >= 400:
+                            raise ErroHTTP(response.status, url, response.reason or '')
+                        content, tamanho, hash = await ler(response)
+                        return Resposta(url, response.status, response.headers, content, monotonic() - inicio,
+                                        tamanho, hash)
+                except ERROS_CONEXAO:
+                    self.disjuntores.registrar_falha_conexao(host)
+                    self.limitador.registrar(host, None, monotonic() - inicio)
+                    if tentativa >= self.tentativas:
+                        raise
+                    await asyncio.sleep(self.backoff * 2 ** tentativa)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    # Conectou mas não completou: o host existe, só está lento
+                    self.disjuntores.registrar_sucesso(host)
+                    self.limitador.registrar(host, None, monotonic() - inicio)
+                    if tentativa >= self.tentativas:
+                        raise
+                    await asyncio.sleep(self.backoff * 2 ** tentativa)
+
+class FilaJusta:
+    """Uma subfila por host, atendidas em rodízio.
+
+    Um host que já tem por_host jobs em andamento fica de fora até liberar
+    um: os workers vão para outros hosts em vez de ficarem parados no
+    semáforo de um portal lento. Com disjuntores, o host de disjuntor aberto
+    também fica de fora até a hora da sonda (e enquanto ela não volta); se
+    só sobrarem hosts assim e nada em andamento, os jobs deles são liberados
+    para serem adiados em vez de segurar a execução.
+    """
+    def __init__(self, jobs, por_host=None, prioridade=None, disjuntores=None):
+        self.filas = OrderedDict()
+        # Cada host atende os seus na ordem da prioridade (sort estável: empates mantêm a ordem do plano)
+        for job in (sorted(jobs, key=prioridade) if prioridade else jobs):
+            self.filas.setdefault(job['host'], deque()).append(job)
+        self.por_host = por_host
+        self.disjuntores = disjuntores
+        self.ativos = {}
+        self._mudou = asyncio.Condition()
+
+    async def obter(self):
+        """Próximo job no rodízio (None quando não há mais nada na fila)"""
+        async with self._mudou:
+            while self.filas:
+                job = self._proximo()
+                if job is not None:
+                    return job
+                try:
+                    await asyncio.wait_for(self._mudou.wait(), self._proxima_sonda())
+                except asyncio.TimeoutError:
+                    pass
+            return None
+
+    def _proximo(self):
+        esperando = False
+        for _ in range(len(self.filas)):
+            host, fila = next(iter(self.filas.items()))
+            self.filas.move_to_end(host)
+            if self.por_host and self.ativos.get(host, 0) >= self.por_host:
+                continue
+            if self.disjuntores is not None and self.disjuntores.espera_restante(host) != 0:
+                esperando = True
+                continue
+            return self._retirar(host, fila)
+        if esperando and not any(self.ativos.values()):
+            # Só sobraram hosts esperando a sonda e ninguém trabalhando: não há o que esperar
+            host, fila = next(iter(self.filas.items()))
+            return self._retirar(host, fila)
+        return None
+
+    def _retirar(self, host, fila):
+        job = fila.popleft()
+        if not fila:
+            del self.filas[host]
+        self.ativos[host] = self.ativos.get(host, 0) + 1
+        return job
+
+    def _proxima_sonda(self):
+        """Segundos até o primeiro disjuntor da fila deixar passar a sonda (None: esperar um job concluir)"""
+        if self.disjuntores is None:
+            return None
+        esperas = [self.disjuntores.espera_restante(host) for host in self.filas]
+        esperas = [espera for espera in esperas if espera]
+        return min(esperas) if esperas else None
+
+    async def concluir(self, job):
+        async with self._mudou:
+            self.ativos[job['host']] -= 1
+            self._mudou.notify_all()
+
+def workers_padrao(jobs, max_workers=None):
+    """max_workers ou, se None, um worker por host com job: todos os hosts ao mesmo tempo,
+    cada um protegido pelo seu limite por host"""
+    if max_workers is not None:
+        return max_workers
+    return len({job['host'] for job in jobs})
+
+async def executar_jobs(jobs, processar, max_concorrencia, por_host=None, prioridade=None, disjuntores=None):
+    """Roda processar(job) com no máximo max_concorrencia em andamento no total e por_host por host.
+
+    max_concorrencia None é um worker por host (workers_padrao). prioridade(job), se
+    dada, é a chave de ordenação dos jobs de cada host (menor sai antes). disjuntores
+    (os DisjuntoresHosts do cliente) seguram os jobs de host com disjuntor aberto.
+    """
+    max_concorrencia = workers_padrao(jobs, max_concorrencia)
+    fila = FilaJusta(jobs, por_host, prioridade, disjuntores)
+
+    async def worker():
+        while (job := await fila.obter()) is not None:
+            try:
+                await processar(job)
+            finally:
+                await fila.concluir(job)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(max_concorrencia, len(jobs))))))
@@ -1,42 +1,71 @@
-import requests
+import asyncio
 import pandas as pd
 import sqlite3
-from time import sleep, time
+from time import time
 import os
 from datetime import datetime
-from urllib.parse import urlparse
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-def normalizar_url(url):
-    url = url.strip()
-    if not url.startswith('http'):
-        url = 'https://' + url.strip().lstrip('/')
-    return url.rstrip('/')
-
-def get_retry_session():
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=2, status_forcelist=[500, 502, 503, 504])
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    return session
-
-def main():
+from urllib.parse import urlparse, parse_qs
+
+from nucleo_http import (ClienteHTTP, normalizar_url, host_da_url, executar_jobs, workers_padrao,
+                         cabecalhos_condicionais, conteudo_inalterado, STATUS_NAO_MODIFICADO)
+from controle_host import CircuitoAberto
+from gravador import GravadorSQLite
+from prioridades import prioridade_job
+from retentativas import indice_prefeituras, reprocessar_falhas
+from cache_negativo import vazio_em_dia
+from prazos import PrazosAprendidos
+from capacidades import matriz_capacidades, periodos_permitidos, resumo_capacidades
+from snapshots import cadencias_snapshot, snapshot_em_dia, marcar_snapshot, chave_substituicao
+from arquivo_bruto import ArquivoBruto, reproduzir_jobs
+from fluxo_json import DecodificadorArray
+from banco import (carregar_chaves_concluidas, criar_ledger, periodos_com_status, periodos_vazios, validadores_ledger,
+                   snapshots_ledger, ultimo_periodo, importar_log_legado, PERIODO_SNAPSHOT,
+                   STATUS_OK, STATUS_VAZIO, STATUS_ERRO, STATUS_ADIADO, STATUS_PARCIAL)
+
+VENDOR = 'portaltp'
+
+# Concorrência padrão: quantas requisições em andamento no total e quantas
+# requisições simultâneas cada host (prefeitura) recebe. None: um worker por host,
+# todas as prefeituras ao mesmo tempo (o limite por host protege cada servidor)
+MAX_WORKERS = None
+REQUISICOES_POR_HOST = 2
+
+# Colunas que identificam um período já extraído e, nos endpoints de retrato, a prefeitura
+CHAVES = ('municipio', 'prefeitura', 'ano', 'mes')
+CHAVES_SNAPSHOT = ('municipio', 'prefeitura')
+
+# Endpoints com payload mensal grande demais para ler de uma vez: o array é
+# decodificado em fluxo e gravado a cada LINHAS_POR_LOTE linhas
+ENDPOINTS_FLUXO = {'liquidacoesfavorecidos'}
+LINHAS_POR_LOTE = 5000
+
+# Revalidação: meses mais recentes (inclusive o atual) conferidos de novo, já que os portais revisam o passado recente
+MESES_REVALIDACAO = 3
+
+def caminhos_padrao():
+    """(endpoints, prefeituras, BD, log de erros, log de execução, last_run) do projeto"""
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     data_dir = os.path.join(base_dir, 'data')
     bds_dir = os.path.join(base_dir, 'bds')
     logs_dir = os.path.join(base_dir, 'logs')
 
-    endpoints_file = os.path.join(data_dir, 'endpoints_portaltp.txt')
-    prefeituras_file = os.path.join(data_dir, 'prefeituras.csv')
-    db_file = os.path.join(bds_dir, 'portaltp.db')
-    error_log_file = os.path.join(logs_dir, 'portaltp_errors.log')
-    execution_log_file = os.path.join(logs_dir, 'portaltp_execution.log')
-    last_run_file = os.path.join(logs_dir, 'portaltp_last_run.txt')
-
     os.makedirs(bds_dir, exist_ok=True)
     os.makedirs(logs_dir, exist_ok=True)
 
+    return (
+        os.path.join(data_dir, 'endpoints_portaltp.txt'),
+        os.path.join(data_dir, 'prefeituras.csv'),
+        os.path.join(bds_dir, 'portaltp.db'),
+        os.path.join(logs_dir, 'portaltp_errors.log'),
+        os.path.join(logs_dir, 'portaltp_execution.log'),
+        os.path.join(logs_dir, 'portaltp_last_run.txt'),
+    )
+
+def main():
+    (endpoints_file, prefeituras_file, db_file,
+     error_log_file, execution_log_file, last_run_file) = caminhos_padrao()
+    concorrencia = {'max_workers': MAX_WORKERS, 'por_host': REQUISICOES_POR_HOST}
+
     while True:
         print("\n" + "="*50)
         print("MENU PRINCIPAL - PORTALTP DATA EXTRACTOR")
@@ -44,44 +73,85 @@ def main():
         print("1. Rodar código para um período específico")
         print("2. Rodar URLs que falharam (do arquivo de log)")
         print("3. Continuar extração desde a última data")
-        print("4. Sair")
+        print(f"4. Revalidar os últimos {MESES_REVALIDACAO} meses (regrava só o que mudou)")
+        print("5. Reconstruir as tabelas de um período a partir do arquivo (sem rede)")
+        print(f"6. Ajustar paralelismo (agora: {concorrencia['max_workers'] or 'um por host'} em paralelo, "
+              f"{concorrencia['por_host']} por host)")
+        print("7. Sair")
 
-        choice = input("\nEscolha uma opção (1-4): ")
+        choice = input("\nEscolha uma opção (1-7): ")
 
         if choice == '1':
             start_time = time()
             log_execution(execution_log_file, "Opção 1: Rodar código para período específico")
             data_inicio, data_fim = get_periodo_usuario()
-            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, error_log_file)
-            save_last_run(last_run_file, data_fim)
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, **concorrencia)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '2':
             start_time = time()
             log_execution(execution_log_file, "Opção 2: Rodar URLs que falharam")
-            run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file)
+            run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file, **concorrencia)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '3':
             start_time = time()
             log_execution(execution_log_file, "Opção 3: Continuar desde última data")
-            data_inicio = get_last_run(last_run_file)
+            data_inicio = get_last_run(db_file, last_run_file)
             if data_inicio is None:
                 print("\n🔴 Nenhuma execução anterior encontrada. Use a opção 1 primeiro.")
                 continue
 
             data_fim = (datetime.now().year, datetime.now().month)
-            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, error_log_file)
-            save_last_run(last_run_file, data_fim)
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, **concorrencia)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '4':
+            start_time = time()
+            log_execution(execution_log_file, "Opção 4: Revalidar últimos meses")
+            data_inicio, data_fim = periodo_revalidacao()
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=True,
+                           **concorrencia)
+            log_execution_time(execution_log_file, start_time)
+
+        elif choice == '5':
+            start_time = time()
+            log_execution(execution_log_file, "Opção 5: Reconstruir a partir do arquivo")
+            data_inicio, data_fim = get_periodo_usuario()
+            run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, reproduzir=True,
+                           **concorrencia)
+            log_execution_time(execution_log_file, start_time)
+
+        elif choice == '6':
+            concorrencia = get_concorrencia_usuario(concorrencia)
+
+        elif choice == '7':
             print("\nSaindo...")
             break
 
         else:
             print("\n🔴 Opção inválida. Tente novamente.")
 
+def get_concorrencia_usuario(atual):
+    """Pergunta workers e requisições por host; Enter mantém o valor atual (0 workers = um por host)"""
+    novo = dict(atual)
+    for chave, pergunta in (('max_workers', "Requisições em paralelo no total (0 = uma por host)"),
+                            ('por_host', "Requisições simultâneas por host")):
+        while True:
+            resposta = input(f"{pergunta} [{atual[chave] or 0}]: ").strip()
+            if not resposta:
+                break
+            try:
+                valor = int(resposta)
+                if valor < 0 or (valor == 0 and chave == 'por_host'):
+                    raise ValueError
+            except ValueError:
+                print("🔴 Número inválido. Tente novamente.")
+                continue
+            novo[chave] = valor or None
+            break
+    return novo
+
 def get_periodo_usuario():
     print("\n" + "="*50)
     print("DEFINIR PERÍODO DE EXTRAÇÃO")
@@ -110,23 +180,45 @@ def get_periodo_usuario():
         except (ValueError, IndexError):
             print("🔴 Formato inválido. Use MM/AAAA (ex: 01/2024). Tente novamente.")
 
-def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, error_log_file):
+def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file,
+                   max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST, revalidar=False, reproduzir=False):
+    """Extrai o período. Com revalidar=True os meses já baixados também são
+    requisitados, de forma condicional, e só regravados se o conteúdo mudou.
+    Com reproduzir=True as tabelas do período são reconstruídas a partir do
+    arquivo de respostas brutas, sem rede."""
+    if reproduzir:
+        # Todos os meses do intervalo, baixados ou não; só os que estão no arquivo são reprocessados
+        jobs = planejar_extracao(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=True)
+        asyncio.run(reproduzir_jobs(jobs, db_file, processar_job, max_workers))
+        print("\n\n✅ RECONSTRUÇÃO CONCLUÍDA!")
+        return
+
+    jobs = planejar_extracao(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar)
+    if not jobs:
+        return
+
+    max_workers = workers_padrao(jobs, max_workers)
+    print(f"🔧 {max_workers} em paralelo, {por_host} por host")
+    asyncio.run(executar_extracao(jobs, db_file, max_workers, por_host))
+
+    print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
+
+def planejar_extracao(data_inicio, data_fim, endpoints_file, prefeituras_file, db_file, revalidar=False):
+    """Cria as tabelas e o ledger e devolve os jobs (um por prefeitura x endpoint x mês) ainda pendentes"""
     endpoints = load_endpoints(endpoints_file)
     prefeituras = load_prefeituras(prefeituras_file)
     prefeituras_portaltp = prefeituras[prefeituras['empresa'] == 'portaltp']
 
     if prefeituras_portaltp.empty:
         print("\n🔴 Nenhuma prefeitura com empresa 'portaltp' encontrada.")
-        return
+        return []
 
-    session = get_retry_session()
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
+    criar_ledger(conn)
 
     for endpoint in endpoints:
         endpoint_name = endpoint.split('/')[-1].replace('Get', '').lower()
-        print(f"\n{'='*50}\n🔧 Processando endpoint: {endpoint_name}")
-
         cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS {endpoint_name} (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -136,159 +228,255 @@ def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_f
                 mes INTEGER
             )
         ''')
-        conn.commit()
-
-        for _, prefeitura in prefeituras_portaltp.iterrows():
-            municipio = prefeitura['municipio']
-            prefeitura_nome = prefeitura['prefeitura']
-            base_url = normalizar_url(prefeitura['url'])
-            print(f"\n🏛️ Prefeitura: {prefeitura_nome} ({municipio})")
-
-            for ano, mes in generate_months_range(data_inicio, data_fim):
-                print(f"📅 {mes:02d}/{ano}", end=' ', flush=True)
-                cursor.execute(f'''
-                    SELECT 1 FROM {endpoint_name} 
-                    WHERE municipio = ? AND prefeitura = ? AND ano = ? AND mes = ?
-                    LIMIT 1
-                ''', (municipio, prefeitura_nome, ano, mes))
-
-                if cursor.fetchone():
-                    print("✅ Já existe no BD", end=' ')
+    conn.commit()
+
+    # Mantém a retomada: o que já está no BD (dados ou ledger, inclusive vazios ainda válidos) não é requisitado de novo
+    concluidos = {}
+    finalizados = {}
+    parciais = {}
+    vazios = {}
+    validadores = {}
+    for endpoint in endpoints:
+        endpoint_name = endpoint.split('/')[-1].replace('Get', '').lower()
+        concluidos[endpoint_name] = carregar_chaves_concluidas(conn, endpoint_name, CHAVES)
+        finalizados[endpoint_name] = periodos_com_status(conn, VENDOR, endpoint_name, (STATUS_OK,))
+        # Período gravado pela metade (leitura em fluxo interrompida) tem linhas mas não está concluído
+        parciais[endpoint_name] = periodos_com_status(conn, VENDOR, endpoint_name, (STATUS_PARCIAL,))
+        vazios[endpoint_name] = periodos_vazios(conn, VENDOR, endpoint_name)
+        if revalidar:
+            validadores[endpoint_name] = validadores_ledger(conn, VENDOR, endpoint_name)
+
+    # Endpoints de retrato: um pedido por prefeitura com o último mês, quando o retrato anterior venceu
+    cadencias, detectados = cadencias_snapshot(conn, VENDOR, {endpoint.split('/')[-1].replace('Get', '').lower(): endpoint
+                                                  for endpoint in endpoints})
+    retratos = {endpoint_name: snapshots_ledger(conn, VENDOR, endpoint_name) for endpoint_name in cadencias}
+    # Endpoints que o portal recusa sempre (400/404) ficam de fora, salvo a sonda da rechecagem
+    capacidades = matriz_capacidades(conn, VENDOR)
+    resumo_capacidades(VENDOR, capacidades)
+
+    meses = generate_months_range(data_inicio, data_fim)
+    jobs = []
+    for _, prefeitura in prefeituras_portaltp.iterrows():
+        base_url = normalizar_url(prefeitura['url'])
+        host = host_da_url(base_url)
+        for endpoint in endpoints:
+            endpoint_name = endpoint.split('/')[-1].replace('Get', '').lower()
+            if endpoint_name in cadencias:
+                registro = retratos[endpoint_name].get((host, ''))
+                if periodos_permitidos(capacidades, host, endpoint_name, meses) and (revalidar or not snapshot_em_dia(registro, cadencias[endpoint_name])):
+                    ano, mes = meses[-1]
+                    job = montar_job(f"{base_url}/{endpoint}?ano={ano}&mes={mes:02d}", endpoint_name,
+                                     prefeitura['municipio'], prefeitura['prefeitura'], ano, mes)
+                    jobs.append(marcar_snapshot(job, registro, endpoint_name in detectados))
+                continue
+            for ano, mes in periodos_permitidos(capacidades, host, endpoint_name, meses):
+                periodo = (host, '', f"{ano}-{mes:02d}")
+                ja_baixado = (((prefeitura['municipio'], prefeitura['prefeitura'], ano, mes) in concluidos[endpoint_name]
+                               and periodo not in parciais[endpoint_name])
+                              or periodo in finalizados[endpoint_name]
+                              or vazio_em_dia(vazios[endpoint_name].get(periodo), ano, mes))
+                if ja_baixado and not revalidar:
                     continue
-
-                url = f"{base_url}/{endpoint}?ano={ano}&mes={mes:02d}"
-                try:
-                    response = session.get(url, timeout=30)
-                    response.raise_for_status()
-                    if not response.content.strip():
-                        print("🟡 Resposta vazia. Ignorando.", end=' ')
-                        continue
-                    dados = response.json()
-                    df = pd.DataFrame(dados)
-
-                    if not df.empty:
-                        df['municipio'] = municipio
-                        df['prefeitura'] = prefeitura_nome
-                        df['ano'] = ano
-                        df['mes'] = mes
-
-                        cursor.execute(f"PRAGMA table_info({endpoint_name})")
-                        existing_columns = [col[1] for col in cursor.fetchall()]
-
-                        for column in df.columns:
-                            if column not in existing_columns and column != 'id':
-                                col_type = 'TEXT'
-                                if pd.api.types.is_numeric_dtype(df[column]):
-                                    col_type = 'REAL'
-                                elif pd.api.types.is_integer_dtype(df[column]):
-                                    col_type = 'INTEGER'
-                                cursor.execute(f"ALTER TABLE {endpoint_name} ADD COLUMN {column} {col_type}")
-                                conn.commit()
-
-                        df.to_sql(endpoint_name, conn, if_exists='append', index=False)
-                        print("✅ Dados salvos", end=' ')
-
-                except Exception as e:
-                    print(f"🔴 ERRO: {str(e)}", end=' ')
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    with open(error_log_file, 'a') as f:
-                        f.write(f"{timestamp}|{url}|{type(e).__name__}|{str(e)}\n")
-                sleep(1)
-
+                job = montar_job(f"{base_url}/{endpoint}?ano={ano}&mes={mes:02d}", endpoint_name,
+                                 prefeitura['municipio'], prefeitura['prefeitura'], ano, mes)
+                if ja_baixado:
+                    job['revalidar'] = True
+                    job['validadores'] = validadores[endpoint_name].get(periodo)
+                jobs.append(job)
+
+    # A gravação fica com o GravadorSQLite (conexão própria)
     conn.close()
-    print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
+    print(f"\n🔧 {VENDOR}: {len(jobs)} requisições pendentes ({len(endpoints)} endpoints x "
+          f"{len(prefeituras_portaltp)} prefeituras x {len(meses)} meses)")
+    return jobs
+
+def montar_job(url, endpoint_name, municipio, prefeitura_nome, ano, mes):
+    return {
+        'vendor': VENDOR,
+        'url': url,
+        'host': host_da_url(url),
+        'endpoint_name': endpoint_name,
+        'municipio': municipio,
+        'prefeitura': prefeitura_nome,
+        'periodo': f"{ano}-{mes:02d}",
+        'ano': ano,
+        'mes': mes,
+    }
+
+async def executar_extracao(jobs, db_file, max_workers, por_host, timeout=30, retentativa=False):
+    """timeout é o padrão dos pares (host, endpoint) ainda sem histórico de latência
+    e, no reprocessamento (retentativa=True), o piso de todos"""
+    arquivo = ArquivoBruto()
+    prazos = PrazosAprendidos.do_banco(db_file, VENDOR, timeout, retentativa)
+    print(f"⏱️ Timeouts: {prazos}")
+    with GravadorSQLite(db_file, arquivo=arquivo) as gravador:
+        async with ClienteHTTP(por_host=por_host, arquivo=arquivo) as cliente:
+            async def processar(job):
+                await processar_job(cliente, gravador, job, prazos.para(job))
+            await executar_jobs(jobs, processar, max_workers, por_host, prioridade_job, cliente.disjuntores)
+        print(f"\n🔌 Pool: {cliente.estatisticas}")
+
+async def processar_job(cliente, gravador, job, timeout=30):
+    """Ponto de entrada de um job (também usado pelo agendador)"""
+    if job['endpoint_name'] in ENDPOINTS_FLUXO and not job.get('snapshot'):
+        await processar_mes_fluxo(cliente, gravador, job, timeout)
+    else:
+        await processar_mes(cliente, gravador, job, timeout)
+
+async def processar_mes(cliente, gravador, job, timeout=30):
+    endpoint_name = job['endpoint_name']
+    prefixo = f"[{job['municipio']}] {endpoint_name} {job['mes']:02d}/{job['ano']}"
+    # Na revalidação o mês inteiro é substituído se o conteúdo mudou (no retrato, a prefeitura inteira)
+    chave = chave_substituicao(job, CHAVES, CHAVES_SNAPSHOT)
+    try:
+        validadores = job.get('validadores')
+        response = await cliente.get(job['url'], timeout=timeout, cabecalhos=cabecalhos_condicionais(validadores))
+        if chave and conteudo_inalterado(response, validadores):
+            print(f"🔁 {prefixo}: Sem mudanças")
+            if job.get('snapshot'):
+                # A cadência do retrato conta a partir desta conferência
+                await gravador.enviar(job, conferido=True)
+            return
+        if not response.content.strip():
+            print(f"🟡 {prefixo}: Resposta vazia. Ignorando.")
+            await gravador.enviar(job, STATUS_VAZIO, resposta=response, tabela=endpoint_name, chave=chave,
+                                  limpar=chave is not None)
+            return
+        dados = response.json()
+        df = pd.DataFrame(dados)
+
+        if df.empty:
+            await gravador.enviar(job, STATUS_VAZIO, resposta=response, tabela=endpoint_name, chave=chave,
+                                  limpar=chave is not None)
+            return
+
+        df['municipio'] = job['municipio']
+        df['prefeitura'] = job['prefeitura']
+        df['ano'] = job['ano']
+        df['mes'] = job['mes']
+        await gravador.enviar(job, STATUS_OK, resposta=response, tabela=endpoint_name, df=df, chave=chave,
+                              limpar=chave is not None)
+        print(f"✅ {prefixo}: Dados salvos")
+
+    except CircuitoAberto as e:
+        print(f"⏸️ {prefixo}: {e}")
+        await gravador.enviar(job, STATUS_ADIADO, erro=e)
 
-def run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file):
-    if not os.path.exists(error_log_file):
-        print("\n🔴 Nenhum arquivo de log de erros encontrado.")
-        return
+    except Exception as e:
+        print(f"🔴 {prefixo}: ERRO: {str(e)}")
+        await gravador.enviar(job, STATUS_ERRO, erro=e)
+
+async def processar_mes_fluxo(cliente, gravador, job, timeout=30):
+    """processar_mes para endpoints grandes: o timeout vale por pedaço lido e as linhas vão para o gravador em lotes"""
+    endpoint_name = job['endpoint_name']
+    prefixo = f"[{job['municipio']}] {endpoint_name} {job['mes']:02d}/{job['ano']}"
+    chave = {coluna: job[coluna] for coluna in CHAVES}
+    decodificador = DecodificadorArray()
+    pendentes = []
+    gravadas = 0
+
+    async def gravar_lote(registros, status=STATUS_PARCIAL, response=None):
+        nonlocal gravadas
+        df = pd.DataFrame(registros)
+        for coluna, valor in chave.items():
+            df[coluna] = valor
+        # O primeiro lote apaga o que sobrou de uma tentativa anterior interrompida
+        await gravador.enviar(job, status, resposta=response, tabela=endpoint_name, df=df,
+                              linhas=gravadas + len(df), chave=chave, limpar=gravadas == 0)
+        gravadas += len(df)
+
+    async def ao_receber(pedaco):
+        pendentes.extend(decodificador.alimentar(pedaco))
+        while len(pendentes) >= LINHAS_POR_LOTE:
+            await gravar_lote(pendentes[:LINHAS_POR_LOTE])
+            del pendentes[:LINHAS_POR_LOTE]
 
-    failed_urls = []
-    with open(error_log_file, 'r') as f:
-        for line in f:
-            partes = line.strip().split('|')
-            if len(partes) >= 2:
-                failed_urls.append(partes[1])
+    try:
+        # Só o 304 evita o download aqui: o hash do corpo só fica pronto depois dos lotes gravados
+        cabecalhos = cabecalhos_condicionais(job.get('validadores'))
+        response = await cliente.get_stream(job['url'], ao_receber, timeout=timeout, cabecalhos=cabecalhos)
+        if job.get('revalidar') and response.status_code == STATUS_NAO_MODIFICADO:
+            print(f"🔁 {prefixo}: Sem mudanças")
+            return
+        pendentes.extend(decodificador.finalizar())
+        if not gravadas and not pendentes:
+            print(f"🟡 {prefixo}: Resposta vazia. Ignorando.")
+            await gravador.enviar(job, STATUS_VAZIO, resposta=response, tabela=endpoint_name, chave=chave,
+                                  limpar=bool(job.get('revalidar')))
+            return
+
+        await gravar_lote(pendentes, STATUS_OK, response)
+        print(f"✅ {prefixo}: {gravadas} linhas salvas em fluxo")
+
+    except CircuitoAberto as e:
+        print(f"⏸️ {prefixo}: {e}")
+        await gravador.enviar(job, STATUS_ADIADO, erro=e)
 
-    if not failed_urls:
-        print("\n✅ Nenhuma URL com erro para reprocessar.")
-        return
+    except Exception as e:
+        print(f"🔴 {prefixo}: ERRO: {str(e)}")
+        # Não deixa lotes de uma leitura interrompida no banco
+        await gravador.enviar(job, STATUS_ERRO, erro=e, tabela=endpoint_name, chave=chave, limpar=gravadas > 0)
 
-    print(f"\n🔧 Reprocessando {len(failed_urls)} URLs com erro")
-    session = get_retry_session()
-    prefeituras = load_prefeituras(prefeituras_file)
+def run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file,
+                    max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST):
     conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    success_count = 0
-    temp_error_file = error_log_file + ".temp"
+    criar_ledger(conn)
 
-    for url in failed_urls:
-        try:
-            print(f"🔁 Tentando novamente: {url}", end=' ', flush=True)
-            url = normalizar_url(url).replace('//', '/').replace('https:/', 'https://')
-            parsed = urlparse(url)
-            base_url = f"{parsed.scheme}://{parsed.netloc}"
-            if '?' not in url:
-                print("🟡 URL sem parâmetros. Ignorando.")
-                continue
+    # O log de erros antigo (pipe-delimitado) é importado para o ledger uma única vez
+    prefeituras = load_prefeituras(prefeituras_file)
+    indice = indice_prefeituras(prefeituras)
+    importados = importar_log_legado(conn, error_log_file, lambda url: job_da_url(url, indice))
+    if importados:
+        print(f"\n📥 {importados} falhas do log antigo importadas para o ledger")
+
+    def executar(jobs):
+        for job in jobs:
+            if job['periodo'] == PERIODO_SNAPSHOT:
+                # O retrato foi pedido com o último mês do intervalo daquela execução
+                params = parse_qs(urlparse(job['url']).query)
+                job['ano'], job['mes'] = int(params['ano'][0]), int(params['mes'][0])
+                job['snapshot'] = True
+            else:
+                job['ano'], job['mes'] = map(int, job['periodo'].split('-'))
+        asyncio.run(executar_extracao(jobs, db_file, max_workers, por_host, timeout=60, retentativa=True))
+
+    total, descartadas, restantes = reprocessar_falhas(conn, VENDOR, executar)
+    conn.close()
+    if not total:
+        print("\n✅ Nenhuma URL com erro para reprocessar.")
+        return
+    print(f"\n✅ Concluído! {total - descartadas - restantes}/{total} URLs reprocessadas com sucesso "
+          f"({descartadas} descartadas, {restantes} ainda com erro).")
 
-            query_params = parsed.query
-            params_dict = dict(param.split('=', 1) for param in query_params.split('&'))
-            ano = int(params_dict.get('ano', 0))
-            mes = int(params_dict.get('mes', 0))
+def job_da_url(url, indice):
+    """Monta o job a partir de uma URL do log antigo (None se não der para identificar).
 
-            prefeitura_match = prefeituras[prefeituras['url'].str.strip().apply(normalizar_url) == base_url]
-            if prefeitura_match.empty:
-                print("🟡 Prefeitura não encontrada. Ignorando.")
-                continue
+    indice: {host: prefeitura} do indice_prefeituras.
+    """
+    url = normalizar_url(url)
+    parsed = urlparse(url)
+    if not parsed.query:
+        return None
 
-            prefeitura = prefeitura_match.iloc[0]
-            municipio = prefeitura['municipio']
-            prefeitura_nome = prefeitura['prefeitura']
-            endpoint_name = parsed.path.split('/')[-1].replace('Get', '').lower()
+    params_dict = dict(param.split('=', 1) for param in parsed.query.split('&') if '=' in param)
+    try:
+        ano = int(params_dict.get('ano', 0))
+        mes = int(params_dict.get('mes', 0))
+    except ValueError:
+        return None
 
-            response = session.get(url, timeout=60)
-            response.raise_for_status()
-            if not response.content.strip():
-                print("🟡 Resposta vazia. Ignorando.")
-                continue
+    prefeitura = indice.get(host_da_url(url))
+    if prefeitura is None or not ano or not mes:
+        return None
 
-            dados = response.json()
-            df = pd.DataFrame(dados)
-
-            if not df.empty:
-                df['municipio'] = municipio
-                df['prefeitura'] = prefeitura_nome
-                df['ano'] = ano
-                df['mes'] = mes
-
-                cursor.execute(f"PRAGMA table_info({endpoint_name})")
-                existing_columns = [col[1] for col in cursor.fetchall()]
-
-                for column in df.columns:
-                    if column not in existing_columns and column != 'id':
-                        col_type = 'TEXT'
-                        if pd.api.types.is_numeric_dtype(df[column]):
-                            col_type = 'REAL'
-                        elif pd.api.types.is_integer_dtype(df[column]):
-                            col_type = 'INTEGER'
-                        cursor.execute(f"ALTER TABLE {endpoint_name} ADD COLUMN {column} {col_type}")
-                        conn.commit()
-
-                df.to_sql(endpoint_name, conn, if_exists='append', index=False)
-                success_count += 1
-                print("✅ Sucesso")
-
-        except Exception as e:
-            print(f"🔴 Falhou novamente: {str(e)}")
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(temp_error_file, 'a') as f:
-                f.write(f"{timestamp}|{url}|{type(e).__name__}|{str(e)}\n")
-        sleep(1)
+    endpoint_name = parsed.path.split('/')[-1].replace('Get', '').lower()
+    return montar_job(url, endpoint_name, prefeitura['municipio'], prefeitura['prefeitura'], ano, mes)
 
-    conn.close()
-    os.replace(temp_error_file, error_log_file)
-    print(f"\n✅ Concluído! {success_count}/{len(failed_urls)} URLs reprocessadas com sucesso.")
+def periodo_revalidacao():
+    """Os últimos MESES_REVALIDACAO meses, inclusive o atual"""
+    hoje = datetime.now()
+    inicio = hoje.year * 12 + hoje.month - MESES_REVALIDACAO
+    return (inicio // 12, inicio % 12 + 1), (hoje.year, hoje.month)
 
 def generate_months_range(data_inicio, data_fim):
     meses = []
@@ -305,11 +493,16 @@ def generate_months_range(data_inicio, data_fim):
 
     return meses
 
-def save_last_run(last_run_file, data_fim):
-    with open(last_run_file, 'w') as f:
-        f.write(f"{data_fim[0]},{data_fim[1]}")
-
-def get_last_run(last_run_file):
+def get_last_run(db_file, last_run_file):
+    """Última data registrada no ledger; o arquivo last_run antigo serve de fallback"""
+    if os.path.exists(db_file):
+        conn = sqlite3.connect(db_file)
+        criar_ledger(conn)
+        periodo = ultimo_periodo(conn, VENDOR)
+        conn.close()
+        if periodo:
+            ano, mes = map(int, periodo.split('-'))
+            return (ano, mes)
     if not os.path.exists(last_run_file):
         return None
     with open(last_run_file, 'r') as f:
@@ -0,0 +1,102 @@
+"""Timeouts por (host, endpoint) aprendidos com as latências do ledger.
+
+Um timeout fixo de 30s (60s no reprocessamento) estourava sempre nos endpoints
+pesados (liquidações por favorecido) e, nos leves, segurava um worker 30s
+esperando um host morto. O ledger guarda a latência de cada período baixado;
+daqui sai um Prazo por par:
+
+- leitura: FOLGA_LEITURA x o percentil PERCENTIL das latências do par, entre
+  LEITURA_MINIMA e LEITURA_MAXIMA;
+- conexão: FOLGA_CONEXAO x a mediana das latências do host (a conexão é uma
+  parte pequena de qualquer resposta), entre CONEXAO_MINIMA e TIMEOUT_CONEXAO.
+
+Par com menos de MIN_AMOSTRAS respostas usa o timeout padrão da execução.
+
+O prazo aprendido nunca fica abaixo do padrão no reprocessamento (que passa um
+padrão maior de propósito) nem nos pares com timeout registrado nos últimos
+ESTOURO_DIAS: esses ainda ganham FOLGA_ESTOURO x o prazo, até LEITURA_MAXIMA,
+para que um endpoint que sempre estoura não fique preso no mesmo prazo.
+"""
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from banco import criar_ledger, latencias_ledger, falhas_ledger
+from nucleo_http import Prazo, TIMEOUT_CONEXAO
+from retentativas import classificar_falha
+
+PERCENTIL = 0.95
+FOLGA_LEITURA = 3
+LEITURA_MINIMA = 10
+LEITURA_MAXIMA = 300
+
+FOLGA_CONEXAO = 2
+CONEXAO_MINIMA = 3
+
+MIN_AMOSTRAS = 5
+
+FOLGA_ESTOURO = 2
+ESTOURO_DIAS = 30
+# Estouro de leitura (resposta total ou socket parado): é o que um prazo maior resolve. O timeout
+# de conexão (ConnectionTimeoutError) é host inalcançável e fica com o disjuntor
+CLASSES_ESTOURO = ('TimeoutError', 'ServerTimeoutError', 'SocketTimeoutError')
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+def _limitar(valor, minimo, maximo):
+    return max(minimo, min(maximo, valor))
+
+def pares_com_estouro(falhas, agora=None):
+    """Set de (host, endpoint) com falha por timeout de leitura registrada nos últimos ESTOURO_DIAS"""
+    limite = ((agora or datetime.now()) - timedelta(days=ESTOURO_DIAS)).strftime("%Y-%m-%d %H:%M:%S")
+    return {(falha['host'], falha['endpoint_name']) for falha in falhas
+            if (falha['atualizado_em'] or '') >= limite and classificar_falha(falha)[0] in CLASSES_ESTOURO}
+
+class PrazosAprendidos:
+    """Prazo de cada job a partir das latências já registradas no ledger do vendor.
+
+    retentativa=True (reprocessamento): o padrão é o piso de todo prazo aprendido.
+    """
+    def __init__(self, latencias, padrao, estouros=(), retentativa=False):
+        self.padrao = Prazo.de(padrao)
+        self.estouros = set(estouros)
+        self.retentativa = retentativa
+        por_par = defaultdict(list)
+        por_host = defaultdict(list)
+        for host, endpoint, latencia in latencias:
+            por_par[(host, endpoint)].append(latencia)
+            por_host[host].append(latencia)
+
+        self.conexao = {host: _limitar(FOLGA_CONEXAO * percentil(valores, 0.5), CONEXAO_MINIMA, TIMEOUT_CONEXAO)
+                        for host, valores in por_host.items() if len(valores) >= MIN_AMOSTRAS}
+        self.leitura = {par: _limitar(FOLGA_LEITURA * percentil(valores, PERCENTIL), LEITURA_MINIMA, LEITURA_MAXIMA)
+                        for par, valores in por_par.items() if len(valores) >= MIN_AMOSTRAS}
+
+    @classmethod
+    def do_banco(cls, db_file, vendor, padrao, retentativa=False):
+        conn = sqlite3.connect(db_file)
+        criar_ledger(conn)
+        latencias = latencias_ledger(conn, vendor)
+        estouros = pares_com_estouro(falhas_ledger(conn, vendor))
+        conn.close()
+        return cls(latencias, padrao, estouros, retentativa)
+
+    def para(self, job):
+        par = (job['host'], job['endpoint_name'])
+        conexao = self.conexao.get(job['host'], self.padrao.conexao)
+        leitura = self.leitura.get(par, self.padrao.leitura)
+        if self.retentativa or par in self.estouros:
+            conexao = max(conexao, self.padrao.conexao)
+            leitura = max(leitura, self.padrao.leitura)
+        if par in self.estouros:
+            leitura = min(LEITURA_MAXIMA, FOLGA_ESTOURO * leitura)
+        return Prazo(conexao, leitura)
+
+    def __str__(self):
+        if not self.leitura:
+            return f"sem histórico de latência, {self.padrao}"
+        return (f"{len(self.leitura)} pares (host, endpoint) com prazo aprendido, leitura de "
+                f"{min(self.leitura.values()):.0f}s a {max(self.leitura.values()):.0f}s; "
+                f"{len(self.estouros)} com timeout recente (prazo ampliado); demais: {self.padrao}")
@@ -0,0 +1,63 @@
+"""Ordem de atendimento dos jobs: períodos recentes e endpoints de investigação primeiro.
+
+Sem isso a ordem seguia as linhas do arquivo de endpoints, e Compras de 2013
+podia rodar antes de Despesas do mês passado. Agora cada job ganha uma nota
+(menor sai antes) = prioridade do endpoint x MESES_POR_NIVEL + idade do período
+em meses: um endpoint de prioridade 0 de um ano atrás empata com um de
+prioridade 1 deste mês. Se a execução for interrompida, o que mais importa já
+está no BD.
+
+As prioridades ficam em data/prioridades.csv (colunas padrao, prioridade): o
+padrão casa, sem diferenciar maiúsculas, com o nome do endpoint ou com um
+trecho do caminho da URL (a categoria do portaltp, ex. Despesas). Endpoints
+sem padrão ficam com PRIORIDADE_PADRAO.
+"""
+import os
+from datetime import datetime
+from urllib.parse import urlparse
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARQUIVO_PRIORIDADES = os.path.join(BASE_DIR, 'data', 'prioridades.csv')
+
+PRIORIDADE_PADRAO = 1
+MESES_POR_NIVEL = 12
+
+_prioridades = None
+_por_endpoint = {}
+
+def carregar_prioridades(filename=ARQUIVO_PRIORIDADES):
+    """{padrão em minúsculas: prioridade}; vazio se o arquivo não existir"""
+    if not os.path.exists(filename):
+        return {}
+    try:
+        df = pd.read_csv(filename)
+        return {str(padrao).strip().lower(): int(prioridade) for padrao, prioridade in zip(df['padrao'], df['prioridade'])}
+    except Exception as e:
+        print(f"\n🔴 ERRO ao ler arquivo de prioridades: {str(e)}")
+        return {}
+
+def trechos_endpoint(endpoint_name, caminho):
+    """Nome do endpoint e trechos do caminho em minúsculas: o que os padrões dos arquivos de configuração casam"""
+    return [endpoint_name.lower()] + [trecho.lower() for trecho in caminho.split('/') if trecho]
+
+def prioridade_endpoint(job):
+    global _prioridades
+    chave = (job['vendor'], job['endpoint_name'])
+    if chave not in _por_endpoint:
+        if _prioridades is None:
+            _prioridades = carregar_prioridades()
+        trechos = trechos_endpoint(job['endpoint_name'], urlparse(job['url']).path)
+        casados = [_prioridades[t] for t in trechos if t in _prioridades]
+        _por_endpoint[chave] = min(casados) if casados else PRIORIDADE_PADRAO
+    return _por_endpoint[chave]
+
+def idade_em_meses(job, hoje=None):
+    """Meses entre o período do job e hoje (jobs anuais contam a partir de dezembro)"""
+    hoje = hoje or datetime.now()
+    return max(0, (hoje.year * 12 + hoje.month) - (int(job['ano']) * 12 + int(job.get('mes', 12))))
+
+def prioridade_job(job):
+    """Chave de ordenação para executar_jobs (menor sai antes)"""
+    return prioridade_endpoint(job) * MESES_POR_NIVEL + idade_em_meses(job)
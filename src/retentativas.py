@@ -0,0 +1,137 @@
+"""Planejador de retentativas do run_failed_urls.
+
+As falhas do ledger (e as do log antigo, importado uma vez) são agrupadas por
+classe de erro e host antes de qualquer requisição. Erro permanente (400, 404...,
+ou erro de gravação que se repetiria igual) sai da fila com status descartado
+em vez de ser tentado de novo a cada execução. As falhas transitórias (timeout,
+conexão, 5xx, disjuntor aberto, leitura interrompida) rodam em paralelo pela
+fila justa e, o que falhar de novo, volta em até RODADAS rodadas com espera
+crescente entre elas (enquanto cada rodada recuperar alguma coisa).
+"""
+import re
+from collections import Counter, defaultdict
+from time import sleep
+
+from banco import jobs_para_reprocessar, descartar_jobs, STATUS_ADIADO, STATUS_PARCIAL
+from nucleo_http import normalizar_url, host_da_url
+
+# Respostas que não mudam com nova tentativa
+STATUS_PERMANENTES = {400, 401, 403, 404, 405, 410, 422, 501}
+# Falhas do SQLite ao gravar (ex. too many columns): a mesma resposta falharia igual
+ERROS_GRAVACAO = ('OperationalError', 'IntegrityError')
+
+RODADAS = 3
+ESPERA_RODADA = 30  # segundos antes da 2ª rodada; dobra a cada rodada
+
+# "ErroHTTP: 400 Bad Request for url..." e, no log antigo, "HTTPError: 400 Client Error: ..."
+_STATUS_NO_ERRO = re.compile(r'^(?:ErroHTTP|HTTPError): (\d{3})\b')
+_TIPO_NO_ERRO = re.compile(r'\b([A-Z]\w*(?:Error|Timeout|Exception))\b')
+
+_CAMPOS_LEDGER = ('status', 'erro', 'http_status')
+
+def indice_prefeituras(prefeituras, empresa=None):
+    """{host: linha da prefeitura}, montado uma vez no lugar de comparar a coluna url a cada URL do log"""
+    if empresa is not None:
+        prefeituras = prefeituras[prefeituras['empresa'] == empresa]
+    indice = {}
+    for _, prefeitura in prefeituras.iterrows():
+        # Mesmo host duas vezes: vale a primeira linha, como antes
+        indice.setdefault(host_da_url(normalizar_url(prefeitura['url'])), prefeitura)
+    return indice
+
+def classificar_falha(job):
+    """(classe do erro, permanente?) de um job do ledger"""
+    if job['status'] == STATUS_ADIADO:
+        return 'CircuitoAberto', False
+    if job['status'] == STATUS_PARCIAL:
+        return 'LeituraInterrompida', False
+    erro = job.get('erro') or ''
+    status = job.get('http_status')
+    if not status:
+        casamento = _STATUS_NO_ERRO.match(erro)
+        status = int(casamento.group(1)) if casamento else None
+    if status:
+        return f"HTTP {status}", status in STATUS_PERMANENTES
+    for tipo in ERROS_GRAVACAO:
+        if tipo in erro:
+            return tipo, True
+    casamento = _TIPO_NO_ERRO.search(erro)
+    return (casamento.group(1) if casamento else 'Desconhecido'), False
+
+# Classes (de classificar_falha) que um pedido menor pode evitar, além de HTTP 5xx:
+# o equivalente de nucleo_http.falha_por_tamanho para o que ficou gravado no ledger
+CLASSES_TAMANHO = ('TimeoutError', 'ServerTimeoutError', 'SocketTimeoutError', 'ClientPayloadError',
+                   'LeituraInterrompida')
+
+def falha_registrada_por_tamanho(job):
+    """Se a falha registrada é de tamanho (timeout, 5xx, corpo cortado), não de DNS, conexão ou 4xx"""
+    classe, _ = classificar_falha(job)
+    if classe.startswith('HTTP '):
+        return int(classe[5:]) >= 500
+    return classe in CLASSES_TAMANHO
+
+def triagem(falhas):
+    """Separa as falhas em (transitórias, permanentes) e imprime o resumo por classe e host"""
+    grupos = defaultdict(list)
+    permanentes_classe = {}
+    for job in falhas:
+        classe, permanente = classificar_falha(job)
+        grupos[classe].append(job)
+        permanentes_classe[classe] = permanente
+
+    transitorias, permanentes = [], []
+    for classe, jobs in sorted(grupos.items(), key=lambda item: -len(item[1])):
+        hosts = Counter(job['host'] for job in jobs)
+        principais = ', '.join(f"{host} ({n})" for host, n in hosts.most_common(3))
+        icone = '🗑️' if permanentes_classe[classe] else '🔁'
+        print(f"  {icone} {classe}: {len(jobs)} em {len(hosts)} hosts - {principais}")
+        (permanentes if permanentes_classe[classe] else transitorias).extend(jobs)
+    return transitorias, permanentes
+
+def reprocessar_falhas(conn, vendor, executar, rodadas=RODADAS, espera=ESPERA_RODADA):
+    """Descarta as falhas permanentes e roda executar(jobs) com as transitórias, em até rodadas rodadas.
+
+    executar recebe os jobs no formato dos extratores (sem os campos do ledger)
+    e grava os resultados no ledger antes de voltar. Devolve (falhas no início,
+    descartadas, ainda com erro).
+    """
+    total = None
+    descartadas = 0
+    rodada = 0
+    anteriores = None
+    while True:
+        falhas = jobs_para_reprocessar(conn, vendor)
+        if total is None:
+            total = len(falhas)
+        if not falhas:
+            break
+        print(f"\n🔎 {vendor}: {len(falhas)} falhas por classe de erro")
+        transitorias, permanentes = triagem(falhas)
+        if permanentes:
+            descartar_jobs(conn, permanentes)
+            descartadas += len(permanentes)
+            print(f"🗑️ {len(permanentes)} falhas permanentes descartadas (não serão tentadas de novo)")
+        if not transitorias or rodada == rodadas:
+            break
+        if anteriores is not None and len(transitorias) >= anteriores:
+            # Nenhuma recuperada (ex. disjuntor ainda aberto): outra rodada agora daria no mesmo
+            print("⏹️ Rodada sem nenhuma recuperação: o restante fica para a próxima execução")
+            break
+        anteriores = len(transitorias)
+        if rodada:
+            pausa = espera * 2 ** (rodada - 1)
+            print(f"⏳ Aguardando {pausa}s antes da próxima rodada")
+            sleep(pausa)
+        rodada += 1
+        for job in transitorias:
+            for campo in _CAMPOS_LEDGER:
+                job.pop(campo, None)
+            # Como na revalidação: o período pode já ter linhas (ex. falha importada do log antigo
+            # de um período que depois deu certo) e a retentativa as substitui em vez de duplicar
+            job['revalidar'] = True
+        print(f"\n🔁 Rodada {rodada}/{rodadas}: {len(transitorias)} URLs em "
+              f"{len({job['host'] for job in transitorias})} hosts")
+        executar(transitorias)
+
+    restantes = len(jobs_para_reprocessar(conn, vendor))
+    return total, descartadas, restantes
@@ -0,0 +1,233 @@
+"""Extração em shards: várias máquinas ou processos, cada um com seu BD.
+
+data/prefeituras.csv é dividido em N shards determinísticos pelo hash do host
+(a mesma prefeitura cai sempre no mesmo shard, em qualquer máquina). Cada
+shard roda o agendador só com as suas prefeituras e grava em
+bds/shards/<bd do vendor>.<i>de<N>.db; o comando juntar copia os shards para
+os BDs canônicos (bds/portaltp.db, bds/tectrilha.db, bds/agape&alphatec.db).
+
+    python src/shards.py dividir 4
+    python src/shards.py rodar 0 4 --inicio 01/2020 --fim 12/2024     # numa máquina
+    python src/shards.py processos 4 --inicio 01/2020 --fim 12/2024   # 4 processos locais
+    python src/shards.py juntar
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import os
+import subprocess
+import sys
+from urllib.parse import urlparse
+
+import pandas as pd
+
+import agendador
+from banco import criar_ledger
+from gravador import abrir_conexao
+from nucleo_http import normalizar_url, host_da_url
+from prioridades import trechos_endpoint
+from snapshots import carregar_snapshots
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARDS_DATA_DIR = os.path.join(BASE_DIR, 'data', 'shards')
+SHARDS_BDS_DIR = os.path.join(BASE_DIR, 'bds', 'shards')
+
+def shard_do_host(host, total):
+    """Shard de um host: md5 (estável entre processos e máquinas, ao contrário do hash() do Python)"""
+    return int(hashlib.md5(host.encode('utf-8')).hexdigest(), 16) % total
+
+def arquivo_prefeituras_shard(indice, total):
+    return os.path.join(SHARDS_DATA_DIR, f"prefeituras.{indice}de{total}.csv")
+
+def arquivo_bd_shard(db_file, indice, total):
+    nome, extensao = os.path.splitext(os.path.basename(db_file))
+    return os.path.join(SHARDS_BDS_DIR, f"{nome}.{indice}de{total}{extensao}")
+
+def dividir(prefeituras_file, total):
+    """Grava data/shards/prefeituras.<i>de<N>.csv e devolve as contagens por shard"""
+    prefeituras = pd.read_csv(prefeituras_file)
+    shards = prefeituras['url'].apply(lambda url: shard_do_host(host_da_url(normalizar_url(url)), total))
+    os.makedirs(SHARDS_DATA_DIR, exist_ok=True)
+    contagens = []
+    for indice in range(total):
+        parte = prefeituras[shards == indice]
+        parte.to_csv(arquivo_prefeituras_shard(indice, total), index=False)
+        contagens.append(len(parte))
+    return contagens
+
+def rodar_shard(indice, total, data_inicio, data_fim, vendors=tuple(agendador.VENDORS), revalidar=False,
+                max_workers=agendador.MAX_WORKERS, por_host=agendador.REQUISICOES_POR_HOST):
+    """Roda o agendador só com as prefeituras do shard, gravando nos BDs do shard"""
+    prefeituras_file = arquivo_prefeituras_shard(indice, total)
+    if not os.path.exists(prefeituras_file):
+        raise FileNotFoundError(f"{prefeituras_file} não existe: rode 'dividir {total}' antes")
+    os.makedirs(SHARDS_BDS_DIR, exist_ok=True)
+
+    def caminhos(modulo):
+        endpoints_file, _, db_file = modulo.caminhos_padrao()[:3]
+        return endpoints_file, prefeituras_file, arquivo_bd_shard(db_file, indice, total)
+
+    print(f"\n🧩 Shard {indice}/{total}")
+    planos = agendador.planejar(vendors, data_inicio, data_fim, revalidar, caminhos)
+    if any(jobs for _, jobs in planos.values()):
+        asyncio.run(agendador.executar_agendador(planos, max_workers, por_host))
+
+def rodar_processos(total, argumentos):
+    """Um processo local por shard (mesmos argumentos de 'rodar'); devolve os shards que falharam"""
+    processos = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), 'rodar', str(indice), str(total), *argumentos])
+        for indice in range(total)
+    ]
+    return [indice for indice, processo in enumerate(processos) if processo.wait() != 0]
+
+def juntar(vendors=tuple(agendador.VENDORS)):
+    """Copia todos os BDs de shard para os BDs canônicos.
+
+    Pode ser rodado de novo: as linhas dos períodos presentes no shard
+    substituem as do BD canônico, e no ledger fica a linha mais recente.
+    """
+    for vendor in vendors:
+        modulo = agendador.VENDORS[vendor]
+        db_file = modulo.caminhos_padrao()[2]
+        nome, extensao = os.path.splitext(os.path.basename(db_file))
+        shards = sorted(glob.glob(os.path.join(SHARDS_BDS_DIR, f"{glob.escape(nome)}.*de*{extensao}")))
+        if not shards:
+            continue
+
+        conn = abrir_conexao(db_file)
+        criar_ledger(conn)
+        for shard_file in shards:
+            linhas = juntar_shard(conn, shard_file, modulo.CHAVES, modulo.CHAVES_SNAPSHOT)
+            print(f"🧩 {os.path.basename(shard_file)} -> {os.path.basename(db_file)}: {linhas} linhas")
+        conn.close()
+
+def juntar_shard(conn, shard_file, chaves, chaves_snapshot=None):
+    """Copia um BD de shard para o canônico aberto em conn.
+
+    Nas tabelas de retrato (data/snapshots.csv) as linhas da prefeitura são
+    substituídas por chaves_snapshot: o retrato novo tem outro período e as
+    linhas do retrato anterior não podem sobreviver ao lado dele.
+    """
+    conn.execute("ATTACH DATABASE ? AS shard", (shard_file,))
+    try:
+        conn.execute("BEGIN")
+        linhas = 0
+        tabelas = conn.execute('''
+            SELECT name, sql FROM shard.sqlite_master
+            WHERE type = 'table' AND name NOT IN ('sqlite_sequence', 'crawl_jobs')
+        ''').fetchall()
+        retratos = tabelas_snapshot(conn) if chaves_snapshot else set()
+        for tabela, sql in tabelas:
+            linhas += copiar_tabela(conn, tabela, sql, chaves_snapshot if tabela in retratos else chaves)
+        copiar_ledger(conn)
+        conn.commit()
+        return linhas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+def tabelas_snapshot(conn):
+    """Endpoints do shard declarados como retrato, pelo nome ou pelo caminho da URL no ledger"""
+    declarados = carregar_snapshots()
+    if not declarados:
+        return set()
+    retratos = set()
+    for endpoint, url in conn.execute("SELECT endpoint, MAX(url) FROM shard.crawl_jobs GROUP BY endpoint"):
+        if any(trecho in declarados for trecho in trechos_endpoint(endpoint, urlparse(url or '').path)):
+            retratos.add(endpoint)
+    return retratos
+
+def copiar_tabela(conn, tabela, sql, chaves):
+    conn.execute(sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+    info_shard = conn.execute(f"PRAGMA shard.table_info({tabela})").fetchall()
+    colunas_shard = [col[1] for col in info_shard]
+    colunas_main = {col[1].lower() for col in conn.execute(f"PRAGMA main.table_info({tabela})").fetchall()}
+    for _, coluna, tipo, *_ in info_shard:
+        if coluna.lower() not in colunas_main:
+            conn.execute(f'ALTER TABLE main.{tabela} ADD COLUMN "{coluna}" {tipo}')
+
+    colunas = ', '.join(f'"{c}"' for c in colunas_shard if c != 'id')
+    # Tabela com chave primária própria (ex. unidades_gestoras, por host e UG): upsert nela.
+    # As chaves de dados do vendor não servem aqui: a mesma UG 2 existe em vários hosts
+    primaria = [col[1] for col in sorted(info_shard, key=lambda col: col[5]) if col[5] and col[1] != 'id']
+    if primaria:
+        atualizar = ', '.join(f'"{c}" = excluded."{c}"' for c in colunas_shard if c not in primaria and c != 'id')
+        conflito = f"DO UPDATE SET {atualizar}" if atualizar else "DO NOTHING"
+        cursor = conn.execute(f'''
+            INSERT INTO main.{tabela} ({colunas}) SELECT {colunas} FROM shard.{tabela} WHERE true
+            ON CONFLICT ({', '.join(primaria)}) {conflito}
+        ''')
+        return cursor.rowcount
+
+    # Re-juntar um shard substitui os períodos dele (no retrato, a prefeitura inteira) em vez de duplicar
+    chaves = [c for c in chaves if c in colunas_shard]
+    if chaves:
+        lista = ', '.join(chaves)
+        conn.execute(f'''
+            DELETE FROM main.{tabela}
+            WHERE ({lista}) IN (SELECT DISTINCT {lista} FROM shard.{tabela})
+        ''')
+
+    cursor = conn.execute(f'INSERT INTO main.{tabela} ({colunas}) SELECT {colunas} FROM shard.{tabela}')
+    return cursor.rowcount
+
+def copiar_ledger(conn):
+    colunas = [col[1] for col in conn.execute("PRAGMA shard.table_info(crawl_jobs)").fetchall()]
+    chave = ('vendor', 'endpoint', 'host', 'unidadegestora', 'periodo')
+    atualizar = ', '.join(f"{c} = excluded.{c}" for c in colunas if c not in chave)
+    lista = ', '.join(colunas)
+    conn.execute(f'''
+        INSERT INTO main.crawl_jobs ({lista}) SELECT {lista} FROM shard.crawl_jobs WHERE true
+        ON CONFLICT ({', '.join(chave)}) DO UPDATE SET {atualizar}
+        WHERE excluded.atualizado_em >= crawl_jobs.atualizado_em
+    ''')
+
+def ler_periodo(texto):
+    mes, ano = texto.split('/')
+    return int(ano), int(mes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extração dividida em shards por host")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    p = comandos.add_parser('dividir', help="divide data/prefeituras.csv em N shards")
+    p.add_argument('total', type=int)
+
+    for nome, ajuda in (('rodar', "roda um shard"), ('processos', "roda todos os shards em processos locais")):
+        p = comandos.add_parser(nome, help=ajuda)
+        if nome == 'rodar':
+            p.add_argument('indice', type=int)
+        p.add_argument('total', type=int)
+        p.add_argument('--inicio', required=True, help="MM/AAAA")
+        p.add_argument('--fim', required=True, help="MM/AAAA")
+        p.add_argument('--vendors', nargs='+', choices=list(agendador.VENDORS), default=list(agendador.VENDORS))
+        p.add_argument('--workers', type=int, default=0, help="requisições em paralelo (0 = uma por host)")
+        p.add_argument('--por-host', type=int, default=agendador.REQUISICOES_POR_HOST)
+
+    p = comandos.add_parser('juntar', help="junta os BDs de shard nos BDs canônicos")
+    p.add_argument('--vendors', nargs='+', choices=list(agendador.VENDORS), default=list(agendador.VENDORS))
+
+    args = parser.parse_args()
+    if args.comando == 'dividir':
+        prefeituras_file = agendador.portaltp.caminhos_padrao()[1]
+        for indice, quantidade in enumerate(dividir(prefeituras_file, args.total)):
+            print(f"🧩 Shard {indice}: {quantidade} prefeituras")
+    elif args.comando == 'rodar':
+        rodar_shard(args.indice, args.total, ler_periodo(args.inicio), ler_periodo(args.fim), args.vendors,
+                    max_workers=args.workers or None, por_host=args.por_host)
+    elif args.comando == 'processos':
+        falhos = rodar_processos(args.total, ['--inicio', args.inicio, '--fim', args.fim, '--vendors', *args.vendors,
+                                              '--workers', str(args.workers), '--por-host', str(args.por_host)])
+        if falhos:
+            print(f"\n🔴 Shards com erro: {falhos}")
+            sys.exit(1)
+        print("\n✅ Todos os shards concluídos. Rode 'juntar' para montar os BDs canônicos.")
+    elif args.comando == 'juntar':
+        juntar(args.vendors)
+        print("\n✅ BDs juntados.")
+
+if __name__ == "__main__":
+    main()
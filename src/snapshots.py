@@ -0,0 +1,94 @@
+"""Endpoints de retrato (snapshot): dados que não são fatos do mês.
+
+Bens imóveis, plano de cargos e afins devolvem o estado atual do cadastro,
+qualquer que seja o mês pedido. Pedi-los mês a mês gastava uma requisição por
+mês e gravava cópias quase iguais. Um endpoint de retrato é pedido uma vez por
+prefeitura (UG na tectrilha), com o último mês do intervalo, e só se o último
+retrato for mais velho que a cadência; o resultado substitui todas as linhas
+daquela prefeitura na tabela (inclusive as cópias mensais antigas).
+
+Um endpoint é de retrato se estiver em data/snapshots.csv (colunas padrao,
+cadencia_dias; mesmos padrões de prioridades.csv) ou se o ledger mostrar que
+pelo menos MIN_HOSTS_DETECCAO hosts receberam, cada um, sempre o mesmo corpo
+(não vazio) em MIN_PERIODOS_DETECCAO períodos ou mais, e nenhum host recebeu
+corpos diferentes. Cadência 0 pede o retrato em toda execução (uma vez, não uma
+por mês).
+
+Só o retrato declarado substitui o histórico da prefeitura. O detectado pelo
+ledger é um palpite (um portal quebrado também repete o corpo) e substitui
+apenas as linhas do mês em que foi pedido.
+"""
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from banco import endpoints_conteudo_repetido, PERIODO_SNAPSHOT
+from prioridades import trechos_endpoint
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARQUIVO_SNAPSHOTS = os.path.join(BASE_DIR, 'data', 'snapshots.csv')
+
+# Cadência dos endpoints detectados pelo ledger (não declarados)
+CADENCIA_PADRAO_DIAS = 30
+MIN_PERIODOS_DETECCAO = 3
+MIN_HOSTS_DETECCAO = 3
+
+def carregar_snapshots(filename=ARQUIVO_SNAPSHOTS):
+    """{padrão em minúsculas: cadência em dias}; vazio se o arquivo não existir"""
+    if not os.path.exists(filename):
+        return {}
+    try:
+        df = pd.read_csv(filename)
+        return {str(padrao).strip().lower(): int(dias) for padrao, dias in zip(df['padrao'], df['cadencia_dias'])}
+    except Exception as e:
+        print(f"\n🔴 ERRO ao ler arquivo de snapshots: {str(e)}")
+        return {}
+
+def cadencias_snapshot(conn, vendor, endpoints):
+    """({endpoint_name: cadência em dias} dos endpoints de retrato, set dos só detectados pelo ledger).
+
+    endpoints: {endpoint_name: caminho} (a linha do arquivo de endpoints, ex. MateriasBens/GetBensImoveis).
+    """
+    declarados = carregar_snapshots()
+    detectados = endpoints_conteudo_repetido(conn, vendor, MIN_PERIODOS_DETECCAO, MIN_HOSTS_DETECCAO)
+    cadencias = {}
+    so_detectados = []
+    for endpoint_name, caminho in endpoints.items():
+        casados = [declarados[t] for t in trechos_endpoint(endpoint_name, caminho) if t in declarados]
+        if casados:
+            cadencias[endpoint_name] = min(casados)
+        elif endpoint_name in detectados:
+            cadencias[endpoint_name] = CADENCIA_PADRAO_DIAS
+            so_detectados.append(endpoint_name)
+    if so_detectados:
+        print(f"📸 {vendor}: retratos detectados pelo ledger: {', '.join(so_detectados)}")
+    return cadencias, set(so_detectados)
+
+def snapshot_em_dia(registro, cadencia_dias, agora=None):
+    """Se o último retrato (linha de snapshots_ledger) ainda vale pela cadência"""
+    if registro is None or cadencia_dias <= 0:
+        return False
+    agora = agora or datetime.now()
+    return datetime.strptime(registro[0], "%Y-%m-%d %H:%M:%S") > agora - timedelta(days=cadencia_dias)
+
+def marcar_snapshot(job, registro=None, detectado=False):
+    """Transforma o job de um mês no job do retrato (com os validadores do último, se houver)"""
+    job['periodo'] = PERIODO_SNAPSHOT
+    job['snapshot'] = True
+    if detectado:
+        job['detectado'] = True
+    job['validadores'] = registro[1:] if registro else None
+    return job
+
+def chave_substituicao(job, chaves, chaves_snapshot):
+    """Linhas que o resultado do job substitui na tabela: o retrato inteiro da
+    prefeitura, o período na revalidação (e no retrato só detectado), ou nada
+    (job novo só acrescenta)"""
+    if job.get('snapshot') and not job.get('detectado'):
+        return {coluna: job[coluna] for coluna in chaves_snapshot}
+    if job.get('detectado'):
+        return {coluna: job[coluna] for coluna in chaves}
+    if job.get('revalidar'):
+        return {coluna: job[coluna] for coluna in chaves}
+    return None
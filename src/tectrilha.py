@@ -1,49 +1,71 @@
-import requests
+import asyncio
+import json
+import re
 import pandas as pd
 import sqlite3
-from time import sleep, time
+from time import time
 import os
 from datetime import datetime
-from urllib.parse import urlparse
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-def normalizar_url(url):
-    url = url.strip()
-    if not url.startswith('http'):
-        url = 'https://' + url.strip().lstrip('/')
-    return url.rstrip('/')
-
-def get_retry_session():
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=2, status_forcelist=[500, 502, 503, 504])
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    
-    # Adiciona um cabeçalho padrão de navegador
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36'
-    })
-    
-    return session
-
-
-def main():
+from urllib.parse import urlparse, parse_qs
+
+from nucleo_http import (ClienteHTTP, Resposta, normalizar_url, host_da_url, executar_jobs, workers_padrao,
+                         cabecalhos_condicionais, conteudo_inalterado, falha_por_tamanho)
+from controle_host import CircuitoAberto
+from gravador import GravadorSQLite
+from prioridades import prioridade_job
+from retentativas import indice_prefeituras, reprocessar_falhas, falha_registrada_por_tamanho
+from cache_negativo import vazio_em_dia
+from prazos import PrazosAprendidos
+from unidades_gestoras import atualizar_ugs, expandir_ugs, ENDPOINT_UGS
+from capacidades import matriz_capacidades, periodos_permitidos, resumo_capacidades
+from snapshots import (cadencias_snapshot, snapshot_em_dia, marcar_snapshot, chave_substituicao,
+                       CADENCIA_PADRAO_DIAS)
+from arquivo_bruto import ArquivoBruto, reproduzir_jobs
+from banco import (carregar_chaves_concluidas, criar_ledger, periodos_com_status, periodos_vazios, validadores_ledger,
+                   snapshots_ledger, maiores_respostas, falhas_ledger, ultimo_periodo, importar_log_legado, PERIODO_SNAPSHOT,
+                   STATUS_OK, STATUS_VAZIO, STATUS_ERRO, STATUS_ADIADO)
+
+VENDOR = 'tectrilha'
+
+MAX_WORKERS = 16
+REQUISICOES_POR_HOST = 2
+
+# Colunas que identificam um período já extraído e, nos endpoints de retrato, a UG
+CHAVES = ('municipio', 'prefeitura', 'unidadegestora', 'ano')
+CHAVES_SNAPSHOT = ('municipio', 'prefeitura', 'unidadegestora')
+
+# Revalidação: anos mais recentes (inclusive o atual) conferidos de novo, já que os portais revisam o passado recente
+ANOS_REVALIDACAO = 2
+
+# Assuntos com {periodo} nos parâmetros: um ano grande (ou que falha inteiro) é pedido
+# em fatias mensais, ao mesmo tempo, e as linhas voltam juntas para o mesmo ano
+FATIAS_ANO = [str(mes) for mes in range(1, 13)]
+# UG cuja maior resposta anual passou disso já é planejada em fatias
+TAMANHO_FATIAR = 10 * 1024 * 1024
+
+def caminhos_padrao():
+    """(assuntos, prefeituras, BD, log de erros, log de execução, last_run) do projeto"""
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     data_dir = os.path.join(base_dir, 'data')
     bds_dir = os.path.join(base_dir, 'bds')
     logs_dir = os.path.join(base_dir, 'logs')
 
-    assuntos_file = os.path.join(data_dir, 'assuntos_tectrilha.csv')  # Agora usamos o CSV de assuntos
-    prefeituras_file = os.path.join(data_dir, 'prefeituras.csv')
-    db_file = os.path.join(bds_dir, 'tectrilha.db')
-    error_log_file = os.path.join(logs_dir, 'tectrilha_errors.log')
-    execution_log_file = os.path.join(logs_dir, 'tectrilha_execution.log')
-    last_run_file = os.path.join(logs_dir, 'tectrilha_last_run.txt')
-
     os.makedirs(bds_dir, exist_ok=True)
     os.makedirs(logs_dir, exist_ok=True)
 
+    return (
+        os.path.join(data_dir, 'assuntos_tectrilha.csv'),
+        os.path.join(data_dir, 'prefeituras.csv'),
+        os.path.join(bds_dir, 'tectrilha.db'),
+        os.path.join(logs_dir, 'tectrilha_errors.log'),
+        os.path.join(logs_dir, 'tectrilha_execution.log'),
+        os.path.join(logs_dir, 'tectrilha_last_run.txt'),
+    )
+
+def main():
+    (assuntos_file, prefeituras_file, db_file,
+     error_log_file, execution_log_file, last_run_file) = caminhos_padrao()
+
     while True:
         print("\n" + "="*50)
         print("MENU PRINCIPAL - TECTRILHA DATA EXTRACTOR")
@@ -51,16 +73,17 @@ def main():
         print("1. Rodar código para um período específico")
         print("2. Rodar URLs que falharam (do arquivo de log)")
         print("3. Continuar extração desde o último ano")
-        print("4. Sair")
+        print(f"4. Revalidar os últimos {ANOS_REVALIDACAO} anos (regrava só o que mudou)")
+        print("5. Reconstruir as tabelas de um período a partir do arquivo (sem rede)")
+        print("6. Sair")
 
-        choice = input("\nEscolha uma opção (1-4): ")
+        choice = input("\nEscolha uma opção (1-6): ")
 
         if choice == '1':
             start_time = time()
             log_execution(execution_log_file, "Opção 1: Rodar código para período específico")
             ano_inicio, ano_fim = get_periodo_usuario()
-            run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, error_log_file)
-            save_last_run(last_run_file, ano_fim)
+            run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '2':
@@ -72,17 +95,31 @@ def main():
         elif choice == '3':
             start_time = time()
             log_execution(execution_log_file, "Opção 3: Continuar desde último ano")
-            last_year = get_last_run(last_run_file)
+            last_year = get_last_run(db_file, last_run_file)
             if last_year is None:
                 print("\n🔴 Nenhuma execução anterior encontrada. Use a opção 1 primeiro.")
                 continue
 
+            # O último ano entra de novo: o que já foi extraído é pulado pelo ledger
             current_year = datetime.now().year
-            run_extraction(last_year + 1, current_year, assuntos_file, prefeituras_file, db_file, error_log_file)
-            save_last_run(last_run_file, current_year)
+            run_extraction(last_year, current_year, assuntos_file, prefeituras_file, db_file)
             log_execution_time(execution_log_file, start_time)
 
         elif choice == '4':
+            start_time = time()
+            log_execution(execution_log_file, "Opção 4: Revalidar últimos anos")
+            ano_inicio, ano_fim = periodo_revalidacao()
+            run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, revalidar=True)
+            log_execution_time(execution_log_file, start_time)
+
+        elif choice == '5':
+            start_time = time()
+            log_execution(execution_log_file, "Opção 5: Reconstruir a partir do arquivo")
+            ano_inicio, ano_fim = get_periodo_usuario()
+            run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, reproduzir=True)
+            log_execution_time(execution_log_file, start_time)
+
+        elif choice == '6':
             print("\nSaindo...")
             break
 
@@ -113,24 +150,74 @@ def get_periodo_usuario():
         except ValueError:
             print("🔴 Formato inválido. Use AAAA (ex: 2024). Tente novamente.")
 
-def run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, error_log_file):
+def run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file,
+                   max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST, revalidar=False, reproduzir=False):
+    """Extrai o período. Com revalidar=True os anos já baixados também são
+    requisitados, de forma condicional, e só regravados se o conteúdo mudou.
+    Com reproduzir=True as tabelas do período são reconstruídas a partir do
+    arquivo de respostas brutas, sem rede."""
+    if reproduzir:
+        # Todos os anos do intervalo, baixados ou não; só os que estão no arquivo são reprocessados
+        jobs = planejar_extracao(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, revalidar=True,
+                                 reproduzir=True)
+        asyncio.run(reproduzir_jobs(jobs, db_file, processar_job, max_workers))
+        print("\n\n✅ RECONSTRUÇÃO CONCLUÍDA!")
+        return
+
+    jobs = planejar_extracao(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, revalidar)
+    if not jobs:
+        return
+
+    max_workers = workers_padrao(jobs, max_workers)
+    print(f"🔧 {max_workers} em paralelo, {por_host} por host")
+    asyncio.run(executar_extracao(jobs, db_file, max_workers, por_host))
+
+    print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
+
+def planejar_extracao(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file, revalidar=False,
+                      reproduzir=False):
+    """Cria as tabelas e o ledger e devolve os jobs (um por assunto x UG x ano) ainda pendentes.
+
+    Com reproduzir=True (reconstrução a partir do arquivo) nada vai para a rede:
+    valem só as UGs já guardadas no BD."""
     assuntos = load_assuntos(assuntos_file)  # Carrega os assuntos e parâmetros do CSV
     prefeituras = load_prefeituras(prefeituras_file)
     prefeituras_tectrilha = prefeituras[prefeituras['empresa'] == 'tectrilha']
 
     if prefeituras_tectrilha.empty:
         print("\n🔴 Nenhuma prefeitura com empresa 'tectrilha' encontrada.")
-        return
+        return []
 
-    session = get_retry_session()
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
+    criar_ledger(conn)
+    jobs = []
+
+    # Assuntos com {unidadeGestoraId} vão para todas as UGs que o portal lista, não só a do CSV
+    if not reproduzir and assuntos['parametros'].str.contains('{unidadeGestoraId}', regex=False).any():
+        atualizar_ugs(conn, prefeituras_tectrilha)
+    prefeituras_ugs = expandir_ugs(conn, prefeituras_tectrilha)
+
+    # Endpoints de retrato: um pedido por UG com o último ano, quando o retrato anterior venceu.
+    # Assunto sem {exercicio} nos parâmetros devolve a mesma URL todo ano: também é retrato
+    cadencias, detectados = cadencias_snapshot(conn, VENDOR, {assunto: assunto for assunto in assuntos['assunto']})
+    for _, assunto in assuntos.iterrows():
+        parametros = assunto['parametros'] if pd.notna(assunto['parametros']) else ""
+        if '{exercicio}' not in parametros:
+            cadencias.setdefault(assunto['assunto'], CADENCIA_PADRAO_DIAS)
+            # Mesma URL todo ano: é retrato pela própria URL, não por palpite do ledger
+            detectados.discard(assunto['assunto'])
+    # Assuntos que o portal recusa sempre (400/404) ficam de fora, salvo a sonda da rechecagem
+    capacidades = matriz_capacidades(conn, VENDOR)
+    resumo_capacidades(VENDOR, capacidades)
+    # Anos que falharam por tamanho (timeout, 5xx): DNS, conexão e 4xx não melhoram em fatias
+    falhas_tamanho = {(falha['endpoint_name'], falha['host'], falha['unidadegestora'])
+                      for falha in falhas_ledger(conn, VENDOR)
+                      if falha['status'] == STATUS_ERRO and falha_registrada_por_tamanho(falha)}
 
     for _, assunto in assuntos.iterrows():
         endpoint_name = assunto['assunto']
         parametros = assunto['parametros'].strip() if pd.notna(assunto['parametros']) else ""
-        
-        print(f"\n{'='*50}\n🔧 Processando endpoint: {endpoint_name}")
 
         cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS {endpoint_name} (
@@ -142,201 +229,271 @@ def run_extraction(ano_inicio, ano_fim, assuntos_file, prefeituras_file, db_file
             )
         ''')
         conn.commit()
-
-        for _, prefeitura in prefeituras_tectrilha.iterrows():
+        alvo = prefeituras_ugs if '{unidadeGestoraId}' in parametros else prefeituras_tectrilha
+        if endpoint_name in cadencias:
+            retratos = snapshots_ledger(conn, VENDOR, endpoint_name)
+            for _, prefeitura in alvo.iterrows():
+                unidade_gestora = str(int(prefeitura['unidadegestora']))
+                base_url = normalizar_url(prefeitura['url']).rstrip('/api')
+                host = host_da_url(base_url)
+                registro = retratos.get((host, unidade_gestora))
+                if not periodos_permitidos(capacidades, host, endpoint_name, [ano_fim]):
+                    continue
+                if revalidar or not snapshot_em_dia(registro, cadencias[endpoint_name]):
+                    job = montar_job(montar_url(base_url, endpoint_name, parametros, unidade_gestora, ano_fim),
+                                     endpoint_name, prefeitura['municipio'], prefeitura['prefeitura'],
+                                     unidade_gestora, ano_fim)
+                    jobs.append(marcar_snapshot(job, registro, endpoint_name in detectados))
+            continue
+        concluidos = carregar_chaves_concluidas(conn, endpoint_name, CHAVES)
+        finalizados = periodos_com_status(conn, VENDOR, endpoint_name, (STATUS_OK,))
+        vazios = periodos_vazios(conn, VENDOR, endpoint_name)
+        validadores = validadores_ledger(conn, VENDOR, endpoint_name) if revalidar else {}
+        # UGs com resposta anual grande ou com ano que falhou por tamanho vão direto para as fatias
+        fatiar = {chave for chave, tamanho in maiores_respostas(conn, VENDOR, endpoint_name).items()
+                  if tamanho >= TAMANHO_FATIAR}
+        fatiar |= {(host, ug) for endpoint, host, ug in falhas_tamanho if endpoint == endpoint_name}
+
+        for _, prefeitura in alvo.iterrows():
             municipio = prefeitura['municipio']
             prefeitura_nome = prefeitura['prefeitura']
             unidade_gestora = str(int(prefeitura['unidadegestora']))
             base_url = normalizar_url(prefeitura['url']).rstrip('/api')
-            print(f"\n🏛️ Prefeitura: {prefeitura_nome} ({municipio}) - UG: {unidade_gestora}")
-
-            for ano in range(ano_inicio, ano_fim + 1):
-                print(f"📅 {ano}", end=' ', flush=True)
-                cursor.execute(f'''
-                    SELECT 1 FROM {endpoint_name} 
-                    WHERE municipio = ? AND prefeitura = ? AND unidadegestora = ? AND ano = ?
-                    LIMIT 1
-                ''', (municipio, prefeitura_nome, unidade_gestora, ano))
-
-                if cursor.fetchone():
-                    print("✅ Já existe no BD", end=' ')
+            host = host_da_url(base_url)
+
+            for ano in periodos_permitidos(capacidades, host, endpoint_name, range(ano_inicio, ano_fim + 1)):
+                periodo = (host, unidade_gestora, str(ano))
+                ja_baixado = ((municipio, prefeitura_nome, unidade_gestora, ano) in concluidos or periodo in finalizados
+                              or vazio_em_dia(vazios.get(periodo), ano))
+                if ja_baixado and not revalidar:
                     continue
 
-                # Substitui os placeholders nos parâmetros
-                url_params = parametros.format(
-                    unidadeGestoraId=unidade_gestora,
-                    exercicio=ano,
-                    periodo=""
-                ).strip()
-
-                # Remove espaços em branco e adiciona '?' se houver parâmetros
-                if url_params:
-                    if not url_params.startswith('?'):
-                        url_params = '?' + url_params
-                    url_params = url_params.replace(' ', '')
-
-                url = f"{base_url}/api/{endpoint_name}{url_params}"
-                try:
-                    response = session.get(url, timeout=30)
-                    response.raise_for_status()
-                    if not response.content.strip():
-                        print("🟡 Resposta vazia. Ignorando.", end=' ')
-                        continue
-                    dados = response.json()
-                    df = pd.DataFrame(dados)
-
-                    if not df.empty:
-                        # Remove colunas que já existem para evitar conflito
-                        df = df.drop(columns=['municipio', 'prefeitura', 'unidadegestora', 'ano'], errors='ignore')
-
-                        # Adiciona colunas fixas manualmente
-                        df['municipio'] = municipio
-                        df['prefeitura'] = prefeitura_nome
-                        df['unidadegestora'] = unidade_gestora
-                        df['ano'] = ano
-
-                        cursor.execute(f"PRAGMA table_info({endpoint_name})")
-                        existing_columns = [col[1] for col in cursor.fetchall()]
-
-                        for column in df.columns:
-                            if column.lower() not in [col.lower() for col in existing_columns] and column != 'id':
-                                col_type = 'TEXT'
-                                if pd.api.types.is_numeric_dtype(df[column]):
-                                    col_type = 'REAL'
-                                elif pd.api.types.is_integer_dtype(df[column]):
-                                    col_type = 'INTEGER'
-                                cursor.execute(f"ALTER TABLE {endpoint_name} ADD COLUMN {column} {col_type}")
-                                conn.commit()
-
-                        df.to_sql(endpoint_name, conn, if_exists='append', index=False)
-                        print("✅ Dados salvos", end=' ')
-
-                except Exception as e:
-                    print(f"🔴 ERRO: {str(e)}", end=' ')
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    with open(error_log_file, 'a') as f:
-                        f.write(f"{timestamp}|{url}|{type(e).__name__}|{str(e)}\n")
-                sleep(1)
+                url = montar_url(base_url, endpoint_name, parametros, unidade_gestora, ano)
+                job = montar_job(url, endpoint_name, municipio, prefeitura_nome, unidade_gestora, ano)
+                if fatiavel(url) and (host, unidade_gestora) in fatiar:
+                    job['fatiar'] = True
+                if ja_baixado:
+                    job['revalidar'] = True
+                    job['validadores'] = validadores.get(periodo)
+                jobs.append(job)
 
+    # A gravação fica com o GravadorSQLite (conexão própria)
     conn.close()
-    print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
+    print(f"\n🔧 {VENDOR}: {len(jobs)} requisições pendentes ({len(assuntos)} assuntos x "
+          f"{len(prefeituras_ugs)} UGs x {ano_fim - ano_inicio + 1} anos)")
+    return jobs
+
+def montar_url(base_url, endpoint_name, parametros, unidade_gestora, ano):
+    # Substitui os placeholders nos parâmetros
+    url_params = parametros.format(
+        unidadeGestoraId=unidade_gestora,
+        exercicio=ano,
+        periodo=""
+    ).strip()
+
+    # Remove espaços em branco e adiciona '?' se houver parâmetros
+    if url_params:
+        if not url_params.startswith('?'):
+            url_params = '?' + url_params
+        url_params = url_params.replace(' ', '')
+
+    return f"{base_url}/api/{endpoint_name}{url_params}"
+
+def montar_job(url, endpoint_name, municipio, prefeitura_nome, unidade_gestora, ano):
+    return {
+        'vendor': VENDOR,
+        'url': url,
+        'host': host_da_url(url),
+        'endpoint_name': endpoint_name,
+        'municipio': municipio,
+        'prefeitura': prefeitura_nome,
+        'unidadegestora': unidade_gestora,
+        'periodo': str(ano),
+        'ano': ano,
+    }
+
+async def executar_extracao(jobs, db_file, max_workers, por_host, timeout=30, retentativa=False):
+    """timeout é o padrão dos pares (host, endpoint) ainda sem histórico de latência
+    e, no reprocessamento (retentativa=True), o piso de todos"""
+    arquivo = ArquivoBruto()
+    prazos = PrazosAprendidos.do_banco(db_file, VENDOR, timeout, retentativa)
+    print(f"⏱️ Timeouts: {prazos}")
+    with GravadorSQLite(db_file, arquivo=arquivo) as gravador:
+        async with ClienteHTTP(por_host=por_host, arquivo=arquivo) as cliente:
+            async def processar(job):
+                await processar_job(cliente, gravador, job, prazos.para(job))
+            await executar_jobs(jobs, processar, max_workers, por_host, prioridade_job, cliente.disjuntores)
+        print(f"\n🔌 Pool: {cliente.estatisticas}")
+
+async def processar_job(cliente, gravador, job, timeout=30):
+    """Ponto de entrada de um job (também usado pelo agendador)"""
+    await processar_ano(cliente, gravador, job, timeout)
+
+async def processar_ano(cliente, gravador, job, timeout=30):
+    endpoint_name = job['endpoint_name']
+    prefixo = f"[{job['municipio']} UG {job['unidadegestora']}] {endpoint_name} {job['ano']}"
+    # Na revalidação o ano inteiro é substituído se o conteúdo mudou (no retrato, a UG inteira)
+    chave = chave_substituicao(job, CHAVES, CHAVES_SNAPSHOT)
+    try:
+        validadores = job.get('validadores')
+        response = await baixar_ano(cliente, job, timeout, cabecalhos_condicionais(validadores), prefixo)
+        if chave and conteudo_inalterado(response, validadores):
+            print(f"🔁 {prefixo}: Sem mudanças")
+            if job.get('snapshot'):
+                # A cadência do retrato conta a partir desta conferência
+                await gravador.enviar(job, conferido=True)
+            return
+        if not response.content.strip():
+            print(f"🟡 {prefixo}: Resposta vazia. Ignorando.")
+            await gravador.enviar(job, STATUS_VAZIO, resposta=response, tabela=endpoint_name, chave=chave,
+                                  limpar=chave is not None)
+            return
+        dados = response.json()
+        df = pd.DataFrame(dados)
+
+        if df.empty:
+            await gravador.enviar(job, STATUS_VAZIO, resposta=response, tabela=endpoint_name, chave=chave,
+                                  limpar=chave is not None)
+            return
+
+        # Remove colunas que já existem para evitar conflito
+        df = df.drop(columns=['municipio', 'prefeitura', 'unidadegestora', 'ano'], errors='ignore')
+
+        # Adiciona colunas fixas manualmente
+        df['municipio'] = job['municipio']
+        df['prefeitura'] = job['prefeitura']
+        df['unidadegestora'] = job['unidadegestora']
+        df['ano'] = job['ano']
+
+        await gravador.enviar(job, STATUS_OK, resposta=response, tabela=endpoint_name, df=df, chave=chave,
+                              limpar=chave is not None)
+        print(f"✅ {prefixo}: Dados salvos")
+
+    except CircuitoAberto as e:
+        print(f"⏸️ {prefixo}: {e}")
+        await gravador.enviar(job, STATUS_ADIADO, erro=e)
 
-def run_failed_urls(error_log_file, assuntos_file, prefeituras_file, db_file):
-    if not os.path.exists(error_log_file):
-        print("\n🔴 Nenhum arquivo de log de erros encontrado.")
-        return
+    except Exception as e:
+        print(f"🔴 {prefixo}: ERRO: {str(e)}")
+        await gravador.enviar(job, STATUS_ERRO, erro=e)
 
-    failed_urls = []
-    with open(error_log_file, 'r') as f:
-        for line in f:
-            partes = line.strip().split('|')
-            if len(partes) >= 2:
-                failed_urls.append(partes[1])
+class FatiasIguais(Exception):
+    """As fatias do ano vieram todas iguais: o portal não filtra pelo periodo"""
 
-    if not failed_urls:
-        print("\n✅ Nenhuma URL com erro para reprocessar.")
-        return
+def fatiavel(url):
+    return 'periodo' in parse_qs(urlparse(url).query, keep_blank_values=True)
 
-    print(f"\n🔧 Reprocessando {len(failed_urls)} URLs com erro")
-    session = get_retry_session()
-    prefeituras = load_prefeituras(prefeituras_file)
-    assuntos = load_assuntos(assuntos_file)
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    success_count = 0
-    temp_error_file = error_log_file + ".temp"
+def url_fatia(url, fatia):
+    return re.sub(r'([?&]periodo=)[^&]*', lambda m: m.group(1) + fatia, url)
 
-    for url in failed_urls:
-        try:
-            print(f"🔁 Tentando novamente: {url}", end=' ', flush=True)
-            url = normalizar_url(url).replace('//', '/').replace('https:/', 'https://')
-            parsed = urlparse(url)
-            base_url = f"{parsed.scheme}://{parsed.netloc}"
-            
-            if '?' not in url:
-                print("🟡 URL sem parâmetros. Ignorando.")
-                continue
+async def baixar_ano(cliente, job, timeout, cabecalhos, prefixo):
+    """O ano inteiro numa requisição ou, se o job pedir ou o ano inteiro falhar, em fatias"""
+    if job.get('fatiar'):
+        return await baixar_fatiado(cliente, job, timeout)
+    try:
+        return await cliente.get(job['url'], timeout=timeout, cabecalhos=cabecalhos)
+    except Exception as e:
+        if job.get('snapshot') or not fatiavel(job['url']) or not falha_por_tamanho(e):
+            raise
+        print(f"✂️ {prefixo}: {type(e).__name__} no ano inteiro, pedindo em {len(FATIAS_ANO)} fatias")
+        return await baixar_fatiado(cliente, job, timeout)
+
+async def baixar_fatiado(cliente, job, timeout):
+    """Pede as fatias do ano ao mesmo tempo e devolve uma Resposta só, com as linhas de todas na ordem.
+
+    Só o corpo costurado é arquivado, sob a URL do ano: a reprodução lê o ano
+    de uma vez e as fatias não são resposta de nenhum job.
+    """
+    respostas = await asyncio.gather(*(cliente.get(url_fatia(job['url'], fatia), timeout=timeout, arquivar=False)
+                                       for fatia in FATIAS_ANO))
+    cheias = [resposta for resposta in respostas if resposta.content.strip()]
+    if len(cheias) > 1 and len({resposta.hash for resposta in cheias}) == 1:
+        # O portal ignorou o periodo e devolveu o mesmo conteúdo em todas: costurar duplicaria as linhas
+        raise FatiasIguais(f"{len(cheias)} fatias com o mesmo conteúdo para {job['url']}")
+    registros = []
+    for resposta in cheias:
+        dados = resposta.json()
+        registros.extend(dados if isinstance(dados, list) else [dados])
+    conteudo = json.dumps(registros, ensure_ascii=False).encode('utf-8') if registros else b''
+    costurada = Resposta(job['url'], 200, {}, conteudo, max(resposta.latencia for resposta in respostas))
+    if cliente.arquivo is not None:
+        await asyncio.to_thread(cliente.arquivo.guardar, conteudo, costurada.hash)
+    return costurada
+
+def run_failed_urls(error_log_file, assuntos_file, prefeituras_file, db_file,
+                    max_workers=MAX_WORKERS, por_host=REQUISICOES_POR_HOST):
+    conn = sqlite3.connect(db_file)
+    criar_ledger(conn)
 
-            # Extrai o endpoint_name do path (parte após /api/)
-            path_parts = parsed.path.split('/')
-            if 'api' in path_parts:
-                api_index = path_parts.index('api')
-                if api_index + 1 < len(path_parts):
-                    endpoint_name = path_parts[api_index + 1].split('?')[0]
-                else:
-                    print("🟡 URL malformada. Ignorando.")
-                    continue
+    # O log de erros antigo (pipe-delimitado) é importado para o ledger uma única vez
+    prefeituras = load_prefeituras(prefeituras_file)
+    indice = indice_prefeituras(prefeituras, 'tectrilha')
+    importados = importar_log_legado(conn, error_log_file, lambda url: job_da_url(url, indice))
+    if importados:
+        print(f"\n📥 {importados} falhas do log antigo importadas para o ledger")
+
+    def executar(jobs):
+        # A lista de UGs não é um assunto: o planejamento pede de novo a que falhou
+        jobs = [job for job in jobs if job['endpoint_name'] != ENDPOINT_UGS]
+        for job in jobs:
+            if job['periodo'] == PERIODO_SNAPSHOT:
+                # O retrato foi pedido com o último ano do intervalo (ou sem exercício nenhum)
+                params = parse_qs(urlparse(job['url']).query)
+                job['ano'] = int(params.get('exercicio', [datetime.now().year])[0])
+                job['snapshot'] = True
             else:
-                print("🟡 URL não contém 'api'. Ignorando.")
-                continue
+                job['ano'] = int(job['periodo'])
+        asyncio.run(executar_extracao(jobs, db_file, max_workers, por_host, timeout=60, retentativa=True))
 
-            query_params = parsed.query
-            params_dict = dict(param.split('=', 1) for param in query_params.split('&') if '=' in param)
-            
-            ano = int(params_dict.get('exercicio', 0))
-            unidade_gestora = params_dict.get('unidadegestoraId', '')
-
-            prefeitura_match = prefeituras[
-                (prefeituras['url'].str.strip().apply(normalizar_url) == base_url) & 
-                (prefeituras['unidadegestora'] == unidade_gestora)
-            ]
-            
-            if prefeitura_match.empty:
-                print("🟡 Prefeitura não encontrada. Ignorando.")
-                continue
+    total, descartadas, restantes = reprocessar_falhas(conn, VENDOR, executar)
+    conn.close()
+    if not total:
+        print("\n✅ Nenhuma URL com erro para reprocessar.")
+        return
+    print(f"\n✅ Concluído! {total - descartadas - restantes}/{total} URLs reprocessadas com sucesso "
+          f"({descartadas} descartadas, {restantes} ainda com erro).")
 
-            prefeitura = prefeitura_match.iloc[0]
-            municipio = prefeitura['municipio']
-            prefeitura_nome = prefeitura['prefeitura']
+def job_da_url(url, indice):
+    """Monta o job a partir de uma URL do log antigo (None se não der para identificar).
 
-            response = session.get(url, timeout=60)
-            response.raise_for_status()
-            if not response.content.strip():
-                print("🟡 Resposta vazia. Ignorando.")
-                continue
+    indice: {host: prefeitura} do indice_prefeituras.
+    """
+    url = normalizar_url(url)
+    parsed = urlparse(url)
 
-            dados = response.json()
-            df = pd.DataFrame(dados)
-
-            if not df.empty:
-                df['municipio'] = municipio
-                df['prefeitura'] = prefeitura_nome
-                df['unidadegestora'] = unidade_gestora
-                df['ano'] = ano
-
-                cursor.execute(f"PRAGMA table_info({endpoint_name})")
-                existing_columns = [col[1] for col in cursor.fetchall()]
-
-                for column in df.columns:
-                    if column not in existing_columns and column != 'id':
-                        col_type = 'TEXT'
-                        if pd.api.types.is_numeric_dtype(df[column]):
-                            col_type = 'REAL'
-                        elif pd.api.types.is_integer_dtype(df[column]):
-                            col_type = 'INTEGER'
-                        cursor.execute(f"ALTER TABLE {endpoint_name} ADD COLUMN {column} {col_type}")
-                        conn.commit()
-
-                df.to_sql(endpoint_name, conn, if_exists='append', index=False)
-                success_count += 1
-                print("✅ Sucesso")
-
-        except Exception as e:
-            print(f"🔴 Falhou novamente: {str(e)}")
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(temp_error_file, 'a') as f:
-                f.write(f"{timestamp}|{url}|{type(e).__name__}|{str(e)}\n")
-        sleep(1)
+    # Extrai o endpoint_name do path (parte após /api/)
+    path_parts = parsed.path.split('/')
+    if 'api' not in path_parts or path_parts.index('api') + 1 >= len(path_parts):
+        return None
+    endpoint_name = path_parts[path_parts.index('api') + 1]
 
-    conn.close()
-    os.replace(temp_error_file, error_log_file)
-    print(f"\n✅ Concluído! {success_count}/{len(failed_urls)} URLs reprocessadas com sucesso.")
+    params_dict = dict(param.split('=', 1) for param in parsed.query.split('&') if '=' in param)
+    try:
+        ano = int(params_dict.get('exercicio', 0))
+    except ValueError:
+        return None
 
-def save_last_run(last_run_file, ano):
-    with open(last_run_file, 'w') as f:
-        f.write(str(ano))
+    prefeitura = indice.get(host_da_url(url))
+    if prefeitura is None or not ano:
+        return None
 
-def get_last_run(last_run_file):
+    unidade_gestora = params_dict.get('unidadeGestoraId') or str(int(prefeitura['unidadegestora']))
+    return montar_job(url, endpoint_name, prefeitura['municipio'], prefeitura['prefeitura'], unidade_gestora, ano)
+
+def periodo_revalidacao():
+    """Os últimos ANOS_REVALIDACAO anos, inclusive o atual"""
+    current_year = datetime.now().year
+    return current_year - ANOS_REVALIDACAO + 1, current_year
+
+def get_last_run(db_file, last_run_file):
+    """Último ano registrado no ledger; o arquivo last_run antigo serve de fallback"""
+    if os.path.exists(db_file):
+        conn = sqlite3.connect(db_file)
+        criar_ledger(conn)
+        periodo = ultimo_periodo(conn, VENDOR)
+        conn.close()
+        if periodo:
+            return int(periodo)
     if not os.path.exists(last_run_file):
         return None
     with open(last_run_file, 'r') as f:
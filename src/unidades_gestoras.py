@@ -0,0 +1,141 @@
+"""Descoberta das unidades gestoras (UGs) de cada portal da tectrilha.
+
+O prefeituras.csv traz uma UG por município, então contratos, diárias,
+convênios, passagens e receitas (os assuntos com {unidadeGestoraId}) só saíam
+da UG cadastrada. A lista de UGs de cada portal é pedida a ENDPOINT_UGS e
+guardada na tabela unidades_gestoras do BD; o planejamento espalha esses
+assuntos por todas as UGs e a fila justa cuida do limite por host.
+
+O pedido da lista entra no ledger como um retrato (período snapshot): só é
+repetido depois de CADENCIA_DIAS, e um portal que não tem o endpoint cai na
+matriz de capacidades como qualquer outro. Sem lista (portal sem o endpoint,
+falha), vale a UG do prefeituras.csv.
+"""
+import asyncio
+from datetime import datetime
+
+import pandas as pd
+
+from nucleo_http import ClienteHTTP, normalizar_url, host_da_url
+from banco import registrar_job, snapshots_ledger, PERIODO_SNAPSHOT, STATUS_OK, STATUS_VAZIO, STATUS_ERRO
+from capacidades import matriz_capacidades, periodos_permitidos
+from snapshots import snapshot_em_dia
+
+VENDOR = 'tectrilha'
+ENDPOINT_UGS = 'unidadesGestoras'
+CADENCIA_DIAS = 30
+
+# Nomes de campo já vistos para o código e o nome da UG na lista
+CAMPOS_ID = ('unidadeGestoraId', 'id', 'codigo', 'codigoUnidadeGestora')
+CAMPOS_NOME = ('nome', 'descricao', 'nomeUnidadeGestora', 'unidadeGestora')
+
+def criar_tabela(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS unidades_gestoras (
+            host TEXT NOT NULL,
+            unidadegestora TEXT NOT NULL,
+            nome TEXT,
+            descoberto_em TEXT,
+            PRIMARY KEY (host, unidadegestora)
+        )
+    ''')
+    conn.commit()
+
+def _primeiro(item, campos):
+    for campo in campos:
+        if item.get(campo) not in (None, ''):
+            return item[campo]
+    return None
+
+def extrair_ugs(dados):
+    """[(código, nome)] de uma lista de UGs; itens sem código numérico ficam de fora"""
+    ugs = []
+    for item in dados if isinstance(dados, list) else []:
+        if not isinstance(item, dict):
+            continue
+        codigo = _primeiro(item, CAMPOS_ID)
+        try:
+            codigo = str(int(codigo))
+        except (TypeError, ValueError):
+            continue
+        ugs.append((codigo, _primeiro(item, CAMPOS_NOME)))
+    return ugs
+
+def job_descoberta(prefeitura):
+    base_url = normalizar_url(prefeitura['url']).rstrip('/api')
+    url = f"{base_url}/api/{ENDPOINT_UGS}"
+    return {
+        'vendor': VENDOR,
+        'url': url,
+        'host': host_da_url(url),
+        'endpoint_name': ENDPOINT_UGS,
+        'municipio': prefeitura['municipio'],
+        'prefeitura': prefeitura['prefeitura'],
+        'unidadegestora': '',
+        'periodo': PERIODO_SNAPSHOT,
+    }
+
+async def descobrir(jobs, timeout):
+    """{host: (resposta, erro)} pedindo as listas de todos os portais ao mesmo tempo"""
+    async with ClienteHTTP() as cliente:
+        async def pedir(job):
+            try:
+                return job['host'], (await cliente.get(job['url'], timeout=timeout), None)
+            except Exception as e:
+                return job['host'], (None, e)
+        return dict(await asyncio.gather(*(pedir(job) for job in jobs)))
+
+def atualizar_ugs(conn, prefeituras, timeout=30):
+    """Pede a lista de UGs aos portais com a lista vencida e grava o que vier"""
+    criar_tabela(conn)
+    ultimos = snapshots_ledger(conn, VENDOR, ENDPOINT_UGS)
+    capacidades = matriz_capacidades(conn, VENDOR)
+    pendentes = {}
+    for _, prefeitura in prefeituras.iterrows():
+        job = job_descoberta(prefeitura)
+        if job['host'] in pendentes or snapshot_em_dia(ultimos.get((job['host'], '')), CADENCIA_DIAS):
+            continue
+        if periodos_permitidos(capacidades, job['host'], ENDPOINT_UGS, [PERIODO_SNAPSHOT]):
+            pendentes[job['host']] = job
+    if not pendentes:
+        return
+
+    print(f"🏛️ {VENDOR}: buscando as unidades gestoras de {len(pendentes)} portais")
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for host, (resposta, erro) in asyncio.run(descobrir(list(pendentes.values()), timeout)).items():
+        job = pendentes[host]
+        if erro is not None:
+            print(f"🔴 [{job['municipio']}] unidades gestoras: {erro}")
+            registrar_job(conn, job, STATUS_ERRO, erro=erro)
+            continue
+        try:
+            ugs = extrair_ugs(resposta.json()) if resposta.content.strip() else []
+        except ValueError as e:
+            registrar_job(conn, job, STATUS_ERRO, resposta=resposta, erro=e)
+            continue
+        conn.executemany('''
+            INSERT INTO unidades_gestoras (host, unidadegestora, nome, descoberto_em) VALUES (?, ?, ?, ?)
+            ON CONFLICT (host, unidadegestora) DO UPDATE SET nome = excluded.nome, descoberto_em = excluded.descoberto_em
+        ''', [(host, codigo, nome, agora) for codigo, nome in ugs])
+        registrar_job(conn, job, STATUS_OK if ugs else STATUS_VAZIO, resposta=resposta, linhas=len(ugs))
+        print(f"🏛️ [{job['municipio']}] {len(ugs)} unidades gestoras")
+
+def expandir_ugs(conn, prefeituras):
+    """Uma linha de prefeitura por UG conhecida do portal (a do CSV sempre entra)"""
+    criar_tabela(conn)
+    conhecidas = {}
+    for host, codigo in conn.execute("SELECT host, unidadegestora FROM unidades_gestoras ORDER BY host, unidadegestora"):
+        conhecidas.setdefault(host, []).append(codigo)
+
+    linhas = []
+    vistas = set()
+    for _, prefeitura in prefeituras.iterrows():
+        host = host_da_url(normalizar_url(prefeitura['url']).rstrip('/api'))
+        for codigo in [str(int(prefeitura['unidadegestora']))] + conhecidas.get(host, []):
+            if (host, codigo) in vistas:
+                continue
+            vistas.add((host, codigo))
+            linha = prefeitura.copy()
+            linha['unidadegestora'] = codigo
+            linhas.append(linha)
+    return pd.DataFrame(linhas, columns=prefeituras.columns)
@@ -16,6 +16,19 @@ from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.options import Options
 
+_session = None
+
+def get_session():
+    """Sessão única para os downloads de todos os IDs: as conexões com o portal são reaproveitadas"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        # Adicionar headers para parecer um browser real no requests
+        _session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        })
+    return _session
+
 def extrair_e_baixar_documentos_com_selenium(url_pagina, base_url, pasta_downloads, banco_de_dados, id_pagina):
 
     print(f"📄 Iniciando processo com Selenium para a página: {url_pagina}")
@@ -115,11 +128,7 @@ def extrair_e_baixar_documentos_com_selenium(url_pagina, base_url, pasta_downloa
         print(f"  -> {len(documentos_existentes)} documentos já existem na pasta id_{id_pagina}")
 
         # Processar cada linha da tabela
-        session = requests.Session()
-        # Adicionar headers para parecer um browser real no requests
-        session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        })
+        session = get_session()
 
         documentos_baixados = 0
         documentos_pulados = 0
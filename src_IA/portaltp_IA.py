@@ -7,6 +7,7 @@ from datetime import datetime
 from urllib.parse import urlparse
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
 
 def normalizar_url(url):
     url = url.strip()
@@ -14,12 +15,43 @@ def normalizar_url(url):
         url = 'https://' + url.strip().lstrip('/')
     return url.rstrip('/')
 
+# Pool de conexões: hosts mantidos (um pool por prefeitura) e conexões por host
+POOL_HOSTS = 100
+POOL_POR_HOST = 2
+
+_session = None
+
 def get_retry_session():
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=2, status_forcelist=[500, 502, 503, 504])
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    return session
+    """Sessão única do processo: as conexões (e o TLS) abertas numa execução servem às seguintes"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        # gzip/deflate, e br quando o urllib3 consegue decodificar
+        _session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        retries = Retry(total=3, backoff_factor=2, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_POR_HOST, max_retries=retries)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+def estatisticas_pool(session):
+    """(requisições, conexões novas) somadas nos pools do urllib3; o resto reaproveitou conexão"""
+    requisicoes = conexoes = 0
+    # O mesmo adapter está montado em http:// e https://
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for chave in pools.keys():
+            pool = pools.get(chave)
+            if pool is not None:
+                requisicoes += pool.num_requests
+                conexoes += pool.num_connections
+    return requisicoes, conexoes
+
+def print_estatisticas_pool(session):
+    requisicoes, conexoes = estatisticas_pool(session)
+    if requisicoes:
+        print(f"\n🔌 Pool: {requisicoes - conexoes} de {requisicoes} requisições em conexões reaproveitadas, "
+              f"{conexoes} conexões novas")
 
 def main():
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -196,6 +228,7 @@ def run_extraction(data_inicio, data_fim, endpoints_file, prefeituras_file, db_f
                 sleep(1)
 
     conn.close()
+    print_estatisticas_pool(session)
     print("\n\n✅ EXTRAÇÃO CONCLUÍDA!")
 
 def run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file):
@@ -287,6 +320,7 @@ def run_failed_urls(error_log_file, endpoints_file, prefeituras_file, db_file):
         sleep(1)
 
     conn.close()
+    print_estatisticas_pool(session)
     os.replace(temp_error_file, error_log_file)
     print(f"\n✅ Concluído! {success_count}/{len(failed_urls)} URLs reprocessadas com sucesso.")
 
@@ -0,0 +1,70 @@
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from achatador import PlanoCampos
+
+def antigo(registros):
+    """Achatamento de antes do plano: json_normalize e json.dumps nas listas"""
+    df = pd.json_normalize(registros, sep='_')
+    for coluna in df.columns:
+        df[coluna] = df[coluna].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, list) else v)
+    return df
+
+def valores(df):
+    linhas = df.astype(object).where(df.notna(), None).values.tolist()
+    return [[float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v for v in linha]
+            for linha in linhas]
+
+def comparar(registros):
+    plano = PlanoCampos()
+    novo = pd.DataFrame(plano.linhas(registros), columns=plano.colunas)
+    velho = antigo(registros)
+    assert list(novo.columns) == list(velho.columns)
+    assert valores(novo) == valores(velho)
+
+CASOS = [
+    [{'a': 1, 'b': {'c': 2, 'd': [1, 'ã']}, 'e': None}],
+    # Campo novo no meio do lote e registro sem os campos anteriores
+    [{'a': 1}, {'a': 2, 'b': {'c': [1]}}, {'b': {'c': 5, 'x': {'y': [{'k': 'é'}]}}}],
+    # Dicionário vazio não gera coluna; depois a mesma chave vem como dicionário e como texto
+    [{'a': {}}, {'a': {'b': 1}}, {'a': 's'}, {'z': []}],
+    # null explícito gera a coluna; chave ausente não
+    [{'a': None, 'b': {'c': None}}, {'d': 1}],
+]
+
+@pytest.mark.parametrize('registros', CASOS)
+def test_mesmo_resultado_do_json_normalize(registros):
+    comparar(registros)
+
+def valor_aleatorio(sorteio, nivel):
+    r = sorteio.random()
+    if nivel < 2 and r < 0.3:
+        return {sorteio.choice('pqr'): valor_aleatorio(sorteio, nivel + 1) for _ in range(sorteio.randint(0, 3))}
+    if r < 0.45:
+        return [sorteio.randint(0, 3), {'w': 'ç'}]
+    if r < 0.55:
+        return None
+    if r < 0.6:
+        return {}
+    return sorteio.choice([1, 2.5, 't', True])
+
+def test_registros_aleatorios_iguais_ao_json_normalize():
+    sorteio = random.Random(1)
+    for _ in range(300):
+        registros = [{sorteio.choice('abcde'): valor_aleatorio(sorteio, 0) for _ in range(sorteio.randint(0, 4))}
+                     for _ in range(sorteio.randint(1, 6))]
+        comparar(registros)
+
+def test_plano_reaproveitado_entre_respostas():
+    plano = PlanoCampos()
+    plano.linhas([{'a': 1}])
+    assert plano.linhas([{'a': 2, 'b': {'c': [1]}}, {'a': 3}]) == [(2, '[1]'), (3, None)]
+    assert plano.colunas == ['a', 'b_c']
+
+def test_caminhos_com_o_mesmo_nome_dao_uma_coluna():
+    plano = PlanoCampos()
+    assert plano.linhas([{'a_b': 1, 'a': {'b': 2}}, {'a_b': 3}, {'a': {'b': 4}}]) == [(2,), (3,), (4,)]
+    assert plano.colunas == ['a_b']
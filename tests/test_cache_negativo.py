@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from cache_negativo import vazio_em_dia
+
+HOJE = datetime(2026, 10, 18)
+
+def test_mes_vazio_ainda_aberto_vence_mesmo_depois_de_antigo():
+    # Set/2025 era o mês corrente quando veio vazio: vale um dia, não para sempre
+    assert not vazio_em_dia('2025-09-02 10:00:00', 2025, 9, hoje=HOJE)
+
+def test_mes_ja_fechado_quando_veio_vazio_e_permanente():
+    assert vazio_em_dia('2025-09-02 10:00:00', 2024, 1, hoje=HOJE)
+
+def test_faixa_intermediaria_conta_a_partir_do_registro():
+    # 2 meses de idade no registro: vale 7 dias a partir dele
+    assert vazio_em_dia('2026-10-15 10:00:00', 2026, 8, hoje=HOJE)
+    assert not vazio_em_dia('2026-10-01 10:00:00', 2026, 8, hoje=HOJE)
+
+def test_ano_da_tectrilha_conta_a_partir_de_dezembro():
+    assert vazio_em_dia('2026-10-17 12:00:00', 2025, hoje=HOJE)
+    assert not vazio_em_dia('2025-12-20 12:00:00', 2025, hoje=HOJE)
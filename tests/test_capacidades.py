@@ -0,0 +1,48 @@
+import sqlite3
+from datetime import datetime
+
+from banco import criar_ledger, SQL_LEDGER, linha_ledger, STATUS_OK, STATUS_ERRO
+from capacidades import (matriz_capacidades, periodos_permitidos, SUPORTADO, SEM_SUPORTE, DESCONHECIDO,
+                         RECHECAGEM_DIAS)
+from nucleo_http import ErroHTTP, Resposta
+
+PERIODOS = ['2024-01', '2024-02', '2024-03']
+
+def registrar(conn, host, endpoint, mes, status, erro=None):
+    job = {'vendor': 'portaltp', 'endpoint_name': endpoint, 'host': host, 'periodo': f"2024-{mes:02d}",
+           'url': f"http://{host}/api/{endpoint}?mes={mes}", 'municipio': host, 'prefeitura': host}
+    resposta = Resposta(job['url'], 200, {}, b'[]', 1.0) if status == STATUS_OK else None
+    conn.execute(SQL_LEDGER, linha_ledger(job, status, resposta, erro, 0 if resposta else None))
+
+def ledger():
+    conn = sqlite3.connect(':memory:')
+    criar_ledger(conn)
+    registrar(conn, 'a.gov.br', 'despesas', 1, STATUS_OK)
+    registrar(conn, 'a.gov.br', 'despesas', 2, STATUS_ERRO, ErroHTTP(404, 'x'))
+    for mes in (1, 2):
+        registrar(conn, 'a.gov.br', 'bens', mes, STATUS_ERRO, ErroHTTP(404, 'x'))
+    registrar(conn, 'a.gov.br', 'obras', 1, STATUS_ERRO, ErroHTTP(404, 'x'))
+    for mes in (1, 2):
+        registrar(conn, 'a.gov.br', 'lento', mes, STATUS_ERRO, TimeoutError())
+    return conn
+
+def test_matriz_pelo_ledger():
+    matriz = matriz_capacidades(ledger(), 'portaltp')
+    assert matriz[('a.gov.br', 'despesas')] == (SUPORTADO, None)
+    assert matriz[('a.gov.br', 'bens')][0] == SEM_SUPORTE
+    # Uma recusa só ainda não decide; timeout não diz nada sobre o endpoint existir
+    assert matriz[('a.gov.br', 'obras')][0] == DESCONHECIDO
+    assert ('a.gov.br', 'lento') not in matriz
+
+def test_sem_suporte_sai_do_plano_ate_a_rechecagem():
+    conn = ledger()
+    matriz = matriz_capacidades(conn, 'portaltp')
+    assert periodos_permitidos(matriz, 'a.gov.br', 'bens', PERIODOS) == []
+    assert periodos_permitidos(matriz, 'a.gov.br', 'obras', PERIODOS) == PERIODOS
+    assert periodos_permitidos(matriz, 'b.gov.br', 'bens', PERIODOS) == PERIODOS
+
+    antiga = datetime.fromordinal(datetime.now().toordinal() - RECHECAGEM_DIAS - 1).strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute("UPDATE crawl_jobs SET atualizado_em = ? WHERE endpoint = 'bens'", (antiga,))
+    matriz = matriz_capacidades(conn, 'portaltp')
+    # Rechecagem vencida: só o último período vai, como sonda
+    assert periodos_permitidos(matriz, 'a.gov.br', 'bens', PERIODOS) == PERIODOS[-1:]
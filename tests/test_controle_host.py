@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import controle_host
+from controle_host import BaldeTokens, Disjuntor, DisjuntoresHosts
+from nucleo_http import executar_jobs
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(controle_host, 'monotonic', relogio)
+    return relogio
+
+def test_balde_sobe_devagar_e_cai_pela_metade(relogio):
+    balde = BaldeTokens(taxa=2.0)
+    balde.registrar(200, latencia=0.1)
+    assert balde.taxa == 2.0 + controle_host.INCREMENTO
+    balde.registrar(503, latencia=0.1)
+    assert balde.taxa == (2.0 + controle_host.INCREMENTO) * controle_host.FATOR_REDUCAO
+    assert balde.tokens <= 0
+    for _ in range(20):
+        balde.registrar(None)
+    assert balde.taxa == controle_host.TAXA_MINIMA
+
+def test_balde_nao_sobe_com_host_lento(relogio):
+    balde = BaldeTokens(taxa=2.0)
+    for _ in range(10):
+        balde.registrar(200, latencia=controle_host.LATENCIA_ALVO * 3)
+    assert balde.taxa < 2.0 + 10 * controle_host.INCREMENTO
+
+def test_retry_after_pausa_o_host(relogio):
+    balde = BaldeTokens()
+    balde.registrar(429, retry_after=30)
+    assert balde.pausado_ate == relogio.agora + 30
+
+def test_interpretar_retry_after():
+    assert controle_host.interpretar_retry_after('12') == 12.0
+    assert controle_host.interpretar_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert controle_host.interpretar_retry_after('amanhã') is None
+
+def test_disjuntor_abre_sonda_e_fecha(relogio):
+    disjuntor = Disjuntor(falhas_para_abrir=3, espera=60)
+    for _ in range(3):
+        assert disjuntor.permitir()
+        disjuntor.registrar_falha_conexao()
+    assert disjuntor.estado == Disjuntor.ABERTO
+    assert not disjuntor.permitir()
+    assert disjuntor.espera_restante() == 60
+
+    relogio.agora += 60
+    assert disjuntor.espera_restante() == 0
+    assert disjuntor.permitir()  # a sonda
+    assert disjuntor.estado == Disjuntor.SEMIABERTO
+    assert not disjuntor.permitir()  # só uma sonda por vez
+    assert disjuntor.espera_restante() is None
+
+    disjuntor.registrar_sucesso()
+    assert disjuntor.estado == Disjuntor.FECHADO
+    assert disjuntor.permitir()
+
+def test_sonda_que_falha_dobra_a_espera(relogio):
+    disjuntor = Disjuntor(falhas_para_abrir=1, espera=60)
+    disjuntor.registrar_falha_conexao()
+    relogio.agora += 60
+    assert disjuntor.permitir()
+    disjuntor.registrar_falha_conexao()
+    assert disjuntor.estado == Disjuntor.ABERTO
+    assert disjuntor.espera_restante() == 120
+
+def test_host_com_disjuntor_aberto_espera_a_sonda_enquanto_ha_outro_trabalho():
+    disjuntores = DisjuntoresHosts(falhas_para_abrir=1, espera=0.2)
+    disjuntores.registrar_falha_conexao('morto.gov.br')
+    ordem = []
+
+    async def processar(job):
+        if job['host'] == 'morto.gov.br':
+            permitiu = disjuntores.permitir(job['host'])
+            ordem.append((job['host'], permitiu))
+            if permitiu:
+                disjuntores.registrar_sucesso(job['host'])
+        else:
+            await asyncio.sleep(0.05)
+            ordem.append((job['host'], True))
+
+    jobs = [{'host': 'morto.gov.br'}] * 3 + [{'host': 'vivo.gov.br'}] * 8
+    asyncio.run(executar_jobs(jobs, processar, 2, 1, disjuntores=disjuntores))
+    # Nenhum job do host foi gasto com o disjuntor aberto: depois da espera a sonda passou e o resto seguiu
+    assert [permitiu for host, permitiu in ordem if host == 'morto.gov.br'] == [True, True, True]
+    assert ordem[0] == ('vivo.gov.br', True)
+
+def test_sem_outro_trabalho_os_jobs_do_host_aberto_sao_liberados():
+    disjuntores = DisjuntoresHosts(falhas_para_abrir=1, espera=3600)
+    disjuntores.registrar_falha_conexao('morto.gov.br')
+    vistos = []
+
+    async def processar(job):
+        vistos.append(disjuntores.permitir(job['host']))
+
+    asyncio.run(asyncio.wait_for(executar_jobs([{'host': 'morto.gov.br'}] * 3, processar, 2, 1,
+                                               disjuntores=disjuntores), 5))
+    assert vistos == [False, False, False]
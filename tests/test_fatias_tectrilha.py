@@ -0,0 +1,43 @@
+import asyncio
+import json
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+import tectrilha
+from nucleo_http import Resposta
+
+class ClienteFalso:
+    """Portal de mentira: cada fatia responde as linhas do mês, ou o ano todo se ignora o periodo"""
+    def __init__(self, ignora_periodo=False, meses_vazios=()):
+        self.ignora_periodo = ignora_periodo
+        self.meses_vazios = meses_vazios
+        self.arquivo = None
+        self.arquivadas = []
+
+    async def get(self, url, timeout=None, cabecalhos=None, arquivar=True):
+        self.arquivadas.append(arquivar)
+        mes = int(parse_qs(urlparse(url).query)['periodo'][0])
+        if mes in self.meses_vazios:
+            return Resposta(url, 200, {}, b'', 1.0)
+        linhas = [{'mes': m} for m in range(1, 13)] if self.ignora_periodo else [{'mes': mes}]
+        return Resposta(url, 200, {}, json.dumps(linhas).encode(), 1.0)
+
+JOB = {'url': 'http://portal.gov.br/api/pessoal?exercicio=2024&periodo='}
+
+def baixar(cliente):
+    return asyncio.run(tectrilha.baixar_fatiado(cliente, dict(JOB), 30))
+
+def test_fatias_costuradas_na_ordem_sem_arquivar_as_partes():
+    cliente = ClienteFalso(meses_vazios=(2, 3))
+    resposta = baixar(cliente)
+    assert [linha['mes'] for linha in json.loads(resposta.content)] == [1] + list(range(4, 13))
+    assert cliente.arquivadas == [False] * len(tectrilha.FATIAS_ANO)
+
+def test_portal_que_ignora_o_periodo_falha_o_job():
+    with pytest.raises(tectrilha.FatiasIguais):
+        baixar(ClienteFalso(ignora_periodo=True))
+
+def test_uma_fatia_so_com_linhas_nao_e_repeticao():
+    resposta = baixar(ClienteFalso(meses_vazios=range(2, 13)))
+    assert json.loads(resposta.content) == [{'mes': 1}]
@@ -0,0 +1,43 @@
+import codecs
+import json
+import random
+
+import pytest
+
+from fluxo_json import DecodificadorArray
+
+def decodificar(corpo, tamanho):
+    decodificador = DecodificadorArray()
+    elementos = []
+    for inicio in range(0, len(corpo), tamanho):
+        elementos.extend(decodificador.alimentar(corpo[inicio:inicio + tamanho]))
+    return elementos + decodificador.finalizar()
+
+DADOS = [{'nome': 'Conceição', 'valor': 1234.5e-3, 'itens': [1, -20, {'x': None}]}, 12345, -0.5, 'texto, com ]',
+         True, None, [], {}]
+
+@pytest.mark.parametrize('tamanho', [1, 2, 3, 7, 64, 10 ** 6])
+def test_qualquer_corte_dos_pedacos_da_o_mesmo_array(tamanho):
+    corpo = codecs.BOM_UTF8 + json.dumps(DADOS, ensure_ascii=False, indent=1).encode('utf-8')
+    assert decodificar(corpo, tamanho) == DADOS
+
+def test_pedacos_aleatorios():
+    sorteio = random.Random(3)
+    corpo = json.dumps([{'i': i, 'v': sorteio.random() * 10 ** sorteio.randint(-3, 9)} for i in range(300)]).encode()
+    for _ in range(50):
+        assert decodificar(corpo, sorteio.randint(1, 50)) == json.loads(corpo)
+
+@pytest.mark.parametrize('corpo, esperado', [
+    (b'', []),
+    (b'  \n', []),
+    (b'[]', []),
+    (b'{"a": 1}', [{'a': 1}]),
+    (b'42', [42]),
+])
+def test_corpo_que_nao_e_array_de_objetos(corpo, esperado):
+    assert decodificar(corpo, 1) == esperado
+
+@pytest.mark.parametrize('corpo', [b'[{"a": 1}, {"a":', b'[1 2]', b'[1] [2]'])
+def test_json_incompleto_ou_invalido(corpo):
+    with pytest.raises(ValueError):
+        decodificar(corpo, 3)
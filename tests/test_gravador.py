@@ -0,0 +1,73 @@
+import asyncio
+import sqlite3
+
+import pandas as pd
+
+from banco import criar_ledger, STATUS_OK, STATUS_ERRO
+from gravador import GravadorSQLite
+from nucleo_http import Resposta
+
+def job(mes):
+    return {'vendor': 'portaltp', 'endpoint_name': 'despesas', 'host': 'a.gov.br', 'periodo': f"2024-{mes:02d}",
+            'url': f"http://a.gov.br/api/despesas?mes={mes:02d}", 'municipio': 'a', 'prefeitura': 'P A'}
+
+def banco(tmp_path):
+    db_file = str(tmp_path / 'teste.db')
+    conn = sqlite3.connect(db_file)
+    criar_ledger(conn)
+    conn.execute('CREATE TABLE despesas (valor NOT NULL, mes)')
+    conn.commit()
+    conn.close()
+    return db_file
+
+def gravar(db_file, envios):
+    async def enviar_todos(gravador):
+        for trabalho, kwargs in envios:
+            await gravador.enviar(trabalho, STATUS_OK, resposta=Resposta(trabalho['url'], 200, {}, b'[]', 1.0),
+                                  tabela='despesas', **kwargs)
+    with GravadorSQLite(db_file) as gravador:
+        asyncio.run(enviar_todos(gravador))
+    conn = sqlite3.connect(db_file)
+    status = dict(conn.execute('SELECT periodo, status FROM crawl_jobs').fetchall())
+    linhas = conn.execute('SELECT mes FROM despesas ORDER BY mes').fetchall()
+    return status, linhas
+
+def test_so_o_job_que_falha_fica_com_erro(tmp_path):
+    status, linhas = gravar(banco(tmp_path), [
+        (job(1), {'df': pd.DataFrame({'valor': [1.0], 'mes': [1]})}),
+        (job(2), {'df': pd.DataFrame({'valor': [None], 'mes': [2]})}),
+        (job(3), {'df': pd.DataFrame({'valor': [3.0], 'mes': [3]})}),
+    ])
+    assert status == {'2024-01': STATUS_OK, '2024-02': STATUS_ERRO, '2024-03': STATUS_OK}
+    assert linhas == [(1,), (3,)]
+
+def test_lotes_anteriores_do_periodo_sao_apagados_quando_um_falha(tmp_path):
+    db_file = banco(tmp_path)
+    chave = {'mes': 2}
+
+    async def em_fluxo(gravador):
+        await gravador.enviar(job(2), tabela='despesas', df=pd.DataFrame({'valor': [1.0], 'mes': [2]}),
+                              chave=chave, limpar=True)
+        await gravador.enviar(job(2), STATUS_OK, tabela='despesas', df=pd.DataFrame({'valor': [None], 'mes': [2]}),
+                              chave=chave)
+    # Uma linha por transação: o primeiro lote é confirmado antes do segundo falhar
+    with GravadorSQLite(db_file, linhas_por_transacao=1) as gravador:
+        asyncio.run(em_fluxo(gravador))
+    conn = sqlite3.connect(db_file)
+    assert conn.execute('SELECT count(*) FROM despesas').fetchone() == (0,)
+    assert conn.execute('SELECT status FROM crawl_jobs').fetchone() == (STATUS_ERRO,)
+
+def test_falha_ao_registrar_o_erro_nao_derruba_a_thread(tmp_path):
+    db_file = banco(tmp_path)
+    conn = sqlite3.connect(db_file)
+    # O ledger recusa a linha de erro, como um banco travado ou disco cheio na hora de registrar a falha
+    conn.execute(f"""CREATE TRIGGER recusa_erro BEFORE INSERT ON crawl_jobs WHEN NEW.status = '{STATUS_ERRO}'
+                     BEGIN SELECT RAISE(ABORT, 'disco cheio'); END""")
+    conn.commit()
+    conn.close()
+    status, linhas = gravar(db_file, [
+        (job(1), {'df': pd.DataFrame({'valor': [None], 'mes': [1]})}),
+        (job(2), {'df': pd.DataFrame({'valor': [2.0], 'mes': [2]})}),
+    ])
+    assert status == {'2024-02': STATUS_OK}
+    assert linhas == [(2,)]
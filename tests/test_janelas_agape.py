@@ -0,0 +1,91 @@
+import asyncio
+import importlib
+import json
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from nucleo_http import ErroHTTP, Resposta
+
+agape = importlib.import_module('agape&alphatec')
+
+LINHAS = [{'i': i} for i in range(450)]
+
+class ClienteFalso:
+    """Portal de mentira: o mês inteiro responde erro_mes; as páginas, erro_pagina ou as linhas"""
+    def __init__(self, erro_mes=None, erro_pagina=None):
+        self.erro_mes = erro_mes
+        self.erro_pagina = erro_pagina
+        self.arquivo = None
+        self.pedidos = []
+
+    async def get(self, url, timeout=None, cabecalhos=None, arquivar=True):
+        self.pedidos.append((url, arquivar))
+        consulta = parse_qs(urlparse(url).query)
+        if agape.PARAM_PAGINA not in consulta:
+            if self.erro_mes:
+                raise self.erro_mes
+            return Resposta(url, 200, {}, json.dumps(LINHAS).encode(), 1.0)
+        if self.erro_pagina:
+            raise self.erro_pagina
+        pagina, tamanho = int(consulta[agape.PARAM_PAGINA][0]), int(consulta[agape.PARAM_TAMANHO][0])
+        corpo = json.dumps(LINHAS[(pagina - 1) * tamanho:pagina * tamanho]).encode()
+        return Resposta(url, 200, {}, corpo, 1.0)
+
+@pytest.fixture(autouse=True)
+def janelas_limpas():
+    agape.JANELAS_EM_USO.clear()
+    yield
+    agape.JANELAS_EM_USO.clear()
+
+def job(janela=None):
+    novo = agape.montar_job('http://portal.gov.br/api/servidores?mes=01', 'servidores', 'a', 'P A', 2024, 1)
+    if janela:
+        novo['janela'] = janela
+    return novo
+
+def baixar(cliente, job):
+    return asyncio.run(agape.baixar_mes(cliente, job, 30, None, 'teste'))
+
+def test_paginas_nao_sao_arquivadas():
+    cliente = ClienteFalso(erro_mes=ErroHTTP(500, 'mes'))
+    trabalho = job()
+    resposta = baixar(cliente, trabalho)
+    assert trabalho['janela'] == 'pagina:1000'
+    assert json.loads(resposta.content) == LINHAS
+    assert [arquivar for url, arquivar in cliente.pedidos if agape.PARAM_PAGINA in url] == [False]
+
+def test_portal_sem_paginacao_fica_com_o_erro_do_mes():
+    erro = ErroHTTP(503, 'mes')
+    cliente = ClienteFalso(erro_mes=erro, erro_pagina=ErroHTTP(400, 'pagina'))
+    with pytest.raises(ErroHTTP) as excinfo:
+        baixar(cliente, job())
+    assert excinfo.value is erro
+
+def test_janela_aprendida_recusada_volta_ao_mes_inteiro():
+    cliente = ClienteFalso(erro_pagina=ErroHTTP(404, 'pagina'))
+    trabalho = job('pagina:200')
+    baixar(cliente, trabalho)
+    assert trabalho['janela'] == 'mes'
+
+def test_janela_volta_a_crescer_depois_de_uma_sequencia_de_sucessos():
+    cliente = ClienteFalso()
+    for _ in range(agape.SUCESSOS_PARA_SUBIR):
+        trabalho = job('pagina:200')
+        baixar(cliente, trabalho)
+        assert trabalho['janela'] == 'pagina:200'
+    sonda = job('pagina:200')
+    baixar(cliente, sonda)
+    assert sonda['janela'] == 'pagina:1000'
+    seguinte = job('pagina:200')
+    baixar(cliente, seguinte)
+    assert seguinte['janela'] == 'pagina:1000'
+
+def test_sonda_que_falha_mantem_a_janela_menor():
+    cliente = ClienteFalso()
+    agape.JANELAS_EM_USO[('portal.gov.br', 'servidores')] = [1, agape.SUCESSOS_PARA_SUBIR]
+    cliente.erro_mes = ErroHTTP(500, 'mes')
+    trabalho = job()
+    baixar(cliente, trabalho)
+    assert trabalho['janela'] == 'pagina:1000'
+    assert agape.JANELAS_EM_USO[('portal.gov.br', 'servidores')] == [1, 1]
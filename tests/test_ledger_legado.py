@@ -0,0 +1,28 @@
+import sqlite3
+
+from banco import criar_ledger, importar_log_legado, SQL_LEDGER, linha_ledger, STATUS_OK, STATUS_ERRO
+from nucleo_http import Resposta
+
+def job_da_url(url):
+    mes = int(url.rsplit('=', 1)[1])
+    return {'vendor': 'portaltp', 'endpoint_name': 'despesas', 'host': 'a.gov.br', 'periodo': f"2023-{mes:02d}",
+            'url': url, 'municipio': 'a', 'prefeitura': 'P A'}
+
+def test_vale_a_falha_mais_recente_do_log_e_o_ledger_mais_novo(tmp_path):
+    conn = sqlite3.connect(':memory:')
+    criar_ledger(conn)
+    # Maio falhou no log e depois deu certo (ledger, com a data de agora)
+    conn.execute(SQL_LEDGER, linha_ledger(job_da_url('http://a.gov.br/api?mes=5'), STATUS_OK,
+                                          Resposta('http://a.gov.br/api?mes=5', 200, {}, b'[]', 1.0), linhas=0))
+    log = tmp_path / 'erros.log'
+    log.write_text(
+        '2024-01-01 10:00:00|http://a.gov.br/api?mes=5|HTTPError|500 Server Error: x\n'
+        '2024-01-01 10:00:00|http://a.gov.br/api?mes=6|HTTPError|500 Server Error: x\n'
+        '2024-02-01 10:00:00|http://a.gov.br/api?mes=6|HTTPError|404 Client Error: nf\n',
+        encoding='utf-8')
+
+    assert importar_log_legado(conn, str(log), job_da_url) == 3
+    linhas = dict((periodo, resto) for periodo, *resto in conn.execute(
+        'SELECT periodo, status, erro, tentativas, atualizado_em FROM crawl_jobs'))
+    assert linhas['2023-05'][0] == STATUS_OK
+    assert linhas['2023-06'] == [STATUS_ERRO, 'HTTPError: 404 Client Error: nf', 2, '2024-02-01 10:00:00']
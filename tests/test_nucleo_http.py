@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import socket
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from controle_host import LimitadorHosts, DisjuntoresHosts, CircuitoAberto
+from nucleo_http import (ClienteHTTP, ErroHTTP, LeituraInterrompida, Prazo, falha_por_tamanho, TIMEOUT_CONEXAO,
+                         host_da_url)
+
+def rodar(respostas, teste):
+    """Sobe um servidor que responde (status, corpo) na ordem dada e roda teste(cliente, url, pedidos)"""
+    pedidos = []
+
+    async def responder(request):
+        pedidos.append(request.path_qs)
+        status, corpo = respostas[min(len(pedidos), len(respostas)) - 1]
+        return web.Response(status=status, body=corpo)
+
+    async def principal():
+        app = web.Application()
+        app.router.add_get('/{caminho:.*}', responder)
+        async with TestServer(app) as servidor:
+            async with ClienteHTTP(backoff=0, limitador=LimitadorHosts(taxa_inicial=1000)) as cliente:
+                return await teste(cliente, str(servidor.make_url('/api')), pedidos)
+    return asyncio.run(principal())
+
+def test_retentativa_em_5xx_ate_responder():
+    async def teste(cliente, url, pedidos):
+        resposta = await cliente.get(url)
+        assert (resposta.status_code, resposta.content, len(pedidos)) == (200, b'[1]', 3)
+        assert resposta.hash == hashlib.sha256(b'[1]').hexdigest()
+    rodar([(503, b''), (500, b''), (200, b'[1]')], teste)
+
+def test_4xx_nao_e_tentado_de_novo():
+    async def teste(cliente, url, pedidos):
+        with pytest.raises(ErroHTTP) as excinfo:
+            await cliente.get(url)
+        assert excinfo.value.status == 404 and len(pedidos) == 1
+    rodar([(404, b'')], teste)
+
+def test_5xx_que_persiste_vira_erro_depois_das_tentativas():
+    async def teste(cliente, url, pedidos):
+        with pytest.raises(ErroHTTP) as excinfo:
+            await cliente.get(url)
+        assert excinfo.value.status == 503 and len(pedidos) == cliente.tentativas + 1
+        assert falha_por_tamanho(excinfo.value)
+    rodar([(503, b'')], teste)
+
+def test_leitura_em_fluxo_entrega_os_pedacos():
+    corpo = b'x' * 100000
+
+    async def teste(cliente, url, pedidos):
+        recebidos = []
+
+        async def ao_receber(pedaco):
+            recebidos.append(pedaco)
+        resposta = await cliente.get_stream(url, ao_receber, tamanho_pedaco=4096)
+        assert b''.join(recebidos) == corpo and len(recebidos) > 1
+        assert (resposta.content, resposta.tamanho, resposta.hash) == (None, len(corpo),
+                                                                        hashlib.sha256(corpo).hexdigest())
+    rodar([(200, corpo)], teste)
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def test_host_fora_do_ar_abre_o_disjuntor():
+    url = f"http://127.0.0.1:{porta_livre()}/api"
+    disjuntores = DisjuntoresHosts(falhas_para_abrir=2, espera=3600)
+
+    async def principal():
+        async with ClienteHTTP(backoff=0, disjuntores=disjuntores) as cliente:
+            # 1ª tentativa e 1ª retentativa falham na conexão; a 2ª retentativa já encontra o disjuntor aberto
+            with pytest.raises(CircuitoAberto):
+                await cliente.get(url)
+            with pytest.raises(CircuitoAberto):
+                await cliente.get(url)
+    asyncio.run(principal())
+    assert disjuntores.disjuntor(host_da_url(url)).falhas == 2
+
+def test_prazo_de_timeout_unico():
+    assert (Prazo.de(60).conexao, Prazo.de(60).leitura) == (TIMEOUT_CONEXAO, 60)
+    assert (Prazo.de(5).conexao, Prazo.de(5).leitura) == (5, 5)
+    prazo = Prazo(3, 90)
+    assert Prazo.de(prazo) is prazo
+
+@pytest.mark.parametrize('erro, esperado', [
+    (ErroHTTP(502, 'x'), True),
+    (ErroHTTP(404, 'x'), False),
+    (asyncio.TimeoutError(), True),
+    (LeituraInterrompida('cortou'), True),
+    (aiohttp.ClientPayloadError('cortou'), True),
+    (aiohttp.ConnectionTimeoutError('conexão'), False),
+    (ValueError('json'), False),
+])
+def test_falha_por_tamanho(erro, esperado):
+    assert falha_por_tamanho(erro) == esperado
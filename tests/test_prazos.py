@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from banco import STATUS_ERRO
+from prazos import (PrazosAprendidos, pares_com_estouro, FOLGA_ESTOURO, FOLGA_LEITURA, LEITURA_MINIMA,
+                    MIN_AMOSTRAS)
+
+AGORA = datetime(2026, 10, 18)
+
+def falha(endpoint, erro, atualizado_em='2026-10-10 12:00:00'):
+    return {'host': 'a.gov.br', 'endpoint_name': endpoint, 'status': STATUS_ERRO, 'erro': erro,
+            'http_status': None, 'atualizado_em': atualizado_em}
+
+def test_so_timeout_de_leitura_recente_amplia_o_prazo():
+    falhas = [
+        falha('lento', 'ServerTimeoutError: Timeout on reading data from socket'),
+        falha('total', 'TimeoutError: '),
+        falha('fora_do_ar', 'ConnectionTimeoutError: Connection timeout to host http://a.gov.br'),
+        falha('antigo', 'TimeoutError: ', atualizado_em='2026-08-01 12:00:00'),
+        falha('quebrado', 'ErroHTTP: 500 Internal Server Error for url: http://a.gov.br'),
+    ]
+    assert pares_com_estouro(falhas, AGORA) == {('a.gov.br', 'lento'), ('a.gov.br', 'total')}
+
+def test_prazo_aprendido_e_ampliado_no_par_que_estourou():
+    latencias = [('a.gov.br', 'pesado', 20.0)] * MIN_AMOSTRAS + [('a.gov.br', 'leve', 0.5)] * MIN_AMOSTRAS
+    prazos = PrazosAprendidos(latencias, 30, estouros={('a.gov.br', 'pesado')})
+    leve = prazos.para({'host': 'a.gov.br', 'endpoint_name': 'leve'})
+    pesado = prazos.para({'host': 'a.gov.br', 'endpoint_name': 'pesado'})
+    assert leve.leitura == LEITURA_MINIMA
+    assert pesado.leitura == FOLGA_ESTOURO * FOLGA_LEITURA * 20.0
+
+def test_par_sem_historico_usa_o_padrao():
+    prazos = PrazosAprendidos([], 30)
+    prazo = prazos.para({'host': 'b.gov.br', 'endpoint_name': 'x'})
+    assert (prazo.conexao, prazo.leitura) == (prazos.padrao.conexao, 30)
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from banco import (criar_ledger, SQL_LEDGER, linha_ledger, STATUS_OK, STATUS_ERRO, STATUS_ADIADO, STATUS_PARCIAL,
+                   STATUS_DESCARTADO)
+from nucleo_http import ErroHTTP, Resposta
+from retentativas import classificar_falha, falha_registrada_por_tamanho, triagem, reprocessar_falhas
+
+def falha(erro=None, http_status=None, status=STATUS_ERRO, host='a.gov.br'):
+    return {'status': status, 'erro': erro, 'http_status': http_status, 'host': host}
+
+@pytest.mark.parametrize('registro, esperado', [
+    (falha('ErroHTTP: 404 Not Found for url: x', 404), ('HTTP 404', True)),
+    (falha('ErroHTTP: 503 Service Unavailable for url: x', 503), ('HTTP 503', False)),
+    # Log antigo: o status só aparece no texto
+    (falha('HTTPError: 400 Client Error: Bad Request'), ('HTTP 400', True)),
+    (falha('Erro: OperationalError - too many columns'), ('OperationalError', True)),
+    (falha('ServerTimeoutError: Timeout on reading data from socket'), ('ServerTimeoutError', False)),
+    (falha('ClientConnectorError: Cannot connect to host'), ('ClientConnectorError', False)),
+    (falha('CircuitoAberto: ...', status=STATUS_ADIADO), ('CircuitoAberto', False)),
+    (falha(None, status=STATUS_PARCIAL), ('LeituraInterrompida', False)),
+    (falha('algo estranho'), ('Desconhecido', False)),
+])
+def test_classificar_falha(registro, esperado):
+    assert classificar_falha(registro) == esperado
+
+def test_falha_por_tamanho_exclui_conexao_e_4xx():
+    assert falha_registrada_por_tamanho(falha('TimeoutError: ', None))
+    assert falha_registrada_por_tamanho(falha('ErroHTTP: 502 Bad Gateway', 502))
+    assert falha_registrada_por_tamanho(falha(None, status=STATUS_PARCIAL))
+    assert not falha_registrada_por_tamanho(falha('ClientConnectorError: Cannot connect'))
+    assert not falha_registrada_por_tamanho(falha('ConnectionTimeoutError: Connection timeout'))
+    assert not falha_registrada_por_tamanho(falha('ErroHTTP: 404 Not Found', 404))
+
+def test_triagem_separa_permanentes():
+    falhas = [falha('ErroHTTP: 404', 404), falha('TimeoutError: '), falha('TimeoutError: ', host='b.gov.br')]
+    transitorias, permanentes = triagem(falhas)
+    assert permanentes == falhas[:1]
+    assert transitorias == falhas[1:]
+
+def job(mes):
+    return {'vendor': 'portaltp', 'endpoint_name': 'despesas', 'host': 'a.gov.br', 'periodo': f"2024-{mes:02d}",
+            'url': f"http://a.gov.br/api?mes={mes}", 'municipio': 'a', 'prefeitura': 'P A'}
+
+def test_reprocessar_descarta_permanentes_e_para_quando_nada_se_recupera():
+    conn = sqlite3.connect(':memory:')
+    criar_ledger(conn)
+    conn.execute(SQL_LEDGER, linha_ledger(job(1), STATUS_ERRO, erro=ErroHTTP(404, 'x')))
+    conn.execute(SQL_LEDGER, linha_ledger(job(2), STATUS_ERRO, erro=TimeoutError()))
+    conn.execute(SQL_LEDGER, linha_ledger(job(3), STATUS_ERRO, erro=TimeoutError()))
+    rodadas = []
+
+    def executar(jobs):
+        rodadas.append(sorted(j['periodo'] for j in jobs))
+        for j in jobs:
+            assert j['revalidar'] and 'status' not in j
+            if j['periodo'] == '2024-02':
+                conn.execute(SQL_LEDGER, linha_ledger(j, STATUS_OK, Resposta(j['url'], 200, {}, b'[]', 1.0), linhas=0))
+            else:
+                conn.execute(SQL_LEDGER, linha_ledger(j, STATUS_ERRO, erro=TimeoutError()))
+
+    assert reprocessar_falhas(conn, 'portaltp', executar, rodadas=3, espera=0) == (3, 1, 1)
+    # 2ª rodada só com o que sobrou; a 3ª não acontece porque a 2ª não recuperou nada
+    assert rodadas == [['2024-02', '2024-03'], ['2024-03']]
+    status = dict(conn.execute('SELECT periodo, status FROM crawl_jobs'))
+    assert status == {'2024-01': STATUS_DESCARTADO, '2024-02': STATUS_OK, '2024-03': STATUS_ERRO}
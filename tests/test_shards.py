@@ -0,0 +1,59 @@
+import sqlite3
+
+import shards
+import portaltp
+import tectrilha
+from banco import criar_ledger
+from unidades_gestoras import criar_tabela
+
+def criar_shard(caminho, host, nome):
+    conn = sqlite3.connect(caminho)
+    criar_ledger(conn)
+    criar_tabela(conn)
+    conn.execute("INSERT INTO unidades_gestoras VALUES (?, '2', ?, '2024-01-01 00:00:00')", (host, nome))
+    conn.commit()
+    conn.close()
+
+def test_juntar_mantem_a_mesma_ug_de_hosts_diferentes(tmp_path):
+    criar_shard(tmp_path / 'tectrilha.0de2.db', 'guarapari.es.gov.br', 'Câmara de Guarapari')
+    criar_shard(tmp_path / 'tectrilha.1de2.db', 'vilavelha.es.gov.br', 'Câmara de Vila Velha')
+
+    conn = sqlite3.connect(tmp_path / 'tectrilha.db')
+    criar_ledger(conn)
+    for indice in range(2):
+        shards.juntar_shard(conn, str(tmp_path / f'tectrilha.{indice}de2.db'), tectrilha.CHAVES)
+    # Juntar de novo não duplica nem apaga
+    shards.juntar_shard(conn, str(tmp_path / 'tectrilha.0de2.db'), tectrilha.CHAVES)
+
+    linhas = conn.execute("SELECT host, unidadegestora, nome FROM unidades_gestoras ORDER BY host").fetchall()
+    assert linhas == [
+        ('guarapari.es.gov.br', '2', 'Câmara de Guarapari'),
+        ('vilavelha.es.gov.br', '2', 'Câmara de Vila Velha'),
+    ]
+
+def criar_shard_portaltp(caminho, mes):
+    conn = sqlite3.connect(caminho)
+    criar_ledger(conn)
+    for tabela in ('bensimoveis', 'despesas'):
+        conn.execute(f"CREATE TABLE {tabela} (municipio, prefeitura, ano, mes, valor)")
+        conn.execute(f"INSERT INTO {tabela} VALUES ('a', 'P A', 2024, ?, ?)", (mes, mes * 10))
+        conn.execute('''INSERT INTO crawl_jobs (vendor, endpoint, host, periodo, url, status, atualizado_em)
+                        VALUES ('portaltp', ?, 'a.gov.br', ?, ?, 'ok', ?)''',
+                     (tabela, f"2024-{mes:02d}", f"http://a.gov.br/api/{tabela}?mes={mes}", f"2024-{mes:02d}-01 00:00:00"))
+    conn.commit()
+    conn.close()
+
+def test_juntar_substitui_o_retrato_anterior_da_prefeitura(tmp_path):
+    criar_shard_portaltp(tmp_path / 'portaltp.0de1.db', 8)
+    conn = sqlite3.connect(tmp_path / 'portaltp.db')
+    criar_ledger(conn)
+    shards.juntar_shard(conn, str(tmp_path / 'portaltp.0de1.db'), portaltp.CHAVES, portaltp.CHAVES_SNAPSHOT)
+
+    # Execução seguinte do shard: o retrato de bensimoveis (data/snapshots.csv) veio em setembro
+    (tmp_path / 'portaltp.0de1.db').unlink()
+    criar_shard_portaltp(tmp_path / 'portaltp.0de1.db', 9)
+    shards.juntar_shard(conn, str(tmp_path / 'portaltp.0de1.db'), portaltp.CHAVES, portaltp.CHAVES_SNAPSHOT)
+
+    assert conn.execute("SELECT mes, valor FROM bensimoveis").fetchall() == [(9, 90)]
+    # Tabela por período continua acumulando os meses
+    assert conn.execute("SELECT mes FROM despesas ORDER BY mes").fetchall() == [(8,), (9,)]
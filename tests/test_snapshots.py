@@ -0,0 +1,47 @@
+import sqlite3
+
+from banco import criar_ledger, SQL_LEDGER, linha_ledger, STATUS_OK
+from nucleo_http import Resposta
+from snapshots import (endpoints_conteudo_repetido, marcar_snapshot, chave_substituicao,
+                       MIN_PERIODOS_DETECCAO, MIN_HOSTS_DETECCAO)
+
+CHAVES = ('municipio', 'prefeitura', 'ano', 'mes')
+CHAVES_SNAPSHOT = ('municipio', 'prefeitura')
+
+def registrar(conn, host, mes, corpo):
+    job = {'vendor': 'portaltp', 'endpoint_name': 'bensimoveis', 'host': host, 'periodo': f"2024-{mes:02d}",
+           'url': f"http://{host}/api/GetBensImoveis?ano=2024&mes={mes:02d}", 'municipio': host, 'prefeitura': host}
+    conn.execute(SQL_LEDGER, linha_ledger(job, STATUS_OK, Resposta(job['url'], 200, {}, corpo, 1.0), linhas=1))
+
+def ledger(corpos_por_host):
+    conn = sqlite3.connect(':memory:')
+    criar_ledger(conn)
+    for host, corpos in corpos_por_host.items():
+        for mes, corpo in enumerate(corpos, 1):
+            registrar(conn, host, mes, corpo)
+    return conn
+
+def detectados(conn):
+    return endpoints_conteudo_repetido(conn, 'portaltp', MIN_PERIODOS_DETECCAO, MIN_HOSTS_DETECCAO)
+
+def test_um_host_repetindo_nao_decide_pelo_vendor():
+    conn = ledger({
+        'quebrado.gov.br': [b'[{"a": 1}]'] * 3,
+        'b.gov.br': [b'[{"a": 1}]', b'[{"a": 2}]', b'[{"a": 3}]'],
+        'c.gov.br': [b'[{"a": 4}]', b'[{"a": 5}]', b'[{"a": 6}]'],
+    })
+    assert detectados(conn) == set()
+
+def test_host_unico_com_historico_nao_basta():
+    conn = ledger({'quebrado.gov.br': [b'[{"a": 1}]'] * 3, 'novo.gov.br': [b'[{"a": 1}]']})
+    assert detectados(conn) == set()
+
+def test_todos_os_hosts_repetindo_detecta():
+    conn = ledger({f"h{i}.gov.br": [f'[{{"a": {i}}}]'.encode()] * 3 for i in range(MIN_HOSTS_DETECCAO)})
+    assert detectados(conn) == {'bensimoveis'}
+
+def test_retrato_detectado_so_substitui_o_mes_pedido():
+    job = {'municipio': 'Vitória', 'prefeitura': 'PM Vitória', 'ano': 2024, 'mes': 6}
+    assert chave_substituicao(marcar_snapshot(dict(job)), CHAVES, CHAVES_SNAPSHOT) == \
+        {'municipio': 'Vitória', 'prefeitura': 'PM Vitória'}
+    assert chave_substituicao(marcar_snapshot(dict(job), detectado=True), CHAVES, CHAVES_SNAPSHOT) == job